@@ -1,15 +1,29 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
+from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv
+import models
+from database import SessionLocal
 
 load_dotenv()
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "fallbacksecret")
 ALGORITHM = os.environ.get("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", min(4, os.cpu_count() or 1))) # bcrypt runs outside the GIL
+AUTH_CACHE_SECONDS = float(os.environ.get("AUTH_CACHE_SECONDS", 60)) # How long a verified token is trusted without the DB
+AUTH_CACHE_SIZE = int(os.environ.get("AUTH_CACHE_SIZE", 10000))
+REQUIRE_AUTH = os.environ.get("REQUIRE_AUTH", "0") == "1" # Reject uploads without a token (history and exports always need one)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -19,6 +33,16 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# Hashing takes ~250 ms of CPU on purpose. It gets its own threads so logins neither block
+# the event loop nor queue up behind uploads in the default threadpool
+_hash_pool = ThreadPoolExecutor(max_workers=max(1, AUTH_HASH_WORKERS), thread_name_prefix="auth-hash")
+
+async def verify_password_async(plain_password, hashed_password):
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -28,3 +52,126 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+class CurrentUser:
+    """What a request needs to know about its user, kept in the token cache instead of a DB row."""
+
+    __slots__ = ("id", "email", "is_active", "is_approved")
+
+    def __init__(self, id, email, is_active, is_approved):
+        self.id = id
+        self.email = email
+        self.is_active = is_active
+        self.is_approved = is_approved
+
+class TokenCache:
+    """
+    token -> (valid until, CurrentUser), LRU-bounded. An entry never outlives the token itself,
+    and changes to a user (e.g. approval) show up after at most AUTH_CACHE_SECONDS.
+    """
+
+    def __init__(self, ttl=AUTH_CACHE_SECONDS, max_entries=AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None
+
+    def put(self, token, user, expires_at=None):
+        valid_until = time.monotonic() + self.ttl
+        if expires_at is not None:
+            valid_until = min(valid_until, time.monotonic() + (expires_at - time.time()))
+        with self._lock:
+            self._entries[token] = (valid_until, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email):
+        """Drops every cached token of a user (this process only)."""
+        with self._lock:
+            for token in [token for token, (_, user) in self._entries.items() if user.email == email]:
+                del self._entries[token]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+token_cache = TokenCache()
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
+
+def _credentials_error(detail="Could not validate credentials"):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def _load_user(email):
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == email).first()
+        if user is None:
+            return None
+        return CurrentUser(user.id, user.email, user.is_active, user.is_approved)
+    finally:
+        db.close()
+
+async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)):
+    """
+    FastAPI dependency: the CurrentUser of the bearer token. Without REQUIRE_AUTH, requests
+    without a token are served anonymously and get None; a token that is sent but invalid or
+    expired is always rejected, so a client bug never turns into anonymous use. Decoded tokens are cached for
+    AUTH_CACHE_SECONDS, so a repeat request neither decodes the JWT again nor queries the users table.
+    """
+    user = token_cache.get(token) if token else None
+    if user is None:
+        if not token:
+            if REQUIRE_AUTH:
+                raise _credentials_error("Not authenticated")
+            return None
+        user = await _verify_token(token)
+        if user is None:
+            raise _credentials_error()
+
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account disabled.")
+    if not user.is_approved:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account pending approval by Administrator.")
+    return user
+
+async def require_user(user: Optional[CurrentUser] = Depends(get_current_user)):
+    """
+    FastAPI dependency for endpoints that return stored data: always needs a signed-in user,
+    whatever REQUIRE_AUTH says, because what is returned is scoped to that user.
+    """
+    if user is None:
+        raise _credentials_error("Not authenticated")
+    return user
+
+async def _verify_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    email = payload.get("sub")
+    if not email:
+        return None
+    user = await run_in_threadpool(_load_user, email)
+    if user is not None:
+        token_cache.put(token, user, expires_at=payload.get("exp"))
+    return user
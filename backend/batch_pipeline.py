@@ -0,0 +1,336 @@
+import asyncio
+import functools
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import datetime
+
+import drawing_store
+import ingest
+import metrics
+import result_cache
+
+# --- CONFIGURATION ---
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4)) # Drawings extracted at once, across all batches
+BATCH_FILE_TIMEOUT = float(os.environ.get("BATCH_FILE_TIMEOUT", 600)) # Seconds before a drawing is given up on
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", 1000))
+BATCH_MAX_FILE_MB = int(os.environ.get("BATCH_MAX_FILE_MB", 100)) # Uncompressed size limit per ZIP member
+BATCH_RETENTION_SECONDS = int(os.environ.get("BATCH_RETENTION_SECONDS", 24 * 3600)) # Finished batches kept in memory
+
+EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp"}
+
+_batches = {}
+_queue = None
+_workers = []
+
+logger = logging.getLogger(__name__)
+metrics.QUEUE_DEPTH.set_function(lambda: _queue.qsize() if _queue is not None else 0, queue="batch")
+
+class BatchItem:
+    """One drawing of a batch. The source is either a spooled upload (path) or a ZIP member, read on demand."""
+
+    def __init__(self, index, name, path=None, archive=None, member=None):
+        self.index = index
+        self.name = name
+        self.path = path
+        self.archive = archive
+        self.member = member
+        self.status = "queued"
+        self.error = None
+        self.document = None
+        self.run_id = None # History row, see drawing_store
+        self.started = None
+        self.finished = None
+
+    @property
+    def seconds(self):
+        if self.started is None:
+            return None
+        return round((self.finished or time.monotonic()) - self.started, 3)
+
+    def to_dict(self, include_results=False):
+        document = self.document or {}
+        data = {
+            "index": self.index,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "pages": len(document.get("pages") or []),
+            "features": len(document.get("results") or []),
+            "cached": document.get("cached", False),
+            "seconds": self.seconds,
+            "run_id": self.run_id,
+        }
+        if include_results:
+            data["results"] = document.get("results")
+        return data
+
+class Batch:
+    def __init__(self, batch_id, user_id=None):
+        self.id = batch_id
+        self.user_id = user_id
+        self.items = []
+        self.archives = []
+        self.created_at = datetime.utcnow()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def counts(self):
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0, "skipped": 0}
+        for item in self.items:
+            counts[item.status] += 1
+        return counts
+
+    @property
+    def status(self):
+        counts = self.counts()
+        if counts["queued"] == len(self.items) - counts["skipped"] and counts["queued"]:
+            return "queued"
+        if counts["queued"] or counts["running"]:
+            return "running"
+        return "done"
+
+    def item_finished(self):
+        if self.status == "done" and self.finished is None:
+            self.finished = time.monotonic()
+            for archive in self.archives:
+                archive.close()
+            self.archives = []
+            logger.info(f"📦 Batch {self.id} finished: {self.counts()}", extra={"batch": self.id})
+
+    def throughput(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        completed = [item for item in self.items if item.status in ("done", "failed")]
+        done = [item for item in completed if item.status == "done"]
+        pages = sum(len(item.document.get("pages") or []) for item in done)
+        features = sum(len(item.document.get("results") or []) for item in done)
+        minutes = elapsed / 60.0 if elapsed > 0 else None
+        file_seconds = [item.seconds for item in completed if item.seconds is not None]
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_minute": round(len(completed) / minutes, 2) if minutes else None,
+            "pages_per_minute": round(pages / minutes, 2) if minutes else None,
+            "pages": pages,
+            "features": features,
+            "avg_file_seconds": round(sum(file_seconds) / len(file_seconds), 3) if file_seconds else None,
+        }
+
+    def to_dict(self, include_results=False):
+        return {
+            "batch_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "total": len(self.items),
+            "counts": self.counts(),
+            "throughput": self.throughput(),
+            "files": [item.to_dict(include_results) for item in self.items],
+        }
+
+def _suffix(name):
+    return os.path.splitext(name)[1].lower()
+
+def _sniff(fileobj):
+    """MIME type of an upload from its first bytes (ingest.sniff), the name or declared type are not trusted."""
+    head = fileobj.read(16)
+    fileobj.seek(0)
+    return ingest.sniff(head)
+
+def _spool(fileobj, suffix):
+    """Copies an upload to our own temp file; the request's upload is closed once the response is sent."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        shutil.copyfileobj(fileobj, tmp_file)
+        return tmp_file.name
+
+def _add_archive(batch, fileobj, archive_name):
+    """
+    Lists the drawings inside a ZIP without extracting them. Members are
+    read into memory one at a time, only when a worker picks them up.
+    """
+    spooled = tempfile.TemporaryFile() # Anonymous, removed by the OS once closed
+    shutil.copyfileobj(fileobj, spooled)
+    spooled.seek(0)
+    try:
+        archive = zipfile.ZipFile(spooled)
+    except zipfile.BadZipFile:
+        spooled.close()
+        item = BatchItem(len(batch.items), archive_name)
+        item.status, item.error = "skipped", "Not a valid ZIP archive"
+        batch.items.append(item)
+        return
+    batch.archives.append(archive)
+
+    for info in archive.infolist():
+        name = info.filename
+        basename = os.path.basename(name)
+        if info.is_dir() or not basename or basename.startswith(".") or name.startswith("__MACOSX/"):
+            continue
+        item = BatchItem(len(batch.items), name, archive=archive, member=info)
+        if _suffix(name) not in EXTENSIONS:
+            item.status, item.error = "skipped", "Unsupported file type"
+        elif info.file_size > BATCH_MAX_FILE_MB * 1024 * 1024:
+            item.status, item.error = "skipped", f"Larger than {BATCH_MAX_FILE_MB} MB"
+        batch.items.append(item)
+
+def create_batch(uploads, user_id=None):
+    """
+    uploads: [(fileobj, filename, content_type)]. ZIP archives are expanded into their drawings.
+    Blocking (spools the uploads), run it in a thread. Returns the Batch.
+    """
+    batch = Batch(uuid.uuid4().hex, user_id)
+    for fileobj, filename, content_type in uploads:
+        is_archive = content_type in ("application/zip", "application/x-zip-compressed") or _suffix(filename) == ".zip"
+        # Same check as /upload/ and ZIP members: the content decides, the suffix follows it
+        mime_type = _sniff(fileobj) if not is_archive and _suffix(filename) in EXTENSIONS else None
+        if is_archive:
+            _add_archive(batch, fileobj, filename)
+        elif mime_type is not None:
+            batch.items.append(BatchItem(len(batch.items), filename, path=_spool(fileobj, ingest.SUFFIXES[mime_type])))
+        else:
+            item = BatchItem(len(batch.items), filename)
+            item.status, item.error = "skipped", "Unsupported file type"
+            batch.items.append(item)
+        if len(batch.items) > BATCH_MAX_FILES:
+            discard(batch)
+            raise ValueError(f"A batch may contain at most {BATCH_MAX_FILES} files")
+    return batch
+
+def discard(batch):
+    for item in batch.items:
+        if item.path and os.path.exists(item.path):
+            os.remove(item.path)
+    for archive in batch.archives:
+        archive.close()
+
+def _materialize(item):
+    """
+    Path of a spooled upload, or an ingest.IngestedFile for a ZIP member: decompressed
+    into memory now (spilling to disk only above INGEST_SPILL_MB).
+    """
+    if item.path:
+        return item.path
+    upload = ingest.IngestedFile(item.name)
+    try:
+        with item.archive.open(item.member) as src:
+            for chunk in iter(lambda: src.read(1024 * 1024), b""):
+                upload.write(chunk)
+        return upload.finish()
+    except Exception:
+        upload.close()
+        raise
+
+def _cleanup(source):
+    if isinstance(source, ingest.IngestedFile):
+        source.close()
+    elif source and os.path.exists(source):
+        os.remove(source)
+
+def _save_run(batch, item, source):
+    if not drawing_store.STORE_RESULTS or batch.user_id is None:
+        return None
+    if isinstance(source, ingest.IngestedFile):
+        content_hash, mime_type, size = source.sha256, source.mime_type, source.size
+    else:
+        content_hash, mime_type, size = result_cache.hash_file(source), None, os.path.getsize(source)
+    return drawing_store.save_run(
+        item.document, content_hash, filename=item.name, source="batch", user_id=batch.user_id,
+        mime_type=mime_type, size_bytes=size,
+    )
+
+async def _process_item(batch, item):
+    """
+    Extracts one drawing. Returns the extraction's future if it timed out: its thread cannot be
+    interrupted, so the caller keeps the pipeline slot until it returns (see _worker).
+    """
+    import extractor
+
+    loop = asyncio.get_running_loop()
+    item.status = "running"
+    item.started = time.monotonic()
+    source = None
+    running = None
+    try:
+        source = await loop.run_in_executor(None, _materialize, item)
+        extract = extractor.process_upload if isinstance(source, ingest.IngestedFile) else extractor.process_document
+        future = loop.run_in_executor(None, functools.partial(extract, source, user_id=batch.user_id))
+        done, _ = await asyncio.wait({future}, timeout=BATCH_FILE_TIMEOUT or None)
+        if not done:
+            # The item is given up on now; the source is cleaned up whenever the thread returns
+            future.add_done_callback(lambda _, source=source: _cleanup(source))
+            source = None
+            running = future
+            raise TimeoutError(f"Timed out after {BATCH_FILE_TIMEOUT:.0f}s")
+        item.document = future.result()
+        failed_pages = [timing for timing in item.document.get("pages", []) if "error" in timing]
+        if item.document.get("pages") and len(failed_pages) == len(item.document["pages"]):
+            raise RuntimeError(failed_pages[0]["error"])
+        item.run_id = await loop.run_in_executor(None, _save_run, batch, item, source)
+        item.status = "done"
+    except Exception as e:
+        logger.error(f"⚠️ Batch {batch.id}: {item.name} failed: {e}", extra={"batch": batch.id, "file": item.name})
+        item.status = "failed"
+        item.error = str(e) or type(e).__name__
+    finally:
+        item.finished = time.monotonic()
+        _cleanup(source)
+        item.path = None
+    return running
+
+async def _worker():
+    while True:
+        batch, item = await _queue.get()
+        running = None
+        try:
+            running = await _process_item(batch, item)
+        finally:
+            batch.item_finished()
+            _queue.task_done()
+        if running is not None:
+            # A timed-out extraction still holds its slot: BATCH_CONCURRENCY bounds the work actually running
+            await asyncio.wait({running})
+
+def _ensure_workers():
+    """The pipeline: BATCH_CONCURRENCY worker tasks on the API event loop, shared by all batches."""
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    alive = [task for task in _workers if not task.done()]
+    _workers[:] = alive
+    for _ in range(max(1, BATCH_CONCURRENCY) - len(alive)):
+        _workers.append(asyncio.get_running_loop().create_task(_worker()))
+
+def _forget_old_batches():
+    now = time.monotonic()
+    for batch_id, batch in list(_batches.items()):
+        if batch.finished is not None and now - batch.finished > BATCH_RETENTION_SECONDS:
+            del _batches[batch_id]
+
+async def submit(batch):
+    """Registers the batch and queues its drawings. Must run on the API event loop."""
+    _forget_old_batches()
+    _ensure_workers()
+    _batches[batch.id] = batch
+    for item in batch.items:
+        if item.status == "queued":
+            _queue.put_nowait((batch, item))
+    # Nothing to do (e.g. only unsupported files)
+    batch.item_finished()
+    return batch
+
+def get_batch(batch_id, user_id=None):
+    """The batch, if user_id (None: anonymous) is the one who created it, else None."""
+    batch = _batches.get(batch_id)
+    if batch is None or batch.user_id != user_id:
+        return None
+    return batch
+
+async def shutdown():
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
+    for batch in _batches.values():
+        if batch.finished is None:
+            discard(batch)
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tolerance_normalizer
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+CASCADE_FAST_MODEL = os.environ.get("CASCADE_FAST_MODEL", "") # e.g. qwen/qwen-2.5-vl-7b-instruct; empty turns the cascade off
+CASCADE_FAST_BASE_URL = os.environ.get("CASCADE_FAST_BASE_URL", "") # Default: QWEN_BASE_URL
+CASCADE_REFINE = os.environ.get("CASCADE_REFINE", "sync") # sync | background: /upload/ answers with the fast result
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", 0.8)) # Mean feature confidence a page needs
+CASCADE_DOUBTFUL = float(os.environ.get("CASCADE_DOUBTFUL", 0.6)) # A feature below this confidence is doubtful...
+CASCADE_MAX_DOUBTFUL = float(os.environ.get("CASCADE_MAX_DOUBTFUL", 0.1)) # ...and a page with more than this share of them is escalated
+CASCADE_DENSE_FEATURES = int(os.environ.get("CASCADE_DENSE_FEATURES", 40)) # Pages with this many features always go to the large model
+CASCADE_REFINE_WORKERS = int(os.environ.get("CASCADE_REFINE_WORKERS", 2)) # Background refinements run at once
+
+TYPES = {"Dimension", "GD&T"}
+# Letters that small vision models read instead of 0, 5 and 1, when they touch a digit or decimal point
+_LOOKALIKE = re.compile(r"[\d.,][OoSlI]|[OoSlI][\d.,]")
+_ISO_LIKE = re.compile(r"^[A-Za-z]{1,2}\d{1,2}$")
+# Subtypes whose value is not a plain number
+NON_NUMERIC_SUBTYPES = {"Chamfer"}
+
+def enabled():
+    return bool(CASCADE_FAST_MODEL)
+
+def settings_fingerprint():
+    """Changes whenever the cascade would decide differently, so cached results are not reused across settings."""
+    if not enabled():
+        return "cascade:off"
+    settings = (CASCADE_FAST_MODEL, CASCADE_MIN_CONFIDENCE, CASCADE_DOUBTFUL, CASCADE_MAX_DOUBTFUL, CASCADE_DENSE_FEATURES)
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()[:16]
+
+def _digits(text):
+    return re.sub(r"\D", "", str(text or ""))
+
+def _valid_box(box):
+    if not isinstance(box, (list, tuple)) or len(box) != 4:
+        return False
+    try:
+        ymin, xmin, ymax, xmax = [float(v) for v in box]
+    except (TypeError, ValueError):
+        return False
+    return 0 <= ymin < ymax <= 1000 and 0 <= xmin < xmax <= 1000
+
+def score(results):
+    """
+    Sets 'confidence' (0-1) on every feature from sanity checks of what the model returned:
+    a known type, a usable box, a value that parses as a number (without letters in place of digits), an ISO code that the ISO 286
+    tables resolve, a tolerance that parses, and original text that contains the value's digits.
+    Returns the features.
+    """
+    if not results:
+        return results
+    table = tolerance_normalizer.normalize(results)
+    for i, item in enumerate(results):
+        confidence = 1.0
+        checks = []
+        if item.get("type") not in TYPES:
+            confidence -= 0.5
+            checks.append("type")
+        if not _valid_box(item.get("box_2d")):
+            confidence -= 0.3
+            checks.append("box")
+        subtype = item.get("subtype")
+        if subtype not in NON_NUMERIC_SUBTYPES and (math.isnan(table.nominal[i]) or _LOOKALIKE.search(str(item.get("value") or ""))):
+            # The normalizer reads "1OO.OO" as 1.0, so misread digits are looked for as well
+            confidence -= 0.5
+            checks.append("value")
+        tolerance = str(item.get("tolerance") or "").strip()
+        if (table.iso_code[i] is not None or _ISO_LIKE.match(tolerance)) and math.isnan(table.upper[i]):
+            # Looks like an ISO 286 code the tables cannot resolve: misread letter or grade
+            confidence -= 0.5
+            checks.append("iso_code")
+        elif (item.get("type") == "Dimension" and tolerance and tolerance.lower() != "basic"
+              and math.isnan(table.upper[i]) and math.isnan(table.lower[i])):
+            confidence -= 0.3
+            checks.append("tolerance")
+        value_digits, text_digits = _digits(item.get("value")), _digits(item.get("original_text"))
+        if not text_digits:
+            confidence -= 0.1
+            checks.append("original_text")
+        elif value_digits and value_digits not in text_digits and value_digits.rstrip("0") not in text_digits:
+            confidence -= 0.2
+            checks.append("original_text")
+        item["confidence"] = round(max(0.0, confidence), 2)
+        if checks:
+            item["confidence_checks"] = checks
+        else:
+            item.pop("confidence_checks", None)
+    return results
+
+def assess(results):
+    """
+    Scores the fast model's features and decides whether the page goes to the large model.
+    Returns {"features", "confidence", "doubtful", "escalate", "reason"}.
+    """
+    score(results)
+    confidences = [item["confidence"] for item in results]
+    mean = round(sum(confidences) / len(confidences), 3) if confidences else None
+    doubtful = sum(1 for value in confidences if value < CASCADE_DOUBTFUL)
+    if not results:
+        reason = "empty"
+    elif len(results) >= CASCADE_DENSE_FEATURES:
+        reason = "dense"
+    elif mean < CASCADE_MIN_CONFIDENCE:
+        reason = "confidence"
+    elif doubtful > CASCADE_MAX_DOUBTFUL * len(results):
+        reason = "doubtful"
+    else:
+        reason = None
+    return {
+        "features": len(results),
+        "confidence": mean,
+        "doubtful": doubtful,
+        "escalate": reason is not None,
+        "reason": reason,
+    }
+
+_refiner = None
+_refiner_lock = threading.Lock()
+
+def refine_later(fn, *args):
+    """Runs a background refinement (fn(*args)) on the refinement pool."""
+    global _refiner
+    with _refiner_lock:
+        if _refiner is None:
+            _refiner = ThreadPoolExecutor(max_workers=max(1, CASCADE_REFINE_WORKERS), thread_name_prefix="refine")
+    return _refiner.submit(_logged, fn, *args)
+
+def _logged(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        logger.exception(f"⚠️ Background refinement failed: {e}")
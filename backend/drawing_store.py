@@ -0,0 +1,105 @@
+import logging
+import os
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+import models
+from database import SessionLocal
+
+# --- CONFIGURATION ---
+STORE_RESULTS = os.environ.get("STORE_RESULTS", "1") == "1" # Keep every extraction in the history tables
+
+# Feature columns copied from the 'normalized' block written by tolerance_normalizer
+_NORMALIZED = ("nominal", "upper", "lower", "upper_limit", "lower_limit", "unit", "iso_code")
+
+logger = logging.getLogger(__name__)
+
+def _text(value):
+    return None if value is None else str(value)
+
+def _feature_row(item, run_id, drawing_id):
+    normalized = item.get("normalized") or {}
+    row = {
+        "run_id": run_id,
+        "drawing_id": drawing_id,
+        "page": item.get("page") or 1,
+        "type": _text(item.get("type")),
+        "subtype": _text(item.get("subtype")),
+        "value": _text(item.get("value")),
+        "tolerance": _text(item.get("tolerance")),
+        "datum": _text(item.get("datum")),
+        "original_text": _text(item.get("original_text")),
+        "box_2d": item.get("box_2d"),
+        "data": item,
+    }
+    for name in _NORMALIZED:
+        row[name] = normalized.get(name)
+    return row
+
+def _get_or_create_drawing(db, content_hash, user_id, **fields):
+    query = select(models.Drawing).where(
+        models.Drawing.content_hash == content_hash,
+        models.Drawing.user_id.is_(None) if user_id is None else models.Drawing.user_id == user_id,
+    )
+    drawing = db.execute(query).scalars().first()
+    if drawing is not None:
+        return drawing
+    try:
+        with db.begin_nested():
+            drawing = models.Drawing(content_hash=content_hash, user_id=user_id, **fields)
+            db.add(drawing)
+        return drawing
+    except IntegrityError:
+        # Same file uploaded concurrently, the other request created the row
+        return db.execute(query).scalars().one()
+
+def save_run(document, content_hash, filename=None, source="upload", user_id=None,
+             part_number=None, mime_type=None, size_bytes=None):
+    """
+    Records one extraction of a drawing: the drawing (created on first upload of its content),
+    the run and all its features, inserted as one executemany in a single transaction.
+    part_number defaults to the file name without extension.
+    Anonymous extractions (user_id None) are not stored: the history is only readable by its owner.
+    Returns the run id, or None if not stored or storing failed (the extraction itself still succeeded).
+    """
+    if not STORE_RESULTS or not content_hash or user_id is None:
+        return None
+
+    results = document.get("results") or []
+    pages = document.get("pages") or []
+    if part_number is None and filename:
+        part_number = os.path.splitext(os.path.basename(filename))[0] or None
+
+    db = SessionLocal()
+    try:
+        with metrics.stage("history_store"):
+            drawing = _get_or_create_drawing(
+                db, content_hash, user_id,
+                filename=filename, part_number=part_number, mime_type=mime_type,
+                size_bytes=size_bytes, page_count=len(pages) or None,
+            )
+            run = models.ExtractionRun(
+                drawing_id=drawing.id,
+                user_id=user_id,
+                engine=next((timing["engine"] for timing in pages if timing.get("engine")), None),
+                source=source,
+                cached=bool(document.get("cached")),
+                feature_count=len(results),
+                failed_pages=sum(1 for timing in pages if "error" in timing),
+                seconds=document.get("seconds"),
+                pages=pages,
+            )
+            db.add(run)
+            db.flush()
+            if results:
+                db.execute(insert(models.Feature), [_feature_row(item, run.id, drawing.id) for item in results])
+            db.commit()
+        return run.id
+    except Exception as e:
+        db.rollback()
+        logger.error(f"⚠️ Could not store the extraction of {filename}: {e}", extra={"file": filename})
+        return None
+    finally:
+        db.close()
@@ -1,11 +1,14 @@
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 from pydantic import EmailStr
 from typing import List
+import logging
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 async def get_email_config():
     try:
         return ConnectionConfig(
@@ -20,23 +23,19 @@ async def get_email_config():
             VALIDATE_CERTS=True
         )
     except Exception as e:
-        print(f"EMAIL CONFIG ERROR: {e}")
+        logger.error(f"EMAIL CONFIG ERROR: {e}")
         return None
 
 async def send_approval_request(new_user_email: str, approval_link: str):
     """
     Sends an email to the Admin requesting approval for a new user.
-    Falls back to printing to console if email service is not configured.
+    Falls back to logging the link if email service is not configured.
     """
     admin_email = os.environ.get("MAIL_USERNAME")
     
     # FALLBACK: If no admin email configured, just log it.
     if not admin_email:
-        print("\n" + "="*50)
-        print(f" [MOCK EMAIL] To Admin: ACTION REQUIRED")
-        print(f" New User: {new_user_email}")
-        print(f" APPROVE LINK: {approval_link}")
-        print("="*50 + "\n")
+        logger.warning(f"[MOCK EMAIL] To Admin: ACTION REQUIRED. New User: {new_user_email} APPROVE LINK: {approval_link}")
         return
 
     html = f"""
@@ -61,11 +60,11 @@ async def send_approval_request(new_user_email: str, approval_link: str):
             fm = FastMail(conf)
             await fm.send_message(message)
         except Exception as e:
-            print(f"SMTP SEND ERROR: {e}")
-            # Fallback to console even if config existed but connection failed
-            print(f"MANUAL APPROVAL LINK: {approval_link}")
+            logger.error(f"SMTP SEND ERROR: {e}")
+            # Fallback to the log even if config existed but connection failed
+            logger.warning(f"MANUAL APPROVAL LINK: {approval_link}")
     else:
-        print(f"MANUAL APPROVAL LINK (No Config): {approval_link}")
+        logger.warning(f"MANUAL APPROVAL LINK (No Config): {approval_link}")
 
 async def send_password_reset(email: EmailStr, token: str):
     # TODO: Implement Reset Logic
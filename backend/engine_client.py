@@ -0,0 +1,440 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+from json_stream import JsonArrayStream, parse_array
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+ENGINE_TIMEOUT = float(os.environ.get("ENGINE_TIMEOUT", 120)) # Seconds per attempt
+ENGINE_MAX_RETRIES = int(os.environ.get("ENGINE_MAX_RETRIES", 4))
+ENGINE_BACKOFF_BASE = float(os.environ.get("ENGINE_BACKOFF_BASE", 1.0))
+ENGINE_BACKOFF_MAX = float(os.environ.get("ENGINE_BACKOFF_MAX", 30.0))
+ENGINE_MAX_CONTINUATIONS = int(os.environ.get("ENGINE_MAX_CONTINUATIONS", 2)) # Follow-ups for an answer cut off at max_tokens
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Yielded by _stream() when the answer stopped at the output token limit
+TRUNCATED = object()
+
+CONTINUE_PROMPT = (
+    "Your answer was cut off. Return ONLY a JSON array with the remaining features of this drawing, "
+    "not repeating any feature from your previous answer."
+)
+
+def continuation_key(item):
+    return json.dumps(item, sort_keys=True, ensure_ascii=False)
+
+def continuation_answer(received):
+    """The features received so far, as the previous model turn of a continuation request."""
+    return json.dumps(received, ensure_ascii=False, separators=(",", ":"))
+
+def engine_limits(prefix, concurrency=8, rpm=0, tpm=0):
+    """Per-engine limits from the environment, e.g. QWEN_CONCURRENCY / QWEN_RPM / QWEN_TPM. 0 = unlimited."""
+    return {
+        "concurrency": int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency)),
+        "rpm": int(os.environ.get(f"{prefix}_RPM", rpm)),
+        "tpm": int(os.environ.get(f"{prefix}_TPM", tpm)),
+    }
+
+class EngineLoop:
+    """
+    One background event loop shared by every engine.
+    Sync callers (page/tile threads, job workers) hand coroutines over with run(),
+    async endpoints with run_async(), so every request shares one connection pool
+    and the per-engine semaphores/buckets, which are bound to this loop.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="engine-loop", daemon=True)
+                thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedules a coroutine on the engine loop, returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Blocking call from a thread that is not the engine loop."""
+        return self.submit(coro).result()
+
+    async def run_async(self, coro):
+        """Awaitable from any other event loop (e.g. the API's)."""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def stream(self, agen):
+        """Iterates an async generator on the engine loop from another event loop."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        end = object()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (end, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (end, None))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is end:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            # Client went away: stop generating
+            future.cancel()
+
+engine_loop = EngineLoop()
+
+_http_client = None
+_http_lock = threading.Lock()
+
+def shared_http_client():
+    """
+    The connection pool used by every OpenAI-compatible client. Keep-alive connections
+    (and their TLS sessions) are reused across requests, pages and engines.
+    """
+    global _http_client
+    with _http_lock:
+        if _http_client is None:
+            from openai import DefaultAsyncHttpxClient
+            _http_client = DefaultAsyncHttpxClient(timeout=ENGINE_TIMEOUT)
+    return _http_client
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at rate_per_minute.
+    acquire(n) waits until n tokens are available; requests larger than the capacity
+    are let through once the bucket is full so they cannot block forever.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity or rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+def status_of(exc):
+    """HTTP status of a provider error (openai: status_code, google.api_core: code)."""
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+class MalformedAnswer(ValueError):
+    """The answer holds no JSON array: a refusal, prose or an error message instead of features."""
+
+def is_retryable(exc):
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Connection resets and timeouts raised by the HTTP / gRPC layers
+    name = type(exc).__name__
+    return "Timeout" in name or "Connection" in name or "Unavailable" in name
+
+def retry_after(exc):
+    """Seconds requested by a Retry-After header, if the provider sent one."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class AsyncEngine:
+    """
+    Base class of the vision engines.
+    Subclasses implement `async def _call(self, prepared, continuation=None)` for a single attempt,
+    returning (answer text, truncated), and `_stream(prepared)`, an async generator of text deltas
+    (plus TRUNCATED if the answer hit the output limit), for streaming. With `continuation` (the
+    features received so far) the request asks for the rest of a cut-off answer.
+    extract_async / stream_async add the per-engine concurrency limit, RPM/TPM rate limiting,
+    a timeout, exponential backoff with jitter on 429/5xx and the parsing of the answer.
+    """
+
+    engine_id = "engine"
+
+    def setup_limits(self, concurrency=8, rpm=0, tpm=0):
+        self.limits = {"concurrency": concurrency, "rpm": rpm, "tpm": tpm}
+        self._semaphore = None
+        self._rpm_bucket = TokenBucket(rpm) if rpm else None
+        self._tpm_bucket = TokenBucket(tpm) if tpm else None
+        self.in_flight = 0
+        self.waiting = 0
+        metrics.ENGINE_IN_FLIGHT.set_function(lambda: self.in_flight, engine=self.engine_id)
+        metrics.QUEUE_DEPTH.set_function(lambda: self.waiting, queue=self.engine_id)
+
+    def record_usage(self, prompt_tokens, completion_tokens):
+        """Token counts reported by the API response, for drawingscan_engine_tokens_total."""
+        if prompt_tokens:
+            metrics.ENGINE_TOKENS.inc(prompt_tokens, engine=self.engine_id, kind="prompt")
+            metrics.ENGINE_PROMPT_TOKENS.observe(prompt_tokens, engine=self.engine_id)
+        if completion_tokens:
+            metrics.ENGINE_TOKENS.inc(completion_tokens, engine=self.engine_id, kind="completion")
+
+    def estimate_request_tokens(self, prepared):
+        """Prompt + image + completion budget, charged against the TPM bucket."""
+        return 1000
+
+    async def probe(self):
+        """Cheapest possible API call, used by the warm-up to open the connection. Raises on failure."""
+        return None
+
+    def prompt_stats(self):
+        """Estimated size of the prompt sent with every image, for /engines/stats."""
+        return {}
+
+    def _encode(self, prepared):
+        """
+        Blocking work on the request image that all its attempts and continuations share
+        (few-shot selection, encoded payload), cached on `prepared`. Runs once per request
+        in a worker thread, so it never stalls the shared engine loop.
+        """
+        return None
+
+    async def _call(self, prepared, continuation=None):
+        raise NotImplementedError
+
+    async def _stream(self, prepared):
+        raise NotImplementedError
+        yield
+
+    async def _acquire(self, prepared):
+        if self._rpm_bucket:
+            await self._rpm_bucket.acquire(1)
+        if self._tpm_bucket:
+            await self._tpm_bucket.acquire(self.estimate_request_tokens(prepared))
+
+    @asynccontextmanager
+    async def _slot(self):
+        """The engine's concurrency slot. Requests waiting for one count towards its queue depth."""
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _record_attempt(self, prepared, started, error=None):
+        metrics.ENGINE_BYTES_SENT.inc(len(prepared.data), engine=self.engine_id)
+        metrics.ENGINE_SECONDS.observe(time.perf_counter() - started, engine=self.engine_id, outcome="error" if error else "ok")
+        if error is not None:
+            metrics.ENGINE_ERRORS.inc(engine=self.engine_id, reason=status_of(error) or type(error).__name__)
+
+    async def _backoff(self, error, attempt):
+        delay = retry_after(error) or min(ENGINE_BACKOFF_MAX, ENGINE_BACKOFF_BASE * 2 ** (attempt - 1))
+        delay *= random.uniform(0.8, 1.2)
+        metrics.ENGINE_RETRIES.inc(engine=self.engine_id)
+        logger.warning(
+            f"⏳ {self.engine_id}: {type(error).__name__} (status {status_of(error)}), retry {attempt}/{ENGINE_MAX_RETRIES} in {delay:.1f}s",
+            extra={"engine": self.engine_id, "status": status_of(error), "attempt": attempt, "delay": round(delay, 2)},
+        )
+        await asyncio.sleep(delay)
+
+    def _prepare_blocking(self, image):
+        from image_preprocess import ensure_prepared
+        prepared = ensure_prepared(image)
+        self._encode(prepared)
+        return prepared
+
+    async def _prepare(self, image):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limits["concurrency"])
+        return await asyncio.to_thread(self._prepare_blocking, image)
+
+    async def extract_async(self, image):
+        prepared = await self._prepare(image)
+
+        attempt = 0
+        while True:
+            async with self._slot():
+                await self._acquire(prepared)
+                started = time.perf_counter()
+                try:
+                    text, truncated = await asyncio.wait_for(self._call(prepared), ENGINE_TIMEOUT)
+                except Exception as e:
+                    self._record_attempt(prepared, started, e)
+                    if attempt >= ENGINE_MAX_RETRIES or not is_retryable(e):
+                        raise
+                    error = e
+                else:
+                    self._record_attempt(prepared, started)
+                    break
+            # Back off outside the semaphore so other requests can use the slot
+            attempt += 1
+            await self._backoff(error, attempt)
+
+        results = self._parse(text, truncated)
+        if truncated:
+            results += await self._continue(prepared, results)
+        return results
+
+    def _parse(self, text, truncated):
+        """
+        Complete features of an answer. A malformed or cut-off element only loses itself.
+        Raises MalformedAnswer if not even one feature or a complete (empty) array came back:
+        only a literal [] means the page has no features.
+        """
+        with metrics.stage("parse"):
+            results, finished = parse_array(text)
+        if truncated:
+            metrics.ENGINE_TRUNCATED.inc(engine=self.engine_id)
+            logger.warning(f"✂️ {self.engine_id}: answer cut off at the output limit, kept {len(results)} complete feature(s)",
+                           extra={"engine": self.engine_id, "features": len(results)})
+        if not results and not finished:
+            raise MalformedAnswer(f"{self.engine_id}: answer is not a JSON array: {text[:200]!r}")
+        return results
+
+    async def _continue(self, prepared, received):
+        """
+        Asks for the rest of a cut-off answer instead of re-running the whole extraction, up to
+        ENGINE_MAX_CONTINUATIONS times. Returns only the new features; a failed follow-up
+        keeps what was already received.
+        """
+        received = list(received)
+        seen = {continuation_key(item) for item in received}
+        added = []
+        for _ in range(ENGINE_MAX_CONTINUATIONS):
+            if not received:
+                # Nothing complete to continue from, a follow-up would start over anyway
+                break
+            async with self._slot():
+                await self._acquire(prepared)
+                started = time.perf_counter()
+                try:
+                    text, truncated = await asyncio.wait_for(self._call(prepared, received), ENGINE_TIMEOUT)
+                except Exception as e:
+                    self._record_attempt(prepared, started, e)
+                    metrics.ENGINE_CONTINUATIONS.inc(engine=self.engine_id, outcome="error")
+                    logger.warning(f"⚠️ {self.engine_id}: continuation failed ({type(e).__name__}), keeping {len(received)} feature(s)",
+                                   extra={"engine": self.engine_id})
+                    break
+                self._record_attempt(prepared, started)
+            try:
+                parsed = self._parse(text, truncated)
+            except MalformedAnswer as e:
+                metrics.ENGINE_CONTINUATIONS.inc(engine=self.engine_id, outcome="error")
+                logger.warning(f"⚠️ {e}; keeping {len(received)} feature(s)", extra={"engine": self.engine_id})
+                break
+            metrics.ENGINE_CONTINUATIONS.inc(engine=self.engine_id, outcome="ok")
+
+            # Models sometimes repeat features despite the instruction
+            new = []
+            for item in parsed:
+                key = continuation_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    new.append(item)
+            received += new
+            added += new
+            logger.info(f"🧩 {self.engine_id}: continuation added {len(new)} feature(s)", extra={"engine": self.engine_id, "features": len(new)})
+            if not truncated or not new:
+                break
+        return added
+
+    async def stream_async(self, image):
+        """
+        Streaming variant of extract_async: yields each feature as soon as the model
+        has finished writing it. ENGINE_TIMEOUT applies to the gap between chunks.
+        Only attempts that have not yielded anything yet are retried.
+        """
+        prepared = await self._prepare(image)
+
+        attempt = 0
+        while True:
+            parser = JsonArrayStream()
+            received, truncated = [], False
+            async with self._slot():
+                await self._acquire(prepared)
+                started = time.perf_counter()
+                chunks = self._stream(prepared).__aiter__()
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), ENGINE_TIMEOUT)
+                        except StopAsyncIteration:
+                            break
+                        if chunk is TRUNCATED:
+                            truncated = True
+                            continue
+                        for item in parser.feed(chunk):
+                            # Copied, the consumer enriches the features it gets
+                            received.append(copy.deepcopy(item))
+                            yield item
+                    for item in parser.close():
+                        received.append(copy.deepcopy(item))
+                        yield item
+                    if not received and not parser.finished:
+                        # Only a literal [] is an empty page, see _parse
+                        raise MalformedAnswer(f"{self.engine_id}: answer is not a JSON array: {parser.text[:200]!r}")
+                    self._record_attempt(prepared, started)
+                    break
+                except Exception as e:
+                    self._record_attempt(prepared, started, e)
+                    if parser.emitted or attempt >= ENGINE_MAX_RETRIES or not is_retryable(e):
+                        raise
+                    error = e
+                finally:
+                    await chunks.aclose()
+            attempt += 1
+            await self._backoff(error, attempt)
+
+        if truncated:
+            metrics.ENGINE_TRUNCATED.inc(engine=self.engine_id)
+            logger.warning(f"✂️ {self.engine_id}: streamed answer cut off at the output limit after {len(received)} feature(s)",
+                           extra={"engine": self.engine_id, "features": len(received)})
+            # The rest comes from a regular request, the features streamed so far are already out
+            for item in await self._continue(prepared, received):
+                yield item
+
+    def extract_data(self, image):
+        """Sync entry point for worker threads. Runs on the shared engine loop."""
+        return engine_loop.run(self.extract_async(image))
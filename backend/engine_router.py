@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from engine_client import engine_loop
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+ROUTER_WINDOW = int(os.environ.get("ROUTER_WINDOW", 100)) # Requests kept per engine for p50/p95/error rate
+ROUTER_FAILURE_THRESHOLD = int(os.environ.get("ROUTER_FAILURE_THRESHOLD", 5)) # Consecutive failures that open the circuit
+ROUTER_ERROR_RATE = float(os.environ.get("ROUTER_ERROR_RATE", 0.5)) # ...or this error rate over the window
+ROUTER_MIN_SAMPLES = int(os.environ.get("ROUTER_MIN_SAMPLES", 20)) # Before error rate / p95 are trusted
+ROUTER_OPEN_SECONDS = float(os.environ.get("ROUTER_OPEN_SECONDS", 30)) # Open time before a half-open probe
+ROUTER_HEDGE = os.environ.get("ROUTER_HEDGE", "1") == "1"
+ROUTER_HEDGE_MIN_DELAY = float(os.environ.get("ROUTER_HEDGE_MIN_DELAY", 2.0)) # Never hedge earlier than this
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class EngineHealth:
+    """
+    Rolling latency / error statistics and the circuit breaker of one engine.
+    closed: normal traffic. open: skipped until ROUTER_OPEN_SECONDS have passed.
+    half_open: a single probe request decides whether the circuit closes again.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.samples = deque(maxlen=ROUTER_WINDOW) # (seconds, ok)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def latencies(self):
+        return [seconds for seconds, ok in self.samples if ok]
+
+    def p50(self):
+        return percentile(self.latencies(), 0.5)
+
+    def p95(self):
+        latencies = self.latencies()
+        if len(latencies) < ROUTER_MIN_SAMPLES:
+            return None
+        return percentile(latencies, 0.95)
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def available(self):
+        """True if a request may be sent now. Moves open -> half_open once the open time is over."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= ROUTER_OPEN_SECONDS:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                return True
+            return False
+
+    def begin(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = True
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self.samples.append((seconds, ok))
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != CLOSED:
+                    logger.info(f"✅ {self.engine.engine_id}: circuit closed.", extra={"engine": self.engine.engine_id})
+                self.state = CLOSED
+                self.probe_in_flight = False
+                return
+
+            self.consecutive_failures += 1
+            too_many = self.consecutive_failures >= ROUTER_FAILURE_THRESHOLD
+            too_often = len(self.samples) >= ROUTER_MIN_SAMPLES and self.error_rate() >= ROUTER_ERROR_RATE
+            if self.state == HALF_OPEN or too_many or too_often:
+                if self.state != OPEN:
+                    logger.warning(f"🔌 {self.engine.engine_id}: circuit open for {ROUTER_OPEN_SECONDS:.0f}s.", extra={"engine": self.engine.engine_id})
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def release(self):
+        """A cancelled request (lost a hedge race) says nothing about the engine's health."""
+        with self._lock:
+            self.probe_in_flight = False
+
+    def stats(self):
+        p50, p95 = self.p50(), self.p95()
+        return {
+            "engine": self.engine.engine_id,
+            "state": self.state,
+            "requests": len(self.samples),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "prompt": self.engine.prompt_stats(),
+        }
+
+class EngineRouter:
+    """
+    Sends each image to the healthiest engine in priority order.
+    Engines with an open circuit are skipped, failures fall through to the next engine,
+    and if the primary is slower than its own p95 a hedged request goes to the next
+    engine; whichever succeeds first wins and the other request is cancelled.
+    """
+
+    def __init__(self, engines):
+        self.health = [EngineHealth(engine) for engine in engines if engine]
+
+    def __bool__(self):
+        return bool(self.health)
+
+    def candidates(self):
+        """Engines that may take a request now, in priority order. Falls back to all of them if every circuit is open."""
+        ready = [health for health in self.health if health.available()]
+        return ready or list(self.health)
+
+    def primary(self):
+        ready = self.candidates()
+        return ready[0].engine if ready else None
+
+    async def _attempt(self, health, image):
+        """The engine's features (possibly none), or None if it failed."""
+        health.begin()
+        started = time.perf_counter()
+        try:
+            results = await health.engine.extract_async(image)
+        except asyncio.CancelledError:
+            health.release()
+            raise
+        except Exception as e:
+            health.record(time.perf_counter() - started, False)
+            logger.error(f"{health.engine.engine_id} Error: {e}", extra={"engine": health.engine.engine_id})
+            return None
+        # An empty answer is a valid response, but the next engine still gets a try
+        health.record(time.perf_counter() - started, True)
+        if not results:
+            logger.warning(f"{health.engine.engine_id} returned empty results.", extra={"engine": health.engine.engine_id})
+        return results
+
+    async def _hedged(self, primary, secondary, image):
+        """
+        Runs primary; starts secondary once primary exceeds its p95. Returns (results, health, hedged)
+        of the first answer with features, else of an empty answer, else (None, None, hedged).
+        """
+        first = asyncio.ensure_future(self._attempt(primary, image))
+        delay = primary.p95()
+        if secondary is None or not ROUTER_HEDGE or delay is None:
+            return await first, primary, False
+
+        done, _ = await asyncio.wait({first}, timeout=max(ROUTER_HEDGE_MIN_DELAY, delay))
+        if done:
+            return first.result(), primary, False
+
+        primary.hedges += 1
+        logger.info(f"🏁 {primary.engine.engine_id} slower than p95 ({delay:.1f}s), hedging with {secondary.engine.engine_id}.",
+                    extra={"engine": primary.engine.engine_id, "hedge": secondary.engine.engine_id})
+        tasks = {first: primary, asyncio.ensure_future(self._attempt(secondary, image)): secondary}
+        pending = set(tasks)
+        empty = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.result():
+                        if tasks[task] is secondary:
+                            primary.hedge_wins += 1
+                        return task.result(), tasks[task], True
+                    if task.result() is not None and empty is None:
+                        empty = tasks[task]
+        finally:
+            for task in pending:
+                task.cancel()
+        return ([], empty, True) if empty is not None else (None, None, True)
+
+    async def extract_async(self, image):
+        """
+        Returns (results, engine_id). An empty answer still lets the next engine try; if none finds
+        anything, ([], id of the first engine that answered) is a valid, empty page.
+        ([], None) only if every engine failed.
+        """
+        candidates = self.candidates()
+        tried = set()
+        empty = None
+        while candidates:
+            primary = candidates[0]
+            secondary = candidates[1] if len(candidates) > 1 else None
+            results, winner, hedged = await self._hedged(primary, secondary, image)
+            if results:
+                return results, winner.engine.engine_id
+            if results is not None and empty is None:
+                empty = winner.engine.engine_id
+            tried.add(id(primary))
+            if hedged and secondary is not None:
+                tried.add(id(secondary))
+            candidates = [health for health in candidates if id(health) not in tried]
+        return [], empty
+
+    async def stream_async(self, image):
+        """
+        Yields (feature, engine_id) as the engine generates them. Runs on the engine loop.
+        No hedging here: a second stream would emit the same features twice. An engine that
+        fails before its first feature falls through to the next one; a failure mid-stream is raised.
+        If engines answered but none found anything, a single (None, engine_id) marks the valid,
+        empty page; if all of them failed, nothing is yielded.
+        """
+        empty = None
+        for health in self.candidates():
+            health.begin()
+            started = time.perf_counter()
+            emitted = 0
+            try:
+                async for item in health.engine.stream_async(image):
+                    emitted += 1
+                    yield item, health.engine.engine_id
+            except (asyncio.CancelledError, GeneratorExit):
+                health.release()
+                raise
+            except Exception as e:
+                health.record(time.perf_counter() - started, False)
+                logger.error(f"{health.engine.engine_id} Error: {e}", extra={"engine": health.engine.engine_id})
+                if emitted:
+                    raise
+                continue
+            health.record(time.perf_counter() - started, True)
+            if emitted:
+                return
+            logger.warning(f"{health.engine.engine_id} returned empty results.", extra={"engine": health.engine.engine_id})
+            if empty is None:
+                empty = health.engine.engine_id
+        if empty is not None:
+            yield None, empty
+
+    def extract(self, image):
+        """Sync entry point for page and tile threads."""
+        return engine_loop.run(self.extract_async(image))
+
+    def stats(self):
+        return {
+            "hedging": ROUTER_HEDGE,
+            "engines": [health.stats() for health in self.health],
+        }
@@ -0,0 +1,274 @@
+import csv
+import io
+import json
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from sqlalchemy import func, select
+
+import models
+from database import SessionLocal
+
+# --- CONFIGURATION ---
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", 1000)) # Features read per query and written per chunk
+
+# (name, numeric): the spreadsheet columns, in order
+COLUMNS = [
+    ("id", True),
+    ("run_id", True),
+    ("drawing_id", True),
+    ("part_number", False),
+    ("page", True),
+    ("type", False),
+    ("subtype", False),
+    ("value", False),
+    ("tolerance", False),
+    ("datum", False),
+    ("original_text", False),
+    ("nominal", True),
+    ("upper", True),
+    ("lower", True),
+    ("upper_limit", True),
+    ("lower_limit", True),
+    ("unit", False),
+    ("iso_code", False),
+    ("calculated_limits", False),
+    ("box_2d", False),
+]
+COLUMN_NAMES = [name for name, _ in COLUMNS]
+
+def feature_query(user_id):
+    """
+    Features of the user's drawings with the part number of their drawing, to be narrowed
+    with .where() and exported with fetch().
+    """
+    return (select(models.Feature, models.Drawing.part_number)
+            .join(models.Drawing, models.Drawing.id == models.Feature.drawing_id)
+            .where(models.Drawing.user_id == user_id))
+
+def snapshot(query):
+    """(feature count, highest feature id) a query currently matches. The id is the `until` that pins an export."""
+    db = SessionLocal()
+    try:
+        matched = query.subquery()
+        count, until = db.execute(select(func.count(), func.max(matched.c.id))).one()
+        return count, until
+    finally:
+        db.close()
+
+def _record(feature, part_number):
+    data = feature.data or {}
+    return {
+        "id": feature.id,
+        "run_id": feature.run_id,
+        "drawing_id": feature.drawing_id,
+        "part_number": part_number,
+        "page": feature.page,
+        "type": feature.type,
+        "subtype": feature.subtype,
+        "value": feature.value,
+        "tolerance": feature.tolerance,
+        "datum": feature.datum,
+        "original_text": feature.original_text,
+        "nominal": feature.nominal,
+        "upper": feature.upper,
+        "lower": feature.lower,
+        "upper_limit": feature.upper_limit,
+        "lower_limit": feature.lower_limit,
+        "unit": feature.unit,
+        "iso_code": feature.iso_code,
+        "calculated_limits": data.get("calculated_limits"),
+        "box_2d": feature.box_2d,
+        "data": data,
+    }
+
+def fetch(query, after=None, until=None, limit=None):
+    """
+    The next chunk of features in id order after the feature id `after`, up to `until`.
+    Keyset reads, like /history: memory stays at one chunk however large the export.
+    """
+    query = query.where(models.Feature.id > (after or 0))
+    if until is not None:
+        query = query.where(models.Feature.id <= until)
+    db = SessionLocal()
+    try:
+        rows = db.execute(query.order_by(models.Feature.id).limit(limit or EXPORT_CHUNK_ROWS)).all()
+        return [_record(feature, part_number) for feature, part_number in rows]
+    finally:
+        db.close()
+
+def _cell_text(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    return value
+
+class CsvWriter:
+    """UTF-8 with a byte order mark, so Excel shows Ø and ± correctly. A resumed download has no header row."""
+    media_type = "text/csv; charset=utf-8"
+    extension = "csv"
+
+    def __init__(self, header=True):
+        self.header = header
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\r\n")
+
+    def _drain(self):
+        data = self.buffer.getvalue().encode("utf-8")
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def start(self):
+        if not self.header:
+            return b""
+        self.writer.writerow(COLUMN_NAMES)
+        return "\ufeff".encode("utf-8") + self._drain()
+
+    def write(self, records):
+        self.writer.writerows([[_cell_text(record[name]) for name in COLUMN_NAMES] for record in records])
+        return self._drain()
+
+    def finish(self):
+        return b""
+
+class NdjsonWriter:
+    """One feature per line: everything the engine returned, plus the exported columns."""
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, header=True):
+        pass
+
+    def start(self):
+        return b""
+
+    def write(self, records):
+        lines = [json.dumps({**record["data"], **{name: record[name] for name in COLUMN_NAMES}}, ensure_ascii=False)
+                 for record in records]
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+    def finish(self):
+        return b""
+
+class _Sink(io.RawIOBase):
+    """Unseekable file that collects what zipfile writes until it is drained."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+# Not allowed in XML 1.0
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Features" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+class XlsxWriter:
+    """
+    Minimal write-only workbook: one sheet with inline strings, written row by row into a
+    deflated ZIP entry and sent as it is compressed (ZIP data descriptors, no seeking back).
+    A resumed download is a workbook of its own, with a header row.
+    """
+    media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    extension = "xlsx"
+    MAX_ROWS = 1048576 # Excel's limit, header included
+
+    def __init__(self, header=True):
+        self.sink = _Sink()
+        self.zip = zipfile.ZipFile(self.sink, "w", compression=zipfile.ZIP_DEFLATED)
+        self.sheet = None
+        self.row = 0
+        self.letters = [_column_letter(index) for index in range(len(COLUMNS))]
+
+    def _entry(self, name):
+        info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def _cells(self, values):
+        self.row += 1
+        cells = []
+        for letter, (_, numeric), value in zip(self.letters, COLUMNS, values):
+            ref = f"{letter}{self.row}"
+            if value is None or value == "":
+                continue
+            if numeric and isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{ref}"><v>{value!r}</v></c>')
+            else:
+                text = escape(_XML_ILLEGAL.sub("", str(_cell_text(value))))
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        return f'<row r="{self.row}">{"".join(cells)}</row>'
+
+    def start(self):
+        for name, content in _XLSX_PARTS.items():
+            self.zip.writestr(self._entry(name), content)
+        self.sheet = self.zip.open(self._entry("xl/worksheets/sheet1.xml"), "w")
+        self.sheet.write((
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/></sheetView></sheetViews>'
+            '<sheetData>' + self._cells(COLUMN_NAMES)
+        ).encode("utf-8"))
+        return self.sink.drain()
+
+    def write(self, records):
+        rows = [self._cells([record[name] for name in COLUMN_NAMES]) for record in records]
+        self.sheet.write("".join(rows).encode("utf-8"))
+        return self.sink.drain()
+
+    def finish(self):
+        self.sheet.write(b"</sheetData></worksheet>")
+        self.sheet.close()
+        self.zip.close()
+        return self.sink.drain()
+
+WRITERS = {"csv": CsvWriter, "ndjson": NdjsonWriter, "xlsx": XlsxWriter}
@@ -1,17 +1,52 @@
+import asyncio
+import copy
+import io
+import logging
 import re
+import threading
+import time
 
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import cascade
+import image_preprocess
+import ingest
+import metrics
+import rasterizer
+import result_cache
+import revisions
+import roi_detect
+import tiling
+import tolerance_normalizer
+from engine_client import engine_loop
+from engine_router import EngineRouter
+
+logger = logging.getLogger(__name__)
+
+# Pages of one document extracted in parallel, and a hard cap on pages per upload
+PAGE_CONCURRENCY = int(os.environ.get("PAGE_CONCURRENCY", 4))
+MAX_PAGES = int(os.environ.get("MAX_PAGES", 50))
+
+ALLOWED_CONTENT_TYPES = ingest.ALLOWED_CONTENT_TYPES
 
 # --- CLOUD AI INTEGRATION ---
 gemini_client = None
 qwen_client = None
+fast_client = None # Small model answering first with CASCADE_FAST_MODEL (cascade.py)
+router = EngineRouter([])
+fast_router = EngineRouter([])
 init_error = None
+_init_lock = threading.Lock()
 
 def init_reader():
     """
     Initializes Cloud Clients. Checks for API keys.
+    Every engine with a key is started, so the router can fail over or hedge between them.
     """
-    global gemini_client, qwen_client, init_error
+    global gemini_client, qwen_client, fast_client, router, fast_router, init_error
     
     init_error = "No Cloud Keys Found"
 
@@ -19,127 +54,652 @@ def init_reader():
     qwen_key = os.environ.get("QWEN_API_KEY")
     if qwen_key:
         try:
-            print(f"DEBUG: Found QWEN_API_KEY: {qwen_key[:5]}...")
+            logger.debug(f"Found QWEN_API_KEY: {qwen_key[:5]}...")
             from qwen_processor import QwenProcessor
             base_url = os.environ.get("QWEN_BASE_URL")
             model = os.environ.get("QWEN_MODEL", "qwen/qwen-2.5-vl-72b-instruct") 
-            print(f"🚀 Initializing Qwen 2.5... (Model: {model})")
+            logger.info(f"🚀 Initializing Qwen 2.5... (Model: {model})")
             qwen_client = QwenProcessor(api_key=qwen_key, base_url=base_url, model=model)
-            print("✅ Qwen 2.5 Connected.")
+            logger.info("✅ Qwen 2.5 Connected.")
             init_error = None
-            return # Success
+            if cascade.enabled():
+                fast_client = QwenProcessor(api_key=qwen_key, base_url=cascade.CASCADE_FAST_BASE_URL or base_url, model=cascade.CASCADE_FAST_MODEL)
+                fast_router = EngineRouter([fast_client])
+                logger.info(f"🪜 Cascade on: {cascade.CASCADE_FAST_MODEL} answers first, {model} takes doubtful pages.")
         except Exception as e:
             init_error = f"Qwen Init Failed: {str(e)}"
-            print(f"⚠️ Failed to connect to Qwen: {e}")
+            logger.error(f"⚠️ Failed to connect to Qwen: {e}")
 
     # Check Gemini Second
     gemini_key = os.environ.get("GEMINI_API_KEY")
-    if gemini_key and not qwen_client:
-        print("🚀 Gemini AI Detected. Initializing Cloud Engine...")
+    if gemini_key:
+        logger.info("🚀 Gemini AI Detected. Initializing Cloud Engine...")
         try:
              from gemini_processor import GeminiProcessor
              gemini_client = GeminiProcessor(gemini_key)
-             print("✅ Gemini Pro Connected.")
+             logger.info("✅ Gemini Pro Connected.")
              init_error = None
-             return
         except Exception as e:
-            init_error = f"Gemini Init Failed: {str(e)}"
-            print(f"⚠️ Failed to connect to Gemini: {e}")
+            if not qwen_client:
+                init_error = f"Gemini Init Failed: {str(e)}"
+            logger.error(f"⚠️ Failed to connect to Gemini: {e}")
+
+    router = EngineRouter(_active_clients())
             
     if init_error:
-        print(f"❌ Critical Error: {init_error}")
+        logger.critical(f"❌ Critical Error: {init_error}")
+
+def ensure_reader():
+    """
+    init_reader() unless an engine is already up. Requests that arrive during the
+    background warm-up (warmup.py) wait for it instead of starting a second initialization.
+    """
+    if gemini_client is None and qwen_client is None:
+        with _init_lock:
+            if gemini_client is None and qwen_client is None:
+                init_reader()
+
+def probe_engines(timeout=30):
+    """One tiny API call per engine, which opens its connection (DNS, TCP, TLS) before the first drawing. {engine_id: error or None}."""
+    results = {}
+    for client in _active_clients() + ([fast_client] if fast_client else []):
+        try:
+            engine_loop.run(asyncio.wait_for(client.probe(), timeout))
+            results[client.engine_id] = None
+        except Exception as e:
+            logger.warning(f"⚠️ Warm-up probe of {client.engine_id} failed: {e}", extra={"engine": client.engine_id})
+            results[client.engine_id] = str(e) or type(e).__name__
+    return results
 
 def get_active_engine():
-    """Returns the name of the currently active engine."""
+    """Returns the name of the engine that currently takes new requests (skipping open circuits)."""
     global qwen_client, gemini_client, init_error
-    if qwen_client:
+    primary = router.primary()
+    if primary is not None and primary is qwen_client:
         return f"Qwen 2.5 VL (Cloud)"
-    if gemini_client:
+    if primary is not None and primary is gemini_client:
         return "Gemini Flash 2.0 (Cloud)"
     return f"NONE - {init_error or 'No Engine Loaded'}"
 
-def process_file(file_path):
-    # Ensure init
-    global gemini_client, qwen_client
-    if gemini_client is None and qwen_client is None:
-        init_reader()
+def _active_clients():
+    """Engines in priority order."""
+    return [client for client in (qwen_client, gemini_client) if client]
 
-    # --- PRIORITY 1: QWEN 2.5 (Vision) ---
-    if qwen_client:
-        print("🧠 Processing with Qwen 2.5 VL...")
-        try:
-             # Handle PDFs by converting to image first
-             target_path = file_path
-             if str(file_path).lower().endswith('.pdf'):
-                from pdf2image import convert_from_path
-                images = convert_from_path(file_path)
-                if images:
-                    target_path = file_path + "_temp.png"
-                    images[0].save(target_path)
-            
-             results = qwen_client.extract_data(target_path)
-             
-             # Cleanup
-             if target_path != file_path and os.path.exists(target_path):
-                 os.remove(target_path)
-             
-             if results:
-                 # --- ENRICHMENT STEP: ISO TOLERANCES ---
-                 try:
-                     # Lazy import to avoid circular dep issues during startup if any
-                     from iso_fits import calculate_iso_limits
-                     
-                     for item in results:
-                         # Only enrich Dimensions (Linear/Diameter)
-                         if item.get("type") == "Dimension" and item.get("subtype") in ["Diameter", "Linear", "Basic"]:
-                             tol = item.get("tolerance", "")
-                             val = str(item.get("value", "0")).replace("Ø", "").strip()
-                             
-                             # Check for ISO code patterns (e.g. H7, g6, f7)
-                             # Heuristic: Starts with letter, length <= 4
-                             if tol and len(tol) <= 5 and tol[0].isalpha():
-                                 limits = calculate_iso_limits(val, tol)
-                                 if limits:
-                                     item["calculated_limits"] = limits  # Add new field
-                 except ImportError:
-                     print("⚠️ ISO Fits library not found. Skipping enrichment.")
-                 except Exception as e:
-                     print(f"⚠️ ISO Enrichment Failed: {e}")
-                                 
-                 return results
-        except Exception as e:
-            print(f"Qwen Error: {e}")
+def _cache_key(clients, file_hash):
+    """
+    The key covers the file content, every engine/model in the fallback chain,
+    their prompt text and the preprocessing settings, so a prompt or model change never serves stale results.
+    """
+    if file_hash is None or not clients:
+        return None
+    engine_ids = ",".join(client.engine_id for client in clients)
+    prompt_hash = "|".join([client.prompt_fingerprint() for client in clients]
+                           + [image_preprocess.settings_fingerprint(), roi_detect.settings_fingerprint(),
+                              cascade.settings_fingerprint() if fast_router else "cascade:off"])
+    return result_cache.make_key(file_hash, engine_ids, prompt_hash)
 
-    # --- PRIORITY 2: CLOUD AI (GEMINI) ---
-    if gemini_client:
-        print("🧠 Processing with Gemini Pro...")
-        try:
-            # Gemini handles PDFs/Images natively or via PIL.
-            # Convert PDF to image if needed first
-            target_path = file_path
-            
-            # If PDF, convert first page to image for Gemini (simplification for now)
-            # Full PDF support exists but image is safer for "Vision" endpoint usually
-            if str(file_path).lower().endswith('.pdf'):
-                images = convert_from_path(file_path)
-                if images:
-                    # Save temporary image for Gemini
-                    target_path = file_path + "_temp.png"
-                    images[0].save(target_path)
-            
-            results = gemini_client.extract_data(target_path)
-            
-            # Cleanup temp
-            if target_path != file_path and os.path.exists(target_path):
-                os.remove(target_path)
-                
-            if results:
-                return results
+def enrich_iso_limits(results):
+    """
+    --- ENRICHMENT STEP: ISO TOLERANCES ---
+    Adds 'calculated_limits' to dimensions toleranced with an ISO code (e.g. H7, g6, f7).
+    All candidates are resolved in one vectorized lookup.
+    """
+    try:
+        # Lazy import to avoid circular dep issues during startup if any
+        from iso_fits import calculate_iso_limits_batch
+
+        candidates = []
+        for item in results:
+            # Only enrich Dimensions (Linear/Diameter)
+            if item.get("type") == "Dimension" and item.get("subtype") in ["Diameter", "Linear", "Basic"]:
+                tol = item.get("tolerance", "")
+
+                # Check for ISO code patterns (e.g. H7, g6, f7)
+                # Heuristic: Starts with letter, length <= 4
+                if tol and len(tol) <= 5 and tol[0].isalpha():
+                    candidates.append(item)
+
+        if candidates:
+            nominals = [str(item.get("value", "0")).replace("Ø", "").strip() for item in candidates]
+            codes = [item["tolerance"] for item in candidates]
+            for item, limits in zip(candidates, calculate_iso_limits_batch(nominals, codes)):
+                if limits:
+                    item["calculated_limits"] = limits  # Add new field
+    except ImportError:
+        logger.warning("⚠️ ISO Fits library not found. Skipping enrichment.")
+    except Exception as e:
+        logger.warning(f"⚠️ ISO Enrichment Failed: {e}")
+    return results
+
+def _open_image(source):
+    """PIL image from a path or from in-memory bytes."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+def _extract_image(image, timing=None, deferred=None):
+    """
+    Routes one prepared image to the engines. Returns (results, engine_id).
+    With a cascade (cascade.py), the fast model answers first and the image only goes to the
+    large model if that answer looks doubtful. With a `deferred` list, the large model's turn is
+    appended to it for a background refinement instead, and the fast answer is returned.
+    """
+    if not fast_router:
+        return router.extract(image)
+    with metrics.stage("cascade_fast"):
+        results, engine_id = fast_router.extract(image)
+    verdict = cascade.assess(results)
+    if timing is not None:
+        timing["cascade"] = verdict
+    if not verdict["escalate"]:
+        metrics.CASCADE_PAGES.inc(outcome="accepted")
+        return results, engine_id
+    if deferred is not None and engine_id:
+        metrics.CASCADE_PAGES.inc(outcome="deferred")
+        verdict["refine"] = "pending"
+        deferred.append(image)
+        return results, engine_id
+
+    metrics.CASCADE_PAGES.inc(outcome="escalated")
+    logger.info(f"🪜 Escalating to the large model ({verdict['reason']}, confidence {verdict['confidence']})", extra=verdict)
+    accurate, accurate_id = router.extract(image)
+    if not accurate_id:
+        # Large model failed too: the fast answer is better than nothing
+        return results, engine_id
+    return cascade.score(accurate), accurate_id
+
+def _prepare_page(source, timing, mosaic=None):
+    """
+    Preprocessed payload of a page. With ROI_MODE=on a sparse page is reduced to a mosaic of its
+    annotated regions (roi_detect.py); a given mosaic (the changed regions of a revision) is sent as is.
+    Returns (prepared, mosaic or None); _remap_boxes() maps the engine's boxes back onto the page either way.
+    """
+    if mosaic is None and roi_detect.ROI_MODE == "on":
+        with metrics.stage("roi"):
+            if isinstance(source, Image.Image):
+                mosaic = roi_detect.build_mosaic(source)
             else:
-                print("Gemini returned empty results.")
-        except Exception as e:
-             print(f"Gemini Application Error: {e}")
+                with _open_image(source) as image:
+                    mosaic = roi_detect.build_mosaic(image)
+        timing["roi"] = mosaic.stats if mosaic is not None else None
+
+    with metrics.stage("prepare") as prepare:
+        if mosaic is not None:
+            # Cut from the page: no trimming or deskew, so the coordinate map stays exact
+            prepared = image_preprocess.prepare_image(mosaic.image, trim=False, deskew=False)
+        else:
+            prepared = image_preprocess.prepare_image(source)
+    timing["prepare_seconds"] = round(prepare.seconds, 3)
+    timing["payload"] = prepared.stats()
+    return prepared, mosaic
+
+def _remap_boxes(prepared, mosaic, results):
+    # Boxes refer to the trimmed/downscaled payload (or the mosaic), report them on the page
+    prepared.remap_boxes(results)
+    if mosaic is not None:
+        mosaic.remap_boxes(results)
+    return results
+
+def _find_revision(source, file_hash, page_number, timing, user_id=None):
+    """
+    revisions.Revision of a page, None with revision reuse off, for anonymous uploads (whose previous
+    revisions cannot be told apart from other people's) or when the page cannot be fingerprinted.
+    """
+    if not file_hash or user_id is None or not revisions.enabled():
+        return None
+    try:
+        with metrics.stage("revision"):
+            if isinstance(source, Image.Image):
+                revision = revisions.find(source, file_hash, page_number, user_id)
+            else:
+                with _open_image(source) as image:
+                    revision = revisions.find(image, file_hash, page_number, user_id)
+    except Exception as e:
+        logger.warning(f"⚠️ Revision lookup failed, extracting page {page_number} whole: {e}", extra={"page": page_number})
+        return None
+    if revision.stats is not None:
+        timing["revision"] = revision.stats
+    return revision
+
+def _extract_tiled(source):
+    """Large-format sheet: overlapping full-resolution tiles; with ROI_MODE=on, tiles without annotations are skipped."""
+    if not isinstance(source, Image.Image):
+        source = _open_image(source)
+    regions = None
+    if roi_detect.ROI_MODE == "on":
+        with metrics.stage("roi"):
+            regions = roi_detect.annotated_regions(source)
+    return tiling.extract_tiled(source, _extract_image, regions)
+
+def _process_page(file_path, page_number, is_pdf, size_pt=None, file_hash=None, refinements=None, user_id=None):
+    """
+    Renders (PDFs only), preprocesses and extracts a single page.
+    Every feature is tagged with its 1-based page number.
+    A page that is a revision of a stored one only has its changed regions extracted (revisions.py).
+    With a `refinements` list, a page the cascade would escalate is answered by the fast model and
+    (page_number, prepared, mosaic) is appended for _refine().
+    """
+    revision = None
+    rendered = None
+    started = time.perf_counter()
+    timing = {"page": page_number}
+    try:
+        source = file_path
+        if is_pdf:
+            # Render just this page, at a DPI matching its sheet size
+            with metrics.stage("render") as render:
+                rendered = rasterizer.render_page(file_path, page_number, size_pt=size_pt)
+                source = rendered.open()
+            timing["dpi"] = rendered.dpi
+            timing["render_seconds"] = round(render.seconds, 3)
+            size = source.size
+        else:
+            # Header only, pixels are decoded by the preprocessing stage
+            with _open_image(file_path) as probe:
+                size = probe.size
 
-    # --- NO ENGINE AVAILABLE ---
-    print("❌ No active extraction engine available. Please check API Keys.")
-    return []
+        if tiling.should_tile(*size):
+            # Large-format sheet: overlapping full-resolution tiles instead of one downscaled page
+            with metrics.stage("extract") as extract:
+                results, engine_id, tiles = _extract_tiled(source)
+            timing["tiles"] = tiles
+        else:
+            revision = _find_revision(source, file_hash, page_number, timing, user_id)
+            reuse = revision is not None and revision.match is not None
+            if reuse and revision.mosaic is None:
+                # Unchanged since the previous revision: nothing to send
+                with metrics.stage("extract") as extract:
+                    results, engine_id = revision.merge([]), revision.engine
+            else:
+                prepared, mosaic = _prepare_page(source, timing, revision.mosaic if reuse else None)
+                logger.debug(
+                    f"🗜️ Page {page_number}: {prepared.original_bytes} -> {len(prepared.data)} bytes "
+                    f"({prepared.mime_type}, ~{timing['payload']['tokens']['qwen']} image tokens)",
+                    extra={"page": page_number, "bytes": len(prepared.data), "mime_type": prepared.mime_type},
+                )
+
+                # Revisions merge carried-over features into the page, a later refinement would drop them
+                deferred = [] if refinements is not None and not reuse else None
+                with metrics.stage("extract") as extract:
+                    results, engine_id = _extract_image(prepared, timing, deferred)
+                _remap_boxes(prepared, mosaic, results)
+                if deferred:
+                    refinements.append((page_number, prepared, mosaic))
+                if reuse:
+                    results = revision.merge(results)
+        timing["extract_seconds"] = round(extract.seconds, 3)
+        timing["engine"] = engine_id
+        if revision is not None and engine_id:
+            revision.remember()
+    except Exception as e:
+        logger.error(f"⚠️ Page {page_number} failed: {e}", extra={"page": page_number})
+        results = []
+        timing["error"] = str(e)
+    finally:
+        # Hands the bitmap's share of the render memory budget back
+        if rendered is not None:
+            rendered.close()
+
+    for item in results:
+        item["page"] = page_number
+    timing["features"] = len(results)
+    timing["seconds"] = round(time.perf_counter() - started, 3)
+    _record_page(timing)
+    return results, timing
+
+def _record_page(timing):
+    metrics.PAGES.inc(outcome="error" if "error" in timing else "ok")
+    metrics.FEATURES.inc(timing["features"])
+    logger.info(f"📄 Page {timing['page']}: {timing['features']} feature(s) in {timing['seconds']}s",
+                extra={key: value for key, value in timing.items() if key != "payload"})
+
+def _page_layout(file_path, is_pdf=None):
+    """(is_pdf, number of pages to extract, {page: size in points})."""
+    if is_pdf is None:
+        is_pdf = isinstance(file_path, str) and file_path.lower().endswith('.pdf')
+    page_count = min(rasterizer.page_count(file_path), MAX_PAGES) if is_pdf else 1
+    sizes = rasterizer.page_sizes(file_path, 1, page_count) if is_pdf else {}
+    return is_pdf, page_count, sizes
+
+def process_document(file_path, file_hash=None, is_pdf=None, on_refined=None, user_id=None):
+    """
+    Extracts every page of a drawing set.
+    Pages are rendered and sent to the engines concurrently (at most PAGE_CONCURRENCY at once),
+    so a whole set takes about as long as its slowest page.
+    file_path may also be the bytes of an image. A known file_hash saves re-reading the file for the cache key.
+    With CASCADE_REFINE=background and on_refined, pages the cascade escalates are returned as the fast
+    model read them ("refinement": {"status": "pending"}); on_refined(document) receives the refined document.
+    user_id is the uploader, whose stored drawings revisions are matched against.
+    Returns {"results": [...], "pages": [...per-page timing...], "seconds": total, "cached": bool}.
+    """
+    ensure_reader()
+
+    with metrics.stage("document"):
+        return _process_document(file_path, file_hash, is_pdf, on_refined, user_id)
+
+def _process_document(file_path, file_hash, is_pdf, on_refined=None, user_id=None):
+    started = time.perf_counter()
+    clients = _active_clients()
+    if not clients:
+        # --- NO ENGINE AVAILABLE ---
+        logger.error("❌ No active extraction engine available. Please check API Keys.")
+        return {"results": [], "pages": [], "seconds": 0.0, "cached": False}
+
+    file_hash = _revision_hash(file_path, file_hash)
+    cache_key, cached = _lookup(file_path, clients, file_hash)
+    if cached is not None:
+        cached["cached"] = True
+        if cached["results"] and "normalized" not in cached["results"][0]:
+            # Cached before the normalizer existed
+            tolerance_normalizer.normalize_features(cached["results"])
+        return cached
+
+    with metrics.stage("layout"):
+        is_pdf, page_count, sizes = _page_layout(file_path, is_pdf)
+    logger.info(f"🧠 Processing {page_count} page(s) with {clients[0].engine_id}...",
+                extra={"pages": page_count, "engine": clients[0].engine_id})
+
+    refinements = [] if fast_router and on_refined is not None and cascade.CASCADE_REFINE == "background" else None
+    workers = max(1, min(PAGE_CONCURRENCY, page_count))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="page") as pool:
+        pages = list(pool.map(
+            lambda n: _process_page(file_path, n, is_pdf, sizes.get(n), file_hash, refinements, user_id),
+            range(1, page_count + 1),
+        ))
+
+    # Merge in page order
+    results = [item for page_results, _ in pages for item in page_results]
+    with metrics.stage("enrich_iso"):
+        enrich_iso_limits(results)
+    # Typed nominal / deviations / modifiers for every feature, one batch pass
+    with metrics.stage("normalize"):
+        tolerance_normalizer.normalize_features(results)
+
+    document = {
+        "results": results,
+        "pages": [timing for _, timing in pages],
+        "seconds": round(time.perf_counter() - started, 3),
+        "cached": False,
+    }
+
+    if refinements:
+        # Only the refined document is cached
+        document["refinement"] = {"status": "pending", "pages": sorted(number for number, _, _ in refinements)}
+        cascade.refine_later(_refine, copy.deepcopy(document), refinements, cache_key, clients, on_refined)
+        return document
+    _store(cache_key, document, clients)
+    return document
+
+def _refine(document, refinements, cache_key, clients, on_refined):
+    """Background half of the cascade: the large model reads the deferred pages and their features are replaced."""
+    started = time.perf_counter()
+    by_page = {}
+    for item in document["results"]:
+        by_page.setdefault(item.get("page"), []).append(item)
+    timings = {timing["page"]: timing for timing in document["pages"]}
+    for number, prepared, mosaic in refinements:
+        timing = timings[number]
+        with metrics.stage("extract"):
+            results, engine_id = router.extract(prepared)
+        if not engine_id:
+            timing["cascade"]["refine"] = "failed"
+            continue
+        _remap_boxes(prepared, mosaic, cascade.score(results))
+        for item in results:
+            item["page"] = number
+        by_page[number] = results
+        timing.update({"engine": engine_id, "features": len(results)})
+        timing["cascade"]["refine"] = "done"
+
+    results = [item for number in sorted(by_page, key=lambda page: page or 0) for item in by_page[number]]
+    with metrics.stage("enrich_iso"):
+        enrich_iso_limits(results)
+    with metrics.stage("normalize"):
+        tolerance_normalizer.normalize_features(results)
+    document["results"] = results
+    document["refinement"] = {
+        "status": "done",
+        "pages": sorted(number for number, _, _ in refinements),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"🪜 Refined {len(refinements)} page(s) with the large model in {document['refinement']['seconds']}s.")
+    _store(cache_key, document, clients)
+    on_refined(document)
+
+def _revision_hash(file_path, file_hash):
+    # Pages are remembered under the file's hash, which the cache lookup would otherwise compute only if enabled
+    if file_hash is None and revisions.enabled() and isinstance(file_path, str):
+        with metrics.stage("hash"):
+            file_hash = result_cache.hash_file(file_path)
+    return file_hash
+
+def _lookup(file_path, clients, file_hash=None):
+    """(cache key, cached document or None). Both None if the cache is off."""
+    if not result_cache.cache.enabled:
+        return None, None
+    if file_hash is None:
+        with metrics.stage("hash"):
+            file_hash = result_cache.hash_file(file_path)
+    cache_key = _cache_key(clients, file_hash)
+    if not cache_key:
+        return None, None
+    with metrics.stage("cache_lookup"):
+        cached = result_cache.cache.get(cache_key)
+    metrics.CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+    if cached is not None:
+        logger.info("⚡ Cache hit, skipping extraction.")
+    return cache_key, cached
+
+def _store(cache_key, document, clients):
+    # Only cache complete documents, a failed page (error, or no engine answered) should be retried next time.
+    # A page the engines answered without features is complete too
+    if cache_key and document["pages"] and not any("error" in timing or not timing.get("engine") for timing in document["pages"]):
+        with metrics.stage("cache_store"):
+            result_cache.cache.put(cache_key, document, engine_id=clients[0].engine_id)
+
+async def _stream_page(file_path, page_number, is_pdf, size_pt, emit, file_hash=None, user_id=None):
+    """
+    Streaming counterpart of _process_page. Calls emit(event) for every feature
+    as soon as the engine has written it, with boxes mapped to the page and ISO limits added.
+    Features carried over from a previous revision are emitted first, before the engine is called.
+    With a cascade, the fast model is streamed; if the large model has to read the page after all,
+    one {"event": "refined"} replaces the page's streamed features.
+    Returns (results, timing).
+    """
+    started = time.perf_counter()
+    timing = {"page": page_number}
+    results = []
+    revision = None
+
+    def finish(items):
+        for item in items:
+            item["page"] = page_number
+        with metrics.stage("enrich_iso"):
+            enrich_iso_limits(items)
+        with metrics.stage("normalize"):
+            tolerance_normalizer.normalize_features(items)
+        return items
+
+    def publish(item):
+        results.append(finish([item])[0])
+        emit({"event": "feature", "feature": item})
+
+    rendered = None
+    try:
+        source = file_path
+        if is_pdf:
+            with metrics.stage("render") as render:
+                rendered = await asyncio.to_thread(rasterizer.render_page, file_path, page_number, size_pt=size_pt)
+                source = rendered.open()
+            timing["dpi"] = rendered.dpi
+            timing["render_seconds"] = round(render.seconds, 3)
+            size = source.size
+        else:
+            with _open_image(file_path) as probe:
+                size = probe.size
+
+        if tiling.should_tile(*size):
+            # Overlapping tiles have to be de-duplicated first, so a tiled page is emitted in one go
+            with metrics.stage("extract") as extract:
+                page_results, engine_id, tiles = await asyncio.to_thread(_extract_tiled, source)
+            timing["tiles"] = tiles
+            for item in page_results:
+                publish(item)
+        else:
+            revision = await asyncio.to_thread(_find_revision, source, file_hash, page_number, timing, user_id)
+            reuse = revision is not None and revision.match is not None
+            if reuse:
+                for item in revision.carried:
+                    publish(item)
+
+            prepared = None
+            if not reuse or revision.mosaic is not None:
+                prepared, mosaic = await asyncio.to_thread(_prepare_page, source, timing, revision.mosaic if reuse else None)
+
+            extract_started = time.perf_counter()
+            engine_id = revision.engine if reuse else None
+            streamed = []
+            # Includes the time spent publishing features, the engine keeps generating meanwhile
+            with metrics.stage("extract") as extract:
+                if prepared is not None:
+                    async for item, engine_id in engine_loop.stream((fast_router or router).stream_async(prepared)):
+                        if item is None:
+                            # The engines answered, but the page has no features
+                            continue
+                        if "first_feature_seconds" not in timing:
+                            timing["first_feature_seconds"] = round(time.perf_counter() - extract_started, 3)
+                            metrics.STAGE_SECONDS.observe(timing["first_feature_seconds"], stage="first_feature")
+                        item = _remap_boxes(prepared, mosaic, [item])[0]
+                        if reuse and revision.carries(item):
+                            # Already sent as a carried-over feature
+                            continue
+                        if fast_router:
+                            cascade.score([item])
+                        streamed.append(item)
+                        publish(item)
+                if prepared is not None and fast_router:
+                    refined, refined_id = await _escalate_streamed(prepared, mosaic, streamed, timing)
+                    if refined_id:
+                        engine_id = refined_id
+                        kept = [item for item in results if not any(item is other for other in streamed)]
+                        results[:] = kept + finish(refined)
+                        emit({"event": "refined", "page": page_number, "features": results})
+        timing["extract_seconds"] = round(extract.seconds, 3)
+        timing["engine"] = engine_id
+        if revision is not None and engine_id:
+            await asyncio.to_thread(revision.remember)
+    except Exception as e:
+        logger.error(f"⚠️ Page {page_number} failed: {e}", extra={"page": page_number})
+        timing["error"] = str(e)
+    finally:
+        if rendered is not None:
+            rendered.close()
+
+    timing["features"] = len(results)
+    timing["seconds"] = round(time.perf_counter() - started, 3)
+    _record_page(timing)
+    return results, timing
+
+async def _escalate_streamed(prepared, mosaic, streamed, timing):
+    """Cascade verdict on a streamed fast answer; (large model's features, engine_id) if it had to read the page, else ([], None)."""
+    verdict = cascade.assess(streamed)
+    timing["cascade"] = verdict
+    if not verdict["escalate"]:
+        metrics.CASCADE_PAGES.inc(outcome="accepted")
+        return [], None
+    metrics.CASCADE_PAGES.inc(outcome="escalated")
+    logger.info(f"🪜 Escalating to the large model ({verdict['reason']}, confidence {verdict['confidence']})", extra=verdict)
+    refined, engine_id = await engine_loop.run_async(router.extract_async(prepared))
+    if not engine_id:
+        return [], None
+    return cascade.score(_remap_boxes(prepared, mosaic, refined)), engine_id
+
+async def stream_document(file_path, file_hash=None, is_pdf=None, user_id=None):
+    """
+    Async generator behind /upload/stream. Yields NDJSON-ready events:
+    {"event": "start"}, one {"event": "feature"} per feature as it is generated,
+    {"event": "refined"} with all features of a page the cascade sent to the large model,
+    {"event": "page"} when a page is complete and a final {"event": "done"}, which also carries
+    the whole document (for storing it) and has to be stripped of it before it is sent.
+    Pages are streamed concurrently (PAGE_CONCURRENCY), so features of different pages interleave.
+    """
+    if gemini_client is None and qwen_client is None:
+        await asyncio.to_thread(ensure_reader)
+
+    started = time.perf_counter()
+    clients = _active_clients()
+    if not clients:
+        logger.error("❌ No active extraction engine available. Please check API Keys.")
+        yield {"event": "error", "message": init_error or "No active extraction engine available"}
+        return
+
+    file_hash = await asyncio.to_thread(_revision_hash, file_path, file_hash)
+    cache_key, cached = await asyncio.to_thread(_lookup, file_path, clients, file_hash)
+    if cached is not None:
+        yield {"event": "start", "pages": len(cached.get("pages") or []), "cached": True}
+        for item in cached["results"]:
+            yield {"event": "feature", "feature": item}
+        yield {"event": "done", "features": len(cached["results"]), "seconds": round(time.perf_counter() - started, 3), "cached": True,
+               "document": {**cached, "cached": True}}
+        return
+
+    with metrics.stage("layout"):
+        is_pdf, page_count, sizes = await asyncio.to_thread(_page_layout, file_path, is_pdf)
+    primary = router.primary()
+    yield {"event": "start", "pages": page_count, "engine": primary.engine_id if primary else None, "cached": False}
+
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(1, PAGE_CONCURRENCY))
+    pages = {}
+
+    async def run_page(number):
+        async with semaphore:
+            pages[number] = await _stream_page(file_path, number, is_pdf, sizes.get(number), queue.put_nowait, file_hash, user_id)
+        queue.put_nowait({"event": "page", **pages[number][1]})
+
+    tasks = [asyncio.create_task(run_page(number)) for number in range(1, page_count + 1)]
+    first_feature = None
+    try:
+        remaining = page_count
+        while remaining:
+            event = await queue.get()
+            if event["event"] == "page":
+                remaining -= 1
+            elif first_feature is None:
+                first_feature = round(time.perf_counter() - started, 3)
+            yield event
+    finally:
+        # Client disconnected: stop the remaining pages
+        for task in tasks:
+            task.cancel()
+
+    document = {
+        "results": [item for number in sorted(pages) for item in pages[number][0]],
+        "pages": [pages[number][1] for number in sorted(pages)],
+        "seconds": round(time.perf_counter() - started, 3),
+        "cached": False,
+    }
+    await asyncio.to_thread(_store, cache_key, document, clients)
+    metrics.STAGE_SECONDS.observe(document["seconds"], stage="document")
+    yield {
+        "event": "done",
+        "features": len(document["results"]),
+        "seconds": document["seconds"],
+        "first_feature_seconds": first_feature,
+        "cached": False,
+        "document": document,
+    }
+
+def process_upload(upload, on_refined=None, user_id=None):
+    """process_document for an ingest.IngestedFile: read from memory, hash and type already known."""
+    with upload.source() as source:
+        return process_document(source, file_hash=upload.sha256, is_pdf=upload.is_pdf, on_refined=on_refined, user_id=user_id)
+
+def process_bytes(data, filename=None):
+    """Extracts a drawing (PDF or image) held in memory."""
+    with ingest.from_bytes(data, filename) as upload:
+        return process_upload(upload)
+
+def process_file(file_path):
+    """Merged feature list of all pages (see process_document for timings)."""
+    return process_document(file_path)["results"]
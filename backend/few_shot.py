@@ -0,0 +1,193 @@
+import hashlib
+import json
+import logging
+import os
+import textwrap
+import threading
+
+import numpy as np
+from PIL import Image
+
+import image_preprocess
+
+# --- CONFIGURATION ---
+FEW_SHOT_DIR = os.environ.get("FEW_SHOT_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "training_data")
+FEW_SHOT_K = int(os.environ.get("FEW_SHOT_K", 2)) # Examples sent per request, 0 disables few-shot
+FEW_SHOT_LONG_EDGE = int(os.environ.get("FEW_SHOT_LONG_EDGE", 1024)) # Examples are downscaled: fewer image tokens each
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff")
+DEFAULT_TYPE = "general"
+SIGNATURE_GRID = 16 # Layout signature: ink density on a 16x16 grid, plus the aspect ratio
+ASPECT_WEIGHT = 4.0 # A long shaft and a square plate differ mostly in shape, not in where the ink is
+
+logger = logging.getLogger(__name__)
+
+def compact(text):
+    """Prompt text without the source-code indentation, which would otherwise be sent (and billed) on every call."""
+    return textwrap.dedent(text).strip()
+
+def estimate_text_tokens(text):
+    # ~4 characters per token for English and JSON
+    return (len(text) + 3) // 4
+
+def layout_signature(image):
+    """
+    Coarse description of where the ink is on a drawing, compared by distance to pick
+    the examples that look most like the request. Computed on a thumbnail, so it takes milliseconds.
+    """
+    thumb = image.convert("L").resize((SIGNATURE_GRID, SIGNATURE_GRID), Image.BOX)
+    ink = 1.0 - np.asarray(thumb, dtype=np.float32) / 255.0
+    total = ink.sum()
+    density = ink.ravel() / total if total > 0 else ink.ravel()
+    aspect = np.float32(ASPECT_WEIGHT * np.log(image.width / max(1, image.height)))
+    return np.append(density * SIGNATURE_GRID, aspect)
+
+def signature_of(prepared):
+    """Layout signature of a prepared image, computed on first use and kept on it."""
+    if "layout_signature" not in prepared.derived:
+        with prepared.to_pil() as image:
+            prepared.derived["layout_signature"] = layout_signature(image)
+    return prepared.derived["layout_signature"]
+
+class Example:
+    """One image/answer pair, encoded once when the store is loaded."""
+
+    def __init__(self, name, drawing_type, prepared, features, signature):
+        self.name = name
+        self.drawing_type = drawing_type
+        self.prepared = prepared
+        self.features = features
+        self.signature = signature
+        # Compact JSON, exactly what the model should answer for this image
+        self.answer = json.dumps(features, ensure_ascii=False, separators=(",", ":"))
+        self.data_url = prepared.data_url()
+        image_tokens = prepared.stats()["tokens"]
+        text_tokens = estimate_text_tokens(self.answer) + 10
+        self.tokens = {engine: count + text_tokens for engine, count in image_tokens.items()}
+
+class FewShotStore:
+    """
+    Example drawings from FEW_SHOT_DIR: `name.png` + `name.json` pairs, optionally in one
+    sub-directory per drawing type (e.g. training_data/lathe/shaft1.png). The JSON is either the
+    feature array the model should return, or {"drawing_type": ..., "features": [...]}.
+    Images are preprocessed and base64-encoded once; each request gets the FEW_SHOT_K closest examples.
+    """
+
+    def __init__(self, directory=FEW_SHOT_DIR, k=FEW_SHOT_K, long_edge=FEW_SHOT_LONG_EDGE):
+        self.directory = directory
+        self.k = k
+        self.long_edge = long_edge
+        self.examples = []
+        self.by_type = {}
+        self._lock = threading.Lock()
+
+    def _pairs(self):
+        if not os.path.isdir(self.directory):
+            return
+        for folder, _, files in sorted(os.walk(self.directory)):
+            for filename in sorted(files):
+                stem, ext = os.path.splitext(filename)
+                if ext.lower() not in IMAGE_EXTENSIONS:
+                    continue
+                answer_path = os.path.join(folder, stem + ".json")
+                if os.path.exists(answer_path):
+                    yield os.path.join(folder, filename), answer_path
+
+    def load(self):
+        examples = []
+        for image_path, answer_path in self._pairs():
+            name = os.path.relpath(os.path.splitext(image_path)[0], self.directory).replace(os.sep, "/")
+            try:
+                with open(answer_path, encoding="utf-8") as f:
+                    answer = json.load(f)
+                folder = os.path.dirname(name)
+                drawing_type = DEFAULT_TYPE if not folder else folder.split("/")[0]
+                if isinstance(answer, dict):
+                    drawing_type = answer.get("drawing_type") or drawing_type
+                    answer = answer.get("features", [])
+                if not isinstance(answer, list):
+                    raise ValueError("expected a feature array")
+                prepared = image_preprocess.prepare_image(image_path, long_edge=self.long_edge)
+                # Taken from the prepared image, like the signature of a request
+                signature = signature_of(prepared)
+                examples.append(Example(name, drawing_type, prepared, answer, signature))
+            except Exception as e:
+                logger.warning(f"⚠️ Skipping few-shot example {name}: {e}", extra={"example": name})
+
+        by_type = {}
+        for example in examples:
+            by_type.setdefault(example.drawing_type, []).append(example)
+        with self._lock:
+            self.examples = examples
+            self.by_type = by_type
+        if examples:
+            logger.info(f"📚 Loaded {len(examples)} few-shot example(s) of {len(by_type)} drawing type(s), sending {self.k} per request.",
+                        extra={"examples": len(examples), "types": sorted(by_type), "k": self.k})
+        return self
+
+    def fingerprint(self):
+        """Changes when the examples or k change (part of the result cache key)."""
+        digest = hashlib.sha256(f"k={self.k}".encode("utf-8"))
+        for example in self.examples:
+            digest.update(f"\x00{example.name}\x00{example.drawing_type}\x00{example.answer}".encode("utf-8"))
+            digest.update(hashlib.sha256(example.prepared.data).digest())
+        return digest.hexdigest()[:16]
+
+    def classify(self, signature):
+        """Drawing type of the closest example."""
+        if not self.examples:
+            return None
+        return min(self.examples, key=lambda example: np.abs(example.signature - signature).sum()).drawing_type
+
+    def select(self, prepared, k=None):
+        """
+        The k examples most relevant to a request: the closest ones of its drawing type first,
+        then the closest of other types. Returned in a fixed order (by name), so the same selection
+        always yields the same prompt prefix and provider-side prompt caching can reuse it.
+        """
+        k = self.k if k is None else k
+        if k <= 0 or not self.examples:
+            return ()
+        if len(self.examples) <= k:
+            return tuple(self.examples)
+        signature = signature_of(prepared)
+        drawing_type = self.classify(signature)
+        ranked = sorted(
+            self.examples,
+            key=lambda example: (example.drawing_type != drawing_type, float(np.abs(example.signature - signature).sum())),
+        )
+        return tuple(sorted(ranked[:k], key=lambda example: example.name))
+
+    def stats(self, engine):
+        """Estimated prompt tokens the examples add per request for an engine ('qwen' | 'gemini')."""
+        costs = sorted(example.tokens[engine] for example in self.examples)
+        k = min(self.k, len(costs))
+        return {
+            "directory": self.directory,
+            "examples": len(self.examples),
+            "types": {drawing_type: len(examples) for drawing_type, examples in sorted(self.by_type.items())},
+            "k": self.k,
+            "example_tokens_min": sum(costs[:k]),
+            "example_tokens_max": sum(costs[-k:]) if k else 0,
+        }
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """The shared store, loaded on first use (engine initialization at startup)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FewShotStore().load()
+        return _store
+
+if __name__ == "__main__":
+    # Prompt cost of every k, to weigh accuracy against per-call latency and cost
+    logging.basicConfig(level=logging.INFO)
+    store = get_store()
+    print(f"{len(store.examples)} example(s) in {store.directory}")
+    for engine in ("qwen", "gemini"):
+        costs = sorted(example.tokens[engine] for example in store.examples)
+        for k in range(len(costs) + 1):
+            print(f"  {engine:<7} k={k}: +{sum(costs[:k])} to +{sum(costs[-k:]) if k else 0} prompt tokens")
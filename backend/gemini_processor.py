@@ -1,27 +1,45 @@
 import google.generativeai as genai
+import asyncio
 import os
-import json
-from pathlib import Path
-from PIL import Image
+import hashlib
+import logging
+import few_shot
+import metrics
+from engine_client import CONTINUE_PROMPT, TRUNCATED, AsyncEngine, continuation_answer, engine_limits
 
-class GeminiProcessor:
+logger = logging.getLogger(__name__)
+
+class GeminiProcessor(AsyncEngine):
     def __init__(self, api_key):
         if not api_key:
             raise ValueError("API Key is required for Gemini Processor")
         genai.configure(api_key=api_key)
         # Use the flash model for speed and cost, or pro-vision for max intelligence
         # Switching to gemini-flash-latest for stability/quota availability
-        self.model = genai.GenerativeModel('gemini-flash-latest')
-        self.training_dir = Path("backend/training_data")
-        self.training_dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = 'gemini-flash-latest'
+        self.model = genai.GenerativeModel(self.model_name)
+        self.engine_id = f"gemini:{self.model_name}"
+        # The SDK keeps its own (gRPC/REST) channel; concurrency and quotas are enforced by AsyncEngine
+        self.setup_limits(**engine_limits("GEMINI", rpm=60))
+
+        # Example pairs from backend/training_data (see few_shot.py), encoded once for all requests
+        self.few_shot = few_shot.get_store()
+        self.system_prompt = few_shot.compact(self.load_training_examples())
+        self.prompt = few_shot.compact(self.get_prompt())
+        self._prompt_tokens = few_shot.estimate_text_tokens(self.system_prompt) + few_shot.estimate_text_tokens(self.prompt)
+        self._fingerprint = hashlib.sha256(
+            "\x00".join((self.system_prompt, self.prompt, self.few_shot.fingerprint())).encode("utf-8")
+        ).hexdigest()[:16]
+        self._prefixes = {} # Selected example names -> contents before the request image
+
+    async def probe(self):
+        await asyncio.to_thread(genai.get_model, f"models/{self.model_name}")
 
     def load_training_examples(self):
         """
-        Loads user-provided 'training' data to teach the AI what to look for.
-        Looks for pairs of files: example1.png + example1.json inside backend/training_data/
+        System instruction. The example image/JSON pairs themselves come from the
+        few-shot store and are added per request by _prefix().
         """
-        history = []
-        
         # Simple schema instruction for the system (system prompt equivalent)
         system_instruction = """
         You are an expert GD&T (Geometric Dimensioning and Tolerancing) Extractor.
@@ -38,15 +56,10 @@ class GeminiProcessor:
           }
         ]
         """
-        
-        # We can simulate few-shot by adding them as text/image turns effectively
-        # For simplicity in the prompt construction, we'll append them.
         return system_instruction
 
-    def extract_data(self, image_path):
-        system_prompt = self.load_training_examples()
-        
-        prompt = """
+    def get_prompt(self):
+        return """
         Analyze this engineering drawing with high precision.
         
         CRITICAL INSTRUCTIONS:
@@ -99,38 +112,115 @@ class GeminiProcessor:
         
         Analyze the image and Return ONLY a JSON Array.
         """
+
+    def prompt_fingerprint(self):
+        """Changes whenever the prompts or the few-shot examples change, so cached results are invalidated."""
+        return self._fingerprint
+
+    def estimate_request_tokens(self, prepared):
+        few_shot_tokens = self.few_shot.stats("gemini")["example_tokens_max"]
+        return self._prompt_tokens + few_shot_tokens + prepared.stats()["tokens"]["gemini"] + 2000
+
+    def prompt_stats(self):
+        return {"text_tokens": self._prompt_tokens, "few_shot": self.few_shot.stats("gemini")}
+
+    def _prefix(self, examples):
+        """System instruction followed by each example image and its answer, built once per selection."""
+        key = tuple(example.name for example in examples)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = [self.system_prompt]
+            for example in examples:
+                prefix += [
+                    "Example drawing:",
+                    {"mime_type": example.prepared.mime_type, "data": example.prepared.data},
+                    f"Output: {example.answer}",
+                ]
+            self._prefixes[key] = prefix
+        return prefix
+
+    def _encode(self, prepared):
+        with metrics.stage("encode"):
+            # Converted to the request proto once instead of on every attempt
+            prepared.derived["gemini_part"] = genai.protos.Part(
+                inline_data=genai.protos.Blob(mime_type=prepared.mime_type, data=prepared.data)
+            )
+        with metrics.stage("few_shot"):
+            self.few_shot.select(prepared)
+
+    def _request(self, prepared, continuation=None):
+        # Signature and image part cached on `prepared` by _encode
+        examples = self.few_shot.select(prepared)
+        
+        img = prepared.derived.get("gemini_part") or {"mime_type": prepared.mime_type, "data": prepared.data}
+        # Use a slightly higher temperature to encourage creative extraction but strict JSON
+        generation_config = genai.types.GenerationConfig(
+            temperature=0.2, # Low temp for precision
+            candidate_count=1
+        )
+        contents = self._prefix(examples) + [self.prompt, img]
+        if continuation is not None:
+            # Follow-up for a cut-off answer: what arrived so far, then ask for the rest
+            contents = [
+                {"role": "user", "parts": contents},
+                {"role": "model", "parts": [continuation_answer(continuation)]},
+                {"role": "user", "parts": [CONTINUE_PROMPT]},
+            ]
+        return contents, generation_config
+
+    async def _call(self, prepared, continuation=None):
+        contents, generation_config = self._request(prepared, continuation)
+        response = await self.model.generate_content_async(
+            contents,
+            generation_config=generation_config
+        )
         
+        self._record_usage_metadata(response)
+
+        # Parsed (fences, cut-off tails and all) by AsyncEngine
         try:
-            img = Image.open(image_path)
-            # Use a slightly higher temperature to encourage creative extraction but strict JSON
-            generation_config = genai.types.GenerationConfig(
-                temperature=0.2, # Low temp for precision
-                candidate_count=1
-            )
-            
-            response = self.model.generate_content(
-                [system_prompt, prompt, img],
-                generation_config=generation_config
-            )
-            
-            # Clean response to ensure json
             text = response.text.strip()
-            
-            # Debug: Print raw text to console (visible in Coolify logs)
-            print(f"GEMINI RAW RESPONSE: {text[:200]}...")
-
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0]
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0]
-            
-            # Handle case where AI returns plain text list without code blocks
-            if not text.startswith('[') and '[' in text:
-                text = text[text.find('['):text.rfind(']')+1]
-
-            return json.loads(text)
-            
-        except Exception as e:
-            print(f"Gemini Application Error: {e}")
-            # print(f"Failed Text was: {response.text}") # Uncomment if needed
-            return []
+        except ValueError:
+            # No text parts, e.g. the output limit was hit before any text
+            text = ""
+        
+        # Raw text for debugging extraction problems (LOG_LEVEL=DEBUG)
+        logger.debug(f"GEMINI RAW RESPONSE: {text[:200]}...")
+
+        return text, self._truncated(response)
+
+    def _truncated(self, response):
+        candidates = getattr(response, "candidates", None)
+        if not candidates:
+            return False
+        reason = candidates[0].finish_reason
+        return getattr(reason, "name", reason) == "MAX_TOKENS"
+
+    def _record_usage_metadata(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.record_usage(usage.prompt_token_count, usage.candidates_token_count)
+
+    async def _stream(self, prepared):
+        """Text deltas of a streamed generation."""
+        contents, generation_config = self._request(prepared)
+        response = await self.model.generate_content_async(
+            contents,
+            generation_config=generation_config,
+            stream=True
+        )
+        last = None
+        async for chunk in response:
+            last = chunk
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish_reason chunk)
+                continue
+            if text:
+                yield text
+        # Usage is cumulative, the final chunk has the totals
+        if last is not None:
+            self._record_usage_metadata(last)
+            if self._truncated(last):
+                yield TRUNCATED
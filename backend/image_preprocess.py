@@ -0,0 +1,310 @@
+import base64
+import io
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+# --- CONFIGURATION ---
+PREPROCESS_ENABLED = os.environ.get("PREPROCESS_ENABLED", "1") == "1"
+PREPROCESS_LONG_EDGE = int(os.environ.get("PREPROCESS_LONG_EDGE", 2048)) # Target long edge in px
+PREPROCESS_FORMAT = os.environ.get("PREPROCESS_FORMAT", "auto") # auto | png | webp | jpeg
+PREPROCESS_DESKEW = os.environ.get("PREPROCESS_DESKEW", "1") == "1"
+# Hard black/white threshold. Off by default: anti-aliasing keeps small tolerance text legible after downscaling
+PREPROCESS_BINARIZE = os.environ.get("PREPROCESS_BINARIZE", "0") == "1"
+PREPROCESS_JPEG_QUALITY = int(os.environ.get("PREPROCESS_JPEG_QUALITY", 85))
+
+WHITE_THRESHOLD = 245 # Pixels lighter than this count as paper when trimming
+TRIM_MARGIN = 16
+MAX_DESKEW_DEGREES = 3.0
+DESKEW_MIN_GAIN = 0.1 # Required relative improvement of the projection profile over 0 deg
+
+_MIME_BY_FORMAT = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+def settings_fingerprint():
+    """Part of the result cache key: different preprocessing can change what the engine reads."""
+    return f"pre:{int(PREPROCESS_ENABLED)}:{PREPROCESS_LONG_EDGE}:{PREPROCESS_FORMAT}:{int(PREPROCESS_DESKEW)}:{int(PREPROCESS_BINARIZE)}"
+
+def estimate_tokens(width, height):
+    """
+    Rough image-token cost per provider.
+    Qwen2.5-VL: one token per 28x28 px patch. Gemini: 258 tokens per 768x768 tile (one tile if both edges <= 384).
+    """
+    qwen = math.ceil(width / 28) * math.ceil(height / 28)
+    if width <= 384 and height <= 384:
+        gemini = 258
+    else:
+        gemini = math.ceil(width / 768) * math.ceil(height / 768) * 258
+    return {"qwen": qwen, "gemini": gemini}
+
+class PreparedImage:
+    """
+    Encoded image payload ready to send to a vision engine, plus what the preprocessing saved.
+    Also remembers the crop / scale / rotation applied, so boxes the engine reports
+    against this image can be mapped back onto the source image.
+    """
+
+    def __init__(self, data, mime_type, width, height, original_bytes, steps=None,
+                 source_size=None, crop=(0, 0), scale=1.0, angle=0.0, rotated_from=None, final_crop=(0, 0)):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_bytes = original_bytes
+        self.steps = steps or []
+        self.source_size = source_size or (width, height)
+        self.crop = crop                # Offset of the first trim, in source px
+        self.scale = scale              # Downscale factor applied after the first trim
+        self.angle = angle              # Deskew rotation (degrees, counter-clockwise)
+        self.rotated_from = rotated_from # (w, h) before and (W, H) after the expanding rotation
+        self.final_crop = final_crop    # Offset of the trim after rotation
+        # Values derived from the pixels (data URL, layout signature, engine payloads), built
+        # once and reused by every attempt and continuation of a request
+        self.derived = {}
+
+    def to_source_point(self, x, y):
+        """Pixel position in this image -> pixel position in the source image."""
+        x, y = x + self.final_crop[0], y + self.final_crop[1]
+        if self.angle and self.rotated_from:
+            (w, h), (W, H) = self.rotated_from
+            theta = math.radians(self.angle)
+            dx, dy = x - W / 2.0, y - H / 2.0
+            x = w / 2.0 + dx * math.cos(theta) - dy * math.sin(theta)
+            y = h / 2.0 + dx * math.sin(theta) + dy * math.cos(theta)
+        return x / self.scale + self.crop[0], y / self.scale + self.crop[1]
+
+    def to_source_box(self, box_2d):
+        """[ymin, xmin, ymax, xmax] normalised 0-1000 on this image -> same format on the source image."""
+        ymin, xmin, ymax, xmax = [float(v) for v in box_2d]
+        corners = [
+            self.to_source_point(x / 1000.0 * self.width, y / 1000.0 * self.height)
+            for x, y in ((xmin, ymin), (xmax, ymin), (xmin, ymax), (xmax, ymax))
+        ]
+        sw, sh = self.source_size
+        xs = [min(max(x / sw * 1000.0, 0.0), 1000.0) for x, _ in corners]
+        ys = [min(max(y / sh * 1000.0, 0.0), 1000.0) for _, y in corners]
+        return [round(min(ys)), round(min(xs)), round(max(ys)), round(max(xs))]
+
+    def remap_boxes(self, features):
+        """Rewrites every valid 'box_2d' in place to source image coordinates."""
+        for item in features:
+            box = item.get("box_2d")
+            if isinstance(box, (list, tuple)) and len(box) == 4:
+                try:
+                    item["box_2d"] = self.to_source_box(box)
+                except (TypeError, ValueError):
+                    pass
+        return features
+
+    def base64(self):
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def data_url(self):
+        if "data_url" not in self.derived:
+            self.derived["data_url"] = f"data:{self.mime_type};base64,{self.base64()}"
+        return self.derived["data_url"]
+
+    def to_pil(self):
+        return Image.open(io.BytesIO(self.data))
+
+    def stats(self):
+        return {
+            "original_bytes": self.original_bytes,
+            "encoded_bytes": len(self.data),
+            "bytes_saved": self.original_bytes - len(self.data),
+            "width": self.width,
+            "height": self.height,
+            "mime_type": self.mime_type,
+            "steps": self.steps,
+            "tokens": estimate_tokens(self.width, self.height),
+        }
+
+def _load(source):
+    """Returns (PIL image, size of the source in bytes, encoded bytes if the source was a file)."""
+    if isinstance(source, Image.Image):
+        return source, source.width * source.height * len(source.getbands()), None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image, len(data), data
+
+def to_grayscale(image):
+    """Flattens transparency onto white paper and drops colour."""
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA").split()[-1])
+        image = background
+    return image.convert("L")
+
+def estimate_skew(gray):
+    """
+    Projection-profile deskew: the angle at which row ink sums are most peaked.
+    Drawings are dominated by horizontal lines and text baselines, so this is reliable for small angles.
+    Coarse 0.5 deg search on a ~600 px ink mask, then a 0.25 deg refinement.
+    """
+    arr = np.asarray(gray) < 128
+    # Max-pool the ink mask so 1 px lines survive the size reduction
+    k = max(1, max(arr.shape) // 600)
+    h, w = arr.shape[0] // k * k, arr.shape[1] // k * k
+    pooled = arr[:h, :w].reshape(h // k, k, w // k, k).any(axis=(1, 3))
+    ink = Image.fromarray((pooled * 255).astype(np.uint8))
+
+    def score(angle):
+        rotated = np.asarray(ink.rotate(angle, resample=Image.NEAREST, fillcolor=0), dtype=np.float32)
+        return float(np.var(rotated.sum(axis=1)))
+
+    coarse = np.arange(-MAX_DESKEW_DEGREES, MAX_DESKEW_DEGREES + 0.01, 0.5)
+    best = max(coarse, key=lambda a: score(float(a)))
+    best = float(max((best - 0.25, best, best + 0.25), key=lambda a: score(float(a))))
+    # Only rotate for a clear win; sparse pages without long lines give noisy profiles
+    if score(best) < score(0.0) * (1 + DESKEW_MIN_GAIN):
+        return 0.0
+    return best
+
+def trim_borders(gray, margin=TRIM_MARGIN):
+    """Crops uniform paper around the content, keeping a small margin. Returns (image, (left, top))."""
+    arr = np.asarray(gray)
+    rows = np.flatnonzero((arr < WHITE_THRESHOLD).any(axis=1))
+    cols = np.flatnonzero((arr < WHITE_THRESHOLD).any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return gray, (0, 0)
+    top = int(max(0, rows[0] - margin))
+    bottom = int(min(arr.shape[0], rows[-1] + margin + 1))
+    left = int(max(0, cols[0] - margin))
+    right = int(min(arr.shape[1], cols[-1] + margin + 1))
+    if (left, top, right, bottom) == (0, 0, arr.shape[1], arr.shape[0]):
+        return gray, (0, 0)
+    return gray.crop((left, top, right, bottom)), (left, top)
+
+def otsu_threshold(gray):
+    hist = np.bincount(np.asarray(gray).ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    weights = np.cumsum(hist)
+    means = np.cumsum(hist * np.arange(256))
+    background = weights[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    between = np.zeros(255)
+    mean_b = means[:-1][valid] / background[valid]
+    mean_f = (means[-1] - means[:-1][valid]) / foreground[valid]
+    between[valid] = background[valid] * foreground[valid] * (mean_b - mean_f) ** 2
+    return int(np.argmax(between))
+
+def is_line_art(gray):
+    """Line art is mostly paper and ink; scans and renders of photos have lots of mid tones."""
+    arr = np.asarray(gray)
+    mid_tones = np.count_nonzero((arr > 64) & (arr < 192))
+    return mid_tones / max(arr.size, 1) < 0.15
+
+def posterize16(gray):
+    """
+    Maps a greyscale image onto a 16 level palette (PNG-8 at 4 bits per pixel).
+    16 grey levels are plenty for line art and keep anti-aliased text edges.
+    A lookup table is much cheaper than Image.quantize on large sheets.
+    """
+    indices = gray.point([p // 17 for p in range(256)])
+    paletted = Image.frombuffer("P", gray.size, indices.tobytes(), "raw", "P", 0, 1)
+    paletted.putpalette([level * 17 for level in range(16) for _ in range(3)])
+    return paletted
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == "png":
+        if image.mode == "1":
+            image.save(buffer, format="PNG", compress_level=9)
+        else:
+            posterize16(image).save(buffer, format="PNG", compress_level=9, bits=4)
+        return buffer.getvalue(), "image/png"
+    if fmt == "webp":
+        if image.mode == "L":
+            image = posterize16(image)
+        image.convert("L").save(buffer, format="WEBP", lossless=True, method=1)
+        return buffer.getvalue(), "image/webp"
+    image.convert("L").save(buffer, format="JPEG", quality=PREPROCESS_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+def prepare_image(source, long_edge=None, fmt=None, trim=True, deskew=None):
+    """
+    Shared preprocessing stage for every engine.
+    Accepts a file path, raw bytes or a PIL image and runs:
+    grayscale -> trim whitespace -> downscale -> deskew -> (binarize) -> re-encode.
+    With PREPROCESS_ENABLED=0 the original bytes are passed through with their real MIME type.
+    """
+    image, original_bytes, raw = _load(source)
+
+    if not PREPROCESS_ENABLED:
+        if raw is not None and image.format in _MIME_BY_FORMAT:
+            return PreparedImage(raw, _MIME_BY_FORMAT[image.format], image.width, image.height, original_bytes)
+        # Formats the vision APIs don't take (e.g. TIFF) still need re-encoding
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="PNG")
+        return PreparedImage(buffer.getvalue(), "image/png", image.width, image.height, original_bytes)
+
+    long_edge = long_edge or PREPROCESS_LONG_EDGE
+    fmt = (fmt or PREPROCESS_FORMAT).lower()
+    deskew = PREPROCESS_DESKEW if deskew is None else deskew
+    source_size = image.size
+    crop, scale, rotated_from, final_crop = (0, 0), 1.0, None, (0, 0)
+    steps = []
+
+    gray = to_grayscale(image)
+    steps.append("grayscale")
+
+    # Skew is measured at full resolution but corrected after downscaling, where rotating is cheap
+    angle = estimate_skew(gray) if deskew else 0.0
+
+    if trim:
+        gray, crop = trim_borders(gray)
+        if crop != (0, 0) or gray.size != source_size:
+            steps.append("trim")
+
+    if max(gray.size) > long_edge:
+        factor = long_edge / max(gray.size)
+        trimmed_width = gray.width
+        gray = gray.resize((max(1, round(gray.width * factor)), max(1, round(gray.height * factor))), Image.LANCZOS)
+        scale = gray.width / float(trimmed_width)
+        steps.append(f"resize:{long_edge}")
+
+    if angle:
+        before = gray.size
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+        rotated_from = (before, gray.size)
+        gray, final_crop = trim_borders(gray) if trim else (gray, (0, 0))
+        steps.append(f"deskew:{angle:+.2f}")
+
+    if PREPROCESS_BINARIZE:
+        threshold = otsu_threshold(gray)
+        gray = gray.point(lambda p: 255 if p > threshold else 0).convert("1")
+        steps.append(f"binarize:{threshold}")
+
+    if fmt == "auto":
+        if is_line_art(gray if gray.mode == "L" else gray.convert("L")):
+            # Lossless for line art; keep whichever of PNG-8 / WebP is smaller
+            data, mime_type = min((_encode(gray, "png"), _encode(gray, "webp")), key=lambda c: len(c[0]))
+        else:
+            data, mime_type = _encode(gray, "jpeg")
+    else:
+        data, mime_type = _encode(gray, fmt)
+    steps.append(mime_type.split("/")[1])
+
+    return PreparedImage(
+        data, mime_type, gray.width, gray.height, original_bytes, steps,
+        source_size=source_size, crop=crop, scale=scale, angle=angle,
+        rotated_from=rotated_from, final_crop=final_crop,
+    )
+
+def ensure_prepared(image):
+    """Processors accept a path, bytes, a PIL image or an already prepared payload."""
+    if isinstance(image, PreparedImage):
+        return image
+    return prepare_image(image)
@@ -0,0 +1,259 @@
+import hashlib
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError: # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+import rasterizer
+
+# --- CONFIGURATION ---
+INGEST_SPILL_MB = float(os.environ.get("INGEST_SPILL_MB", 32)) # Uploads up to this size never touch disk
+INGEST_MAX_MB = float(os.environ.get("INGEST_MAX_MB", 200))
+INGEST_SPOOL_DIR = os.environ.get("INGEST_SPOOL_DIR") or None # Where larger uploads spill (default: system temp dir)
+
+# Upload types accepted by /upload/ and /jobs
+ALLOWED_CONTENT_TYPES = ["application/pdf", "image/jpeg", "image/png", "image/tiff", "image/webp"]
+
+# Magic bytes -> MIME type. The declared Content-Type of an upload is not trusted
+_SIGNATURES = [
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+# File suffix per sniffed type, for uploads spooled to disk (a ".pdf" suffix marks a PDF)
+SUFFIXES = {
+    "application/pdf": ".pdf",
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/tiff": ".tif",
+    "image/webp": ".webp",
+}
+
+# Request body for the OpenAPI docs of endpoints that parse the upload themselves
+OPENAPI_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+class IngestError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def sniff(head):
+    """MIME type from the first bytes of a file, None if it is not a supported drawing format."""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+class IngestedFile:
+    """
+    An upload received chunk by chunk. The SHA-256 (the result cache key) and the file type
+    are computed while it streams in. Content stays in memory up to INGEST_SPILL_MB and
+    spills to an anonymous temporary file above that, which disappears on close() even after errors.
+    """
+
+    def __init__(self, filename=None, spill_bytes=None, max_bytes=None):
+        self.filename = filename
+        self.spill_bytes = int(INGEST_SPILL_MB * 1024 * 1024 if spill_bytes is None else spill_bytes)
+        self.max_bytes = int(INGEST_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes)
+        self.size = 0
+        self.mime_type = None
+        self.sha256 = None
+        self._digest = hashlib.sha256()
+        self._head = b""
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def spilled(self):
+        return self._file is not None
+
+    @property
+    def is_pdf(self):
+        return self.mime_type == "application/pdf"
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise IngestError(413, f"File too large. The limit is {INGEST_MAX_MB:.0f} MB.")
+        if len(self._head) < 16:
+            self._head += chunk[:16 - len(self._head)]
+        self._digest.update(chunk)
+        if self._file is None and self.size > self.spill_bytes:
+            self._file = tempfile.TemporaryFile(dir=INGEST_SPOOL_DIR)
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+
+    def finish(self):
+        """Called once the upload is complete. Raises IngestError for unsupported content."""
+        self.sha256 = self._digest.hexdigest()
+        self.mime_type = sniff(self._head)
+        if self.mime_type is None:
+            raise IngestError(400, "Invalid file type. Please upload a PDF or Image (JPEG/PNG/TIFF/WEBP).")
+        return self
+
+    def read(self):
+        """The whole content as a bytes-like object (no copy while in memory)."""
+        if self._file is None:
+            return self._buffer.getbuffer()
+        self._file.seek(0)
+        return self._file.read()
+
+    def save(self, fileobj):
+        """Copies the content to another file object (e.g. a job spool file)."""
+        if self._file is None:
+            fileobj.write(self._buffer.getbuffer())
+            return
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(1024 * 1024)
+            if not chunk:
+                return
+            fileobj.write(chunk)
+
+    @contextmanager
+    def source(self):
+        """
+        What the extractor reads: the bytes themselves for in-memory images, otherwise
+        a path that poppler (pdfinfo / pdftoppm, in other processes) or PIL can open.
+        """
+        if not self.is_pdf and self._file is None:
+            yield self._buffer.getbuffer()
+            return
+        with self._path() as path:
+            yield path
+
+    @contextmanager
+    def _path(self):
+        # Linux: the spill file, or an in-memory file (memfd), is reachable through /proc without touching disk.
+        # Only for readers in this process and its own poppler children: the render pool runs in other
+        # processes, which may not see our /proc entries (other uid, hidepid), so PDFs rendered there
+        # get a named temporary file
+        proc_fd = f"/proc/{os.getpid()}/fd"
+        in_process = not self.is_pdf or rasterizer.renders_in_process()
+        if in_process and os.path.isdir(proc_fd) and (self._file is not None or hasattr(os, "memfd_create")):
+            memfd = None
+            if self._file is not None:
+                self._file.flush()
+                fd = self._file.fileno()
+            else:
+                fd = memfd = os.memfd_create("drawingscan-upload")
+                with open(memfd, "wb", closefd=False) as f:
+                    f.write(self._buffer.getbuffer())
+            try:
+                yield f"{proc_fd}/{fd}"
+            finally:
+                if memfd is not None:
+                    os.close(memfd)
+            return
+
+        # Elsewhere a named temporary file, removed again however the extraction ends
+        handle, path = tempfile.mkstemp(suffix=".pdf" if self.is_pdf else "", dir=INGEST_SPOOL_DIR)
+        try:
+            with open(handle, "wb") as f:
+                self.save(f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._buffer = None
+
+def from_bytes(data, filename=None):
+    """IngestedFile around content that is already in memory (e.g. a ZIP member)."""
+    upload = IngestedFile(filename, spill_bytes=len(data) + 1)
+    upload.write(data)
+    return upload.finish()
+
+async def receive(request, field="file"):
+    """
+    Parses a multipart/form-data request body as it arrives and returns the `field` file
+    as an IngestedFile. Unlike UploadFile, nothing is written to a temporary file first.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise IngestError(400, "Expected a multipart/form-data upload.")
+
+    state = {"headers": {}, "field": b"", "value": b"", "target": None, "upload": None}
+
+    def on_part_begin():
+        state["headers"] = {}
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].lower()] = state["value"]
+        state["field"] = state["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if name == field and b"filename" in disposition and state["upload"] is None:
+            state["upload"] = state["target"] = IngestedFile(disposition[b"filename"].decode("utf-8", "replace"))
+
+    def on_part_data(data, start, end):
+        if state["target"] is not None:
+            state["target"].write(data[start:end])
+
+    def on_part_end():
+        state["target"] = None
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        if state["upload"] is None:
+            raise IngestError(400, f"No '{field}' file in the upload.")
+        return state["upload"].finish()
+    except Exception as e:
+        if state["upload"] is not None:
+            state["upload"].close()
+        if isinstance(e, IngestError):
+            raise
+        raise IngestError(400, f"Malformed upload: {e}") from e
@@ -1,79 +1,355 @@
+import functools
+import re
 
-# ISO 286-2 Simplified Lookup Table (Metric, Nominal sizes up to 500mm)
-# Structure: { "ToleranceClass": { (min_dia, max_dia): (lower_limit_microns, upper_limit_microns) } }
-
-ISO_FITS = {
-    "H7": {
-        (0, 3): (0, 10),
-        (3, 6): (0, 12),
-        (6, 10): (0, 15),
-        (10, 18): (0, 18),
-        (18, 30): (0, 21),
-        (30, 50): (0, 25),
-        (50, 80): (0, 30),
-        (80, 120): (0, 35),
-        (120, 180): (0, 40),
-        (180, 250): (0, 46),
-        (250, 315): (0, 52),
-        (315, 400): (0, 57),
-        (400, 500): (0, 63),
-    },
-    "g6": {
-        (0, 3): (-8, -2),
-        (3, 6): (-12, -4),
-        (6, 10): (-14, -5),
-        (10, 18): (-17, -6),
-        (18, 30): (-20, -7),
-        (30, 50): (-25, -9),
-        (50, 80): (-29, -10),
-        (80, 120): (-34, -12),
-        (120, 180): (-39, -14),
-    },
-    "f7": {
-        (0, 3): (-16, -6),
-        (3, 6): (-22, -10),
-        (6, 10): (-28, -13),
-        (10, 18): (-34, -16),
-        (18, 30): (-41, -20),
-        (30, 50): (-50, -25),
-        (50, 80): (-60, -30),
-    }
-    # Add more as needed
+import numpy as np
+
+# ISO 286-1 tolerance engine (Metric, nominal sizes up to 3150mm)
+# Every hole (A-ZC) and shaft (a-zc) tolerance class is derived from the standard
+# IT-grade and fundamental-deviation tables, precomputed once into NumPy arrays:
+#   UPPER[kind, letter, grade, band] / LOWER[...] in microns, NaN where the class is not defined.
+# Lookups are a searchsorted over the size bands plus fancy indexing, for any number of items at once.
+
+# Upper edges of the size bands, including the intermediate steps used by a-c and r-zc
+BAND_EDGES = np.array([
+    3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315,
+    355, 400, 450, 500, 560, 630, 710, 800, 900, 1000, 1120, 1250, 1400, 1600, 1800, 2000,
+    2240, 2500, 2800, 3150,
+], dtype=float)
+MAX_SIZE = 3150.0
+# a / b (A / B) are not defined for nominal sizes up to 1mm, although the first band starts at 0
+AB_MIN_SIZE = 1.0
+
+GRADES = ["01", "0"] + [str(n) for n in range(1, 19)]
+GRADE_INDEX = {grade: i for i, grade in enumerate(GRADES)}
+
+# --- IT GRADES (Table 1) ---
+# { upper edge of main size band: (IT1 .. IT18) } in microns
+_IT_TABLE = {
+    3:    (0.8, 1.2, 2, 3, 4, 6, 10, 14, 25, 40, 60, 100, 140, 250, 400, 600, 1000, 1400),
+    6:    (1, 1.5, 2.5, 4, 5, 8, 12, 18, 30, 48, 75, 120, 180, 300, 480, 750, 1200, 1800),
+    10:   (1, 1.5, 2.5, 4, 6, 9, 15, 22, 36, 58, 90, 150, 220, 360, 580, 900, 1500, 2200),
+    18:   (1.2, 2, 3, 5, 8, 11, 18, 27, 43, 70, 110, 180, 270, 430, 700, 1100, 1800, 2700),
+    30:   (1.5, 2.5, 4, 6, 9, 13, 21, 33, 52, 84, 130, 210, 330, 520, 840, 1300, 2100, 3300),
+    50:   (1.5, 2.5, 4, 7, 11, 16, 25, 39, 62, 100, 160, 250, 390, 620, 1000, 1600, 2500, 3900),
+    80:   (2, 3, 5, 8, 13, 19, 30, 46, 74, 120, 190, 300, 460, 740, 1200, 1900, 3000, 4600),
+    120:  (2.5, 4, 6, 10, 15, 22, 35, 54, 87, 140, 220, 350, 540, 870, 1400, 2200, 3500, 5400),
+    180:  (3.5, 5, 8, 12, 18, 25, 40, 63, 100, 160, 250, 400, 630, 1000, 1600, 2500, 4000, 6300),
+    250:  (4.5, 7, 10, 14, 20, 29, 46, 72, 115, 185, 290, 460, 720, 1150, 1850, 2900, 4600, 7200),
+    315:  (6, 8, 12, 16, 23, 32, 52, 81, 130, 210, 320, 520, 810, 1300, 2100, 3200, 5200, 8100),
+    400:  (7, 9, 13, 18, 25, 36, 57, 89, 140, 230, 360, 570, 890, 1400, 2300, 3600, 5700, 8900),
+    500:  (8, 10, 15, 20, 27, 40, 63, 97, 155, 250, 400, 630, 970, 1550, 2500, 4000, 6300, 9700),
+    630:  (9, 11, 16, 22, 32, 44, 70, 110, 175, 280, 440, 700, 1100, 1750, 2800, 4400, 7000, 11000),
+    800:  (10, 13, 18, 25, 36, 50, 80, 125, 200, 320, 500, 800, 1250, 2000, 3200, 5000, 8000, 12500),
+    1000: (11, 15, 21, 28, 40, 56, 90, 140, 230, 360, 560, 900, 1400, 2300, 3600, 5600, 9000, 14000),
+    1250: (13, 18, 24, 33, 47, 66, 105, 165, 260, 420, 660, 1050, 1650, 2600, 4200, 6600, 10500, 16500),
+    1600: (15, 21, 29, 39, 55, 78, 125, 195, 310, 500, 780, 1250, 1950, 3100, 5000, 7800, 12500, 19500),
+    2000: (18, 25, 35, 46, 65, 92, 150, 230, 370, 600, 920, 1500, 2300, 3700, 6000, 9200, 15000, 23000),
+    2500: (22, 30, 41, 55, 78, 110, 175, 280, 440, 700, 1100, 1750, 2800, 4400, 7000, 11000, 17500, 28000),
+    3150: (26, 36, 50, 68, 96, 135, 210, 330, 540, 860, 1350, 2100, 3300, 5400, 8600, 13500, 21000, 33000),
+}
+
+# IT01 / IT0, only defined up to 500mm
+_IT0_TABLE = {
+    3: (0.3, 0.5), 6: (0.4, 0.6), 10: (0.4, 0.6), 18: (0.5, 0.8), 30: (0.6, 1), 50: (0.6, 1),
+    80: (0.8, 1.2), 120: (1, 1.5), 180: (1.2, 2), 250: (2, 3), 315: (2.5, 4), 400: (3, 5), 500: (4, 6),
 }
 
+# --- SHAFT FUNDAMENTAL DEVIATIONS (Table 2) ---
+# Steps of (upper size edge, deviation in microns). A step covers every band up to its edge;
+# None = not defined for those sizes. Sizes past the last step are not defined either.
+# a .. h: upper deviation es. j .. zc: lower deviation ei.
+_MAIN_STEPS = (3, 6, 10, 18, 30, 50, 80, 120, 180, 250, 315, 400, 500, 630, 800, 1000, 1250, 1600, 2000, 2500, 3150)
+
+def _steps(edges, values):
+    return list(zip(edges, values))
+
+def _main(*values):
+    return _steps(_MAIN_STEPS, values)
+
+_SHAFT_DEVIATIONS = {
+    "a": _steps(
+        (3, 6, 10, 18, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (-270, -270, -280, -290, -300, -310, -320, -340, -360, -380, -410, -460, -520, -580, -660, -740, -820,
+         -920, -1050, -1200, -1350, -1500, -1650)),
+    "b": _steps(
+        (3, 6, 10, 18, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (-140, -140, -150, -150, -160, -170, -180, -190, -200, -220, -240, -260, -280, -310, -340, -380, -420,
+         -480, -540, -600, -680, -760, -840)),
+    "c": _steps(
+        (3, 6, 10, 18, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (-60, -70, -80, -95, -110, -120, -130, -140, -150, -170, -180, -200, -210, -230, -240, -260, -280,
+         -300, -330, -360, -400, -440, -480)),
+    "cd": _steps((3, 6, 10), (-34, -46, -56)),
+    "d": _main(-20, -30, -40, -50, -65, -80, -100, -120, -145, -170, -190, -210, -230, -260, -290, -320, -350, -390, -430, -480, -520),
+    "e": _main(-14, -20, -25, -32, -40, -50, -60, -72, -85, -100, -110, -125, -135, -145, -160, -170, -195, -220, -240, -260, -290),
+    "ef": _steps((3, 6, 10), (-10, -14, -18)),
+    "f": _main(-6, -10, -13, -16, -20, -25, -30, -36, -43, -50, -56, -62, -68, -76, -80, -86, -98, -110, -120, -130, -145),
+    "fg": _steps((3, 6, 10), (-4, -6, -8)),
+    "g": _main(-2, -4, -5, -6, -7, -9, -10, -12, -14, -15, -17, -18, -20, -22, -24, -26, -28, -30, -32, -34, -38),
+    "h": _main(*([0] * len(_MAIN_STEPS))),
+    # k applies to IT4..IT7; every other grade (and everything above 500mm) has ei = 0
+    "k": _main(0, 1, 1, 1, 2, 2, 2, 3, 3, 4, 4, 4, 5, 0, 0, 0, 0, 0, 0, 0, 0),
+    "m": _main(2, 4, 6, 7, 8, 9, 11, 13, 15, 17, 20, 21, 23, 26, 30, 34, 40, 48, 58, 68, 76),
+    "n": _main(4, 8, 10, 12, 15, 17, 20, 23, 27, 31, 34, 37, 40, 44, 50, 56, 66, 78, 92, 110, 135),
+    "p": _main(6, 12, 15, 18, 22, 26, 32, 37, 43, 50, 56, 62, 68, 78, 88, 100, 120, 140, 170, 195, 240),
+    "r": _steps(
+        (3, 6, 10, 18, 30, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500,
+         560, 630, 710, 800, 900, 1000, 1120, 1250, 1400, 1600, 1800, 2000, 2240, 2500, 2800, 3150),
+        (10, 15, 19, 23, 28, 34, 41, 43, 51, 54, 63, 65, 68, 77, 80, 84, 94, 98, 108, 114, 126, 132,
+         150, 155, 175, 185, 210, 220, 250, 260, 300, 330, 370, 400, 440, 460, 550, 580)),
+    "s": _steps(
+        (3, 6, 10, 18, 30, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500,
+         560, 630, 710, 800, 900, 1000, 1120, 1250, 1400, 1600, 1800, 2000, 2240, 2500, 2800, 3150),
+        (14, 19, 23, 28, 35, 43, 53, 59, 71, 79, 92, 100, 108, 122, 130, 140, 158, 170, 190, 208, 232, 252,
+         280, 310, 340, 380, 430, 470, 520, 580, 640, 720, 820, 920, 1000, 1100, 1250, 1400)),
+    "t": _steps(
+        (24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500,
+         560, 630, 710, 800, 900, 1000, 1120, 1250, 1400, 1600, 1800, 2000, 2240, 2500, 2800, 3150),
+        (None, 41, 48, 54, 66, 75, 91, 104, 122, 134, 146, 166, 180, 196, 218, 240, 268, 294, 330, 360,
+         400, 450, 500, 560, 620, 680, 780, 840, 960, 1050, 1200, 1350, 1500, 1650, 1900, 2100)),
+    "u": _steps(
+        (3, 6, 10, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500,
+         560, 630, 710, 800, 900, 1000, 1120, 1250, 1400, 1600, 1800, 2000, 2240, 2500, 2800, 3150),
+        (18, 23, 28, 33, 41, 48, 60, 70, 87, 102, 124, 144, 170, 190, 210, 236, 258, 284, 315, 350, 390, 435, 490, 540,
+         600, 660, 740, 840, 940, 1050, 1150, 1300, 1450, 1600, 1850, 2000, 2300, 2500, 2900, 3200)),
+    "v": _steps(
+        (14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (None, 39, 47, 55, 68, 81, 102, 120, 146, 172, 202, 228, 252, 284, 310, 340, 385, 425, 475, 530, 595, 660)),
+    "x": _steps(
+        (3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (20, 28, 34, 40, 45, 54, 64, 80, 97, 122, 146, 178, 210, 248, 280, 310, 350, 385, 425, 475, 525, 590, 660, 740, 820)),
+    "y": _steps(
+        (18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (None, 63, 75, 94, 114, 144, 174, 214, 254, 300, 340, 380, 425, 470, 520, 580, 650, 730, 820, 920, 1000)),
+    "z": _steps(
+        (3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (26, 35, 42, 50, 60, 73, 88, 112, 136, 172, 210, 258, 310, 365, 415, 465, 520, 575, 640, 710, 790, 900, 1000, 1100, 1250)),
+    "za": _steps(
+        (3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (32, 42, 52, 64, 77, 98, 118, 148, 180, 226, 274, 335, 400, 470, 535, 600, 670, 740, 820, 920, 1000, 1150, 1300, 1450, 1600)),
+    "zb": _steps(
+        (3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (40, 50, 67, 90, 108, 136, 160, 200, 242, 300, 360, 445, 525, 620, 700, 780, 880, 960, 1050, 1200, 1300, 1500, 1650, 1850, 2100)),
+    "zc": _steps(
+        (3, 6, 10, 14, 18, 24, 30, 40, 50, 65, 80, 100, 120, 140, 160, 180, 200, 225, 250, 280, 315, 355, 400, 450, 500),
+        (60, 80, 97, 130, 150, 188, 218, 274, 325, 405, 480, 585, 690, 800, 900, 1000, 1150, 1250, 1350, 1550, 1700, 1900, 2100, 2400, 2600)),
+}
+
+# j: lower deviation per grade (j5/j6 share a value, j8 only exists up to 3mm)
+_J_SHAFT = {
+    "5": _main(-2, -2, -2, -3, -4, -5, -7, -9, -11, -13, -16, -18, -20),
+    "7": _main(-4, -4, -5, -6, -8, -10, -12, -15, -18, -21, -26, -28, -32),
+    "8": _steps((3,), (-6,)),
+}
+_J_SHAFT["6"] = _J_SHAFT["5"]
+
+# J: upper deviation ES for J6 / J7 / J8 (Table 3)
+_J_HOLE = {
+    "6": _main(2, 5, 5, 6, 8, 10, 13, 16, 18, 22, 25, 29, 33),
+    "7": _main(4, 6, 8, 10, 12, 14, 18, 22, 26, 30, 36, 39, 43),
+    "8": _main(6, 10, 12, 15, 20, 24, 28, 34, 41, 47, 55, 60, 66),
+}
+
+SHAFT_LETTERS = ["a", "b", "c", "cd", "d", "e", "ef", "f", "fg", "g", "h", "js", "j", "k", "m", "n",
+                 "p", "r", "s", "t", "u", "v", "x", "y", "z", "za", "zb", "zc"]
+LETTER_INDEX = {letter: i for i, letter in enumerate(SHAFT_LETTERS)}
+HOLE, SHAFT = 0, 1
+
+_CODE_RE = re.compile(r"^([A-Za-z]{1,2})(01|0|1[0-8]|[1-9])$")
+
+def _expand(steps):
+    """Step list -> value per band of BAND_EDGES (NaN where undefined)."""
+    values = np.full(len(BAND_EDGES), np.nan)
+    start = 0
+    for edge, value in steps:
+        stop = int(np.searchsorted(BAND_EDGES, edge)) + 1
+        if value is not None:
+            values[start:stop] = value
+        start = stop
+    return values
+
+def _build_it():
+    it = np.full((len(GRADES), len(BAND_EDGES)), np.nan)
+    for g in range(1, 19):
+        it[GRADE_INDEX[str(g)]] = _expand([(edge, row[g - 1]) for edge, row in _IT_TABLE.items()])
+    it[GRADE_INDEX["01"]] = _expand([(edge, row[0]) for edge, row in _IT0_TABLE.items()])
+    it[GRADE_INDEX["0"]] = _expand([(edge, row[1]) for edge, row in _IT0_TABLE.items()])
+    return it
+
+def _js_half(it, grade):
+    """Half of IT for js/JS. For grades 7 to 11 odd IT values are rounded down to the next even value."""
+    if 7 <= grade <= 11:
+        return np.floor(it / 2.0)
+    return it / 2.0
+
+def _build_tables():
+    it = _build_it()
+    fd = {letter: _expand(steps) for letter, steps in _SHAFT_DEVIATIONS.items()}
+    up_to_500 = BAND_EDGES <= 500
+    above_3 = BAND_EDGES > 3
+
+    shape = (2, len(SHAFT_LETTERS), len(GRADES), len(BAND_EDGES))
+    upper = np.full(shape, np.nan)
+    lower = np.full(shape, np.nan)
+
+    for gi, grade in enumerate(GRADES):
+        tol = it[gi]
+        number = int(grade) if grade not in ("01", "0") else 0
+        # Delta = IT(n) - IT(n-1) for grades 3..8, used by the hole rules below (not above 500mm)
+        if 3 <= number <= 8:
+            delta = np.where(up_to_500 & above_3, tol - it[GRADE_INDEX[str(number - 1)]], 0.0)
+        else:
+            delta = np.zeros(len(BAND_EDGES))
+
+        for li, letter in enumerate(SHAFT_LETTERS):
+            # --- SHAFTS ---
+            if letter == "js":
+                half = _js_half(tol, number)
+                s_upper, s_lower = half, -half
+            elif letter == "j":
+                ei = _expand(_J_SHAFT[grade]) if grade in _J_SHAFT else np.full(len(BAND_EDGES), np.nan)
+                s_upper, s_lower = ei + tol, ei
+            elif letter == "k":
+                ei = fd["k"] if 4 <= number <= 7 else np.where(np.isnan(tol), np.nan, 0.0)
+                s_upper, s_lower = ei + tol, ei
+            elif LETTER_INDEX[letter] <= LETTER_INDEX["h"]:
+                es = fd[letter]
+                s_upper, s_lower = es, es - tol
+            else:
+                ei = fd[letter]
+                s_upper, s_lower = ei + tol, ei
+            upper[SHAFT, li, gi], lower[SHAFT, li, gi] = s_upper, s_lower
+
+            # --- HOLES ---
+            if letter == "js":
+                # Symmetric like js: ES = +IT/2, EI = -IT/2 (not ES - IT, which is uneven for odd IT)
+                half = _js_half(tol, number)
+                upper[HOLE, li, gi], lower[HOLE, li, gi] = half, -half
+                continue
+            elif letter == "j":
+                es_hole = _expand(_J_HOLE[grade]) if grade in _J_HOLE else np.full(len(BAND_EDGES), np.nan)
+            elif LETTER_INDEX[letter] <= LETTER_INDEX["h"]:
+                # A..H mirror the shaft: EI = -es
+                ei_hole = -fd[letter]
+                upper[HOLE, li, gi], lower[HOLE, li, gi] = ei_hole + tol, ei_hole
+                continue
+            elif letter == "k":
+                # K: -k + Delta up to IT8, 0 above IT8 and above 500mm
+                k = fd["k"] if number <= 8 else np.zeros(len(BAND_EDGES))
+                es_hole = np.where(up_to_500, -k + (delta if number <= 8 else 0.0), 0.0)
+            elif letter in ("m", "n"):
+                es_hole = -fd[letter] + (delta if number <= 8 else 0.0)
+                if letter == "n" and number > 8:
+                    # N9 and coarser: ES = 0 above 3mm
+                    es_hole = np.where(above_3 & up_to_500, 0.0, es_hole)
+            else:
+                # P..ZC: -ei, plus Delta up to IT7
+                es_hole = -fd[letter] + (delta if number <= 7 else 0.0)
+            upper[HOLE, li, gi], lower[HOLE, li, gi] = es_hole, es_hole - tol
+
+    # Special case (Table 3 note): M6 from 250mm to 315mm has ES = -9
+    m6_band = int(np.searchsorted(BAND_EDGES, 280))
+    for band in (m6_band, m6_band + 1):
+        upper[HOLE, LETTER_INDEX["m"], GRADE_INDEX["6"], band] = -9.0
+        lower[HOLE, LETTER_INDEX["m"], GRADE_INDEX["6"], band] = -9.0 - it[GRADE_INDEX["6"], band]
+    return it, upper, lower
+
+IT_GRADES, UPPER, LOWER = _build_tables()
+
+# Spot checks against ISO 286-2 (nominal mm, class, upper and lower deviation in microns), verified at import
+_REFERENCE = [
+    (10, "H7", 15, 0),
+    (30, "g6", -7, -20),
+    (50, "K7", 7, -18),
+    (30, "JS7", 10, -10), # IT7 = 21, odd: rounded down to +-10
+    (40, "JS7", 12, -12),
+    (30, "js7", 10, -10),
+    (30, "JS6", 6.5, -6.5),
+    (1, "a11", None, None), # a / b: not defined up to 1mm
+    (1, "B11", None, None),
+    (2, "b11", -140, -200),
+]
+
+def _check_tables():
+    sizes, codes, upper, lower = zip(*_REFERENCE)
+    got_upper, got_lower = iso_deviations(sizes, codes)
+    for i, (size, code) in enumerate(zip(sizes, codes)):
+        if upper[i] is None:
+            mismatch = not (np.isnan(got_upper[i]) and np.isnan(got_lower[i]))
+        else:
+            mismatch = (got_upper[i], got_lower[i]) != (upper[i], lower[i])
+        if mismatch:
+            raise RuntimeError(f"ISO 286 table error: {size} {code} gives {got_upper[i]}/{got_lower[i]}, "
+                               f"expected {upper[i]}/{lower[i]}")
+
+def parse_code(tolerance_code):
+    """'H7' -> (HOLE, letter index, grade index); None if it is not an ISO 286 tolerance class."""
+    return _parse_code(str(tolerance_code).strip())
+
+# Codes come from model output, so the memo is bounded
+@functools.lru_cache(maxsize=4096)
+def _parse_code(code):
+    match = _CODE_RE.match(code)
+    if not match:
+        return None
+    letters, grade = match.groups()
+    if not (letters.isupper() or letters.islower()) or letters.lower() not in LETTER_INDEX:
+        return None
+    return (HOLE if letters.isupper() else SHAFT, LETTER_INDEX[letters.lower()], GRADE_INDEX[grade])
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def iso_deviations(nominals, codes):
+    """
+    Vectorized lookup. nominals: sizes in mm, codes: tolerance classes (e.g. "H7", "g6").
+    Returns (upper, lower) arrays of deviations in microns, NaN where the pair is not defined.
+    """
+    sizes = np.array([_to_float(value) for value in nominals], dtype=float)
+    parsed = [parse_code(code) for code in codes]
+    valid = np.array([p is not None for p in parsed], dtype=bool)
+    kind, letter, grade = (
+        np.array([p[i] if p else 0 for p in parsed], dtype=np.intp) for i in range(3)
+    )
+
+    # (lower, upper] size bands: the first band edge >= size
+    band = np.searchsorted(BAND_EDGES, sizes, side="left")
+    valid &= (sizes > 0) & (sizes <= MAX_SIZE)
+    valid &= ~((letter <= LETTER_INDEX["b"]) & (sizes <= AB_MIN_SIZE))
+    band = np.where(valid, band, 0)
+
+    upper = np.where(valid, UPPER[kind, letter, grade, band], np.nan)
+    lower = np.where(valid, LOWER[kind, letter, grade, band], np.nan)
+    return upper, lower
+
+_check_tables()
+
+def _format_mm(microns):
+    # Whole microns print with 3 decimals, half microns (IT01..IT4, js) need a 4th
+    microns = float(microns) + 0.0 # No "-0.000"
+    decimals = 3 if microns.is_integer() else 4
+    return f"{microns / 1000.0:+.{decimals}f}"
+
+def format_limits(upper_mu, lower_mu):
+    """Microns -> "+0.015 / -0.000", or None for undefined pairs."""
+    if np.isnan(upper_mu) or np.isnan(lower_mu):
+        return None
+    return f"{_format_mm(upper_mu)} / {_format_mm(lower_mu)}"
+
+def calculate_iso_limits_batch(nominals, codes):
+    """Formatted limits for many (nominal, code) pairs in one vectorized lookup. None where not defined."""
+    upper, lower = iso_deviations(nominals, codes)
+    return [format_limits(u, l) for u, l in zip(upper.tolist(), lower.tolist())]
+
 def calculate_iso_limits(nominal_value, tolerance_code):
     """
     Calculates the numerical limits for a given nominal diameter and ISO tolerance code.
     Returns a string: "+0.015 / -0.000" or None if not found.
     """
     try:
-        nominal = float(nominal_value)
-        code = tolerance_code.strip()
-        
-        # Check if code exists in our library
-        if code not in ISO_FITS:
-            return None
-            
-        # Find the range
-        lookup = ISO_FITS[code]
-        limits = None
-        
-        for (min_dia, max_dia), vals in lookup.items():
-            if min_dia < nominal <= max_dia:
-                limits = vals
-                break
-                
-        if not limits:
-            return None
-            
-        lower_mu, upper_mu = limits
-        
-        # Convert microns to mm
-        lower_mm = lower_mu / 1000.0
-        upper_mm = upper_mu / 1000.0
-        
-        # Format explicitly with sign
-        return f"{upper_mm:+.3f} / {lower_mm:+.3f}"
-        
+        return calculate_iso_limits_batch([nominal_value], [tolerance_code])[0]
     except Exception:
         return None
@@ -0,0 +1,287 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+
+import metrics
+import models
+from database import SessionLocal
+
+# --- CONFIGURATION ---
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_SPOOL_DIR = os.environ.get("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "drawingscan_jobs"))
+# A running job whose worker has not renewed its lease for this long is considered abandoned
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+
+_workers = []
+
+logger = logging.getLogger(__name__)
+
+def enqueue(fileobj, filename, suffix="", user_id=None):
+    """
+    Spools an uploaded file to JOB_SPOOL_DIR and inserts a queued job row owned by user_id.
+    Workers run in other processes, so the upload has to live on disk.
+    Returns the new job id.
+    """
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    file_path = os.path.join(JOB_SPOOL_DIR, job_id + suffix)
+    with open(file_path, "wb") as spool_file:
+        shutil.copyfileobj(fileobj, spool_file)
+
+    db = SessionLocal()
+    try:
+        db.add(models.ExtractionJob(id=job_id, filename=filename, file_path=file_path, status="queued", user_id=user_id))
+        db.commit()
+    finally:
+        db.close()
+    return job_id
+
+def queue_depth(db):
+    """Number of jobs waiting for a worker."""
+    return db.query(models.ExtractionJob).filter(models.ExtractionJob.status == "queued").count()
+
+def _queued_jobs():
+    db = SessionLocal()
+    try:
+        return queue_depth(db)
+    finally:
+        db.close()
+
+# Read from the database at scrape time, the queue is shared by all worker processes
+metrics.QUEUE_DEPTH.set_function(_queued_jobs, queue="jobs")
+
+def job_to_dict(job):
+    document = json.loads(job.result) if job.result else {}
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "filename": job.filename,
+        "results": document.get("results"),
+        "pages": document.get("pages"),
+        "run_id": document.get("run_id"),
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+def claim_next_job(worker_name):
+    """
+    Atomically moves the oldest queued job to 'running'.
+    The conditional UPDATE guarantees two workers never claim the same row.
+    Returns (job_id, file_path, user_id) or None if the queue is empty.
+    """
+    db = SessionLocal()
+    try:
+        while True:
+            job = (
+                db.query(models.ExtractionJob)
+                .filter(models.ExtractionJob.status == "queued")
+                .order_by(models.ExtractionJob.created_at)
+                .first()
+            )
+            if job is None:
+                return None
+
+            claimed = db.execute(
+                update(models.ExtractionJob)
+                .where(models.ExtractionJob.id == job.id, models.ExtractionJob.status == "queued")
+                .values(
+                    status="running",
+                    worker=worker_name,
+                    started_at=datetime.utcnow(),
+                    lease_expires_at=_lease_deadline(),
+                    attempts=models.ExtractionJob.attempts + 1,
+                )
+            )
+            db.commit()
+            if claimed.rowcount == 1:
+                return job.id, job.file_path, job.user_id
+            # Another worker won the race, try the next one
+            db.expire_all()
+    finally:
+        db.close()
+
+def _lease_deadline():
+    return datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+def renew_lease(job_id, worker_name):
+    """Extends the lease of a job this worker is running. False if the job was taken away from it."""
+    db = SessionLocal()
+    try:
+        renewed = db.execute(
+            update(models.ExtractionJob)
+            .where(
+                models.ExtractionJob.id == job_id,
+                models.ExtractionJob.status == "running",
+                models.ExtractionJob.worker == worker_name,
+            )
+            .values(lease_expires_at=_lease_deadline())
+        )
+        db.commit()
+        return renewed.rowcount == 1
+    finally:
+        db.close()
+
+@contextmanager
+def _heartbeat(job_id, worker_name):
+    """Renews the job's lease every third of JOB_LEASE_SECONDS while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                if not renew_lease(job_id, worker_name):
+                    logger.warning(f"⚠️ Job {job_id} lease lost by {worker_name}", extra={"job": job_id})
+                    return
+            except Exception as e:
+                # A busy database must not kill the heartbeat, the next beat retries
+                logger.warning(f"⚠️ Job {job_id} lease renewal failed: {e}", extra={"job": job_id})
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def finish_job(job_id, document=None, error=None, worker_name=None):
+    """
+    Records the outcome. With worker_name, only while that worker still holds the job: after its
+    lease expired the job may be running elsewhere. Returns False if another worker holds the job.
+    """
+    db = SessionLocal()
+    try:
+        job = db.get(models.ExtractionJob, job_id)
+        if job is None:
+            return True
+        if worker_name is not None and (job.status != "running" or job.worker != worker_name):
+            logger.warning(f"⚠️ Job {job_id} lost its lease, dropping the result of {worker_name}", extra={"job": job_id})
+            return False
+        job.status = "failed" if error else "done"
+        job.result = json.dumps(document) if document is not None else None
+        job.error = error
+        job.finished_at = datetime.utcnow()
+        job.lease_expires_at = None
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def requeue_stale_jobs():
+    """
+    Jobs left 'running' by a crashed worker, i.e. whose lease expired, go back to the queue,
+    unless they already used up JOB_MAX_ATTEMPTS. Jobs other API replicas are still working
+    on keep their lease and are left alone. Safe to run from several processes at once.
+    """
+    expired = (
+        models.ExtractionJob.status == "running",
+        or_(models.ExtractionJob.lease_expires_at.is_(None), models.ExtractionJob.lease_expires_at < datetime.utcnow()),
+    )
+    db = SessionLocal()
+    try:
+        failed = db.execute(
+            update(models.ExtractionJob)
+            .where(*expired, models.ExtractionJob.attempts >= JOB_MAX_ATTEMPTS)
+            .values(status="failed", error="Worker died while processing this job", finished_at=datetime.utcnow(), lease_expires_at=None)
+        )
+        requeued = db.execute(
+            update(models.ExtractionJob)
+            .where(*expired, models.ExtractionJob.attempts < JOB_MAX_ATTEMPTS)
+            .values(status="queued", worker=None, lease_expires_at=None)
+        )
+        db.commit()
+        return failed.rowcount + requeued.rowcount
+    finally:
+        db.close()
+
+def _save_run(job_id, file_path, document, user_id=None):
+    import drawing_store
+    import result_cache
+    if not drawing_store.STORE_RESULTS or user_id is None:
+        return None
+    db = SessionLocal()
+    try:
+        job = db.get(models.ExtractionJob, job_id)
+        filename = (job.filename if job else None) or os.path.basename(file_path)
+    finally:
+        db.close()
+    return drawing_store.save_run(
+        document, result_cache.hash_file(file_path), filename=filename, source="job", user_id=user_id,
+        size_bytes=os.path.getsize(file_path),
+    )
+
+def run_job(job_id, file_path, user_id=None, worker_name=None):
+    # Imported here so the API process never loads the engines just for the queue
+    import extractor
+    try:
+        document = extractor.process_document(file_path, user_id=user_id)
+        document["run_id"] = _save_run(job_id, file_path, document, user_id)
+        finished = finish_job(job_id, document=document, worker_name=worker_name)
+    except Exception as e:
+        logger.error(f"⚠️ Job {job_id} failed: {e}", extra={"job": job_id})
+        finished = finish_job(job_id, error=str(e), worker_name=worker_name)
+    # A job taken over by another worker still needs its upload
+    if finished and file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+def _worker_main(worker_name):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # Spawned processes start with a fresh logging setup
+    import log_config
+    log_config.configure_logging()
+
+    import extractor
+    extractor.init_reader()
+    logger.info(f"👷 Job worker {worker_name} ready.")
+
+    last_sweep = 0.0
+    while True:
+        if time.monotonic() - last_sweep >= JOB_LEASE_SECONDS:
+            # Recovers jobs of workers that died on any replica, not just at API startup
+            requeue_stale_jobs()
+            last_sweep = time.monotonic()
+        claimed = claim_next_job(worker_name)
+        if claimed is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        job_id, file_path, user_id = claimed
+        with _heartbeat(job_id, worker_name):
+            run_job(job_id, file_path, user_id, worker_name)
+
+def start_workers(count=None):
+    """
+    Starts the worker process pool. Uses 'spawn' so children don't inherit
+    the API's event loop, sockets or SQLite connections.
+    """
+    count = JOB_WORKERS if count is None else count
+    ctx = multiprocessing.get_context("spawn")
+    for i in range(count):
+        name = f"worker-{os.getpid()}-{i}"
+        proc = ctx.Process(target=_worker_main, args=(name,), name=name, daemon=True)
+        proc.start()
+        _workers.append(proc)
+    return len(_workers)
+
+def stop_workers():
+    for proc in _workers:
+        proc.terminate()
+    for proc in _workers:
+        proc.join(timeout=5)
+    _workers.clear()
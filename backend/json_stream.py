@@ -0,0 +1,122 @@
+import json
+import re
+
+# Characters that change the parser state outside / inside a string
+_STRUCTURAL = re.compile(r'["\[\]{}]')
+_IN_STRING = re.compile(r'["\\]')
+
+def strip_fences(text):
+    """Removes a ```json ... ``` wrapper around a model answer."""
+    if "```json" in text:
+        return text.split("```json")[1].split("```")[0]
+    if "```" in text:
+        return text.split("```")[1].split("```")[0]
+    return text
+
+def parse_array(text):
+    """
+    Every complete element of a model answer that should be a JSON array, tolerating markdown
+    fences, preamble text and a cut-off tail. Returns (items, finished): finished is False when the
+    closing ']' never came, e.g. because the answer hit the output token limit.
+    """
+    parser = JsonArrayStream()
+    items = parser.feed(text)
+    items += parser.close()
+    return items, parser.finished
+
+class JsonArrayStream:
+    """
+    Incremental parser for a JSON array of objects arriving in chunks (streamed model output).
+    feed() returns every element completed by the new chunk, so features can be
+    forwarded while the rest of the answer is still being generated.
+    Text before the opening '[' (markdown fences, preamble) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.finished = False
+        self.in_string = False
+        self.item_start = None
+        self.emitted = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+        items = []
+        text = self.text
+        pos = self.pos
+        while not self.finished:
+            if self.in_string:
+                match = _IN_STRING.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(text):
+                        # Escape split across chunks, resume at the backslash
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                continue
+
+            if not self.started:
+                start = text.find("[", pos)
+                if start == -1:
+                    pos = len(text)
+                    break
+                self.started = True
+                self.depth = 1
+                pos = start + 1
+                continue
+
+            match = _STRUCTURAL.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self.in_string = True
+            elif char in "[{":
+                if self.depth == 1:
+                    self.item_start = match.start()
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 1 and self.item_start is not None:
+                    item = self._parse(text[self.item_start:pos])
+                    if item is not None:
+                        items.append(item)
+                    self.item_start = None
+                elif self.depth == 0:
+                    self.finished = True
+        self.pos = pos
+        self.emitted += len(items)
+        return items
+
+    def _parse(self, fragment):
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError:
+            # A malformed element only loses itself, not the rest of the array
+            return None
+
+    def close(self):
+        """
+        Call once the stream has ended. If nothing could be parsed incrementally
+        (e.g. the model wrapped the array in an object), the whole answer is parsed once.
+        """
+        if self.emitted:
+            return []
+        try:
+            data = json.loads(strip_fences(self.text).strip())
+        except json.JSONDecodeError:
+            return []
+        items = data if isinstance(data, list) else [data] if isinstance(data, dict) else []
+        self.emitted += len(items)
+        return items
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+# --- CONFIGURATION ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper() # DEBUG | INFO | WARNING | ERROR | OFF
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text") # text | json
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and is a structured field
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime", "taskName"}
+
+def _fields(record):
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the `extra=` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class TextFormatter(logging.Formatter):
+    """Readable lines, with the `extra=` fields appended as key=value."""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += "  " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+def configure_logging():
+    """
+    Sets up the root logger from LOG_LEVEL / LOG_FORMAT. Called once per process
+    (the API and every job worker). LOG_LEVEL=OFF silences the application logs.
+    """
+    root = logging.getLogger()
+    if LOG_LEVEL == "OFF":
+        logging.disable(logging.CRITICAL)
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+    # Chatty third-party loggers only report problems
+    for name in ("httpx", "httpcore", "openai", "multipart", "passlib"):
+        logging.getLogger(name).setLevel(logging.WARNING)
@@ -1,20 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import shutil
-import os
-import extractor
-import tempfile
-import models
-from database import engine
-from routers import auth
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import json
+import logging
+import threading
+import time
+from typing import Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+import log_config
+log_config.configure_logging()
+
+# extractor (and with it numpy, PIL and the engine SDKs) is imported by the background
+# warm-up or the first request, so a new replica answers health checks right away
+import ingest
+import metrics
+import models
+import batch_pipeline
+import drawing_store
+import job_queue
+import rasterizer
+import result_cache
+import warmup
+from auth import CurrentUser, get_current_user
+from database import add_missing_columns, engine
+from routers import auth, batch, export, history, jobs
+
+logger = logging.getLogger(__name__)
+
 # Create DB Tables
 models.Base.metadata.create_all(bind=engine)
+add_missing_columns(models.ExtractionJob)
 
 app = FastAPI()
 
@@ -25,45 +45,183 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Disposition", "X-Export-Until"], # Export downloads
 )
 
 app.include_router(auth.router)
+app.include_router(jobs.router)
+app.include_router(batch.router)
+app.include_router(history.router)
+app.include_router(export.router)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # For streamed responses this is the time until the headers are sent
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        route=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
 @app.on_event("startup")
 async def startup_event():
-    # Initialize the OCR model on startup to avoid timeout on first request
-    extractor.init_reader()
+    # Engines, connection probes and the render pool start in the background; /readyz reports when they are warm
+    warmup.start()
+
+    # Start the extraction workers; jobs whose worker died (expired lease) are picked up again
+    requeued = job_queue.requeue_stale_jobs()
+    if requeued:
+        logger.info(f"♻️ Re-queued {requeued} unfinished job(s).")
+    job_queue.start_workers()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_queue.stop_workers()
+    await batch_pipeline.shutdown()
+    rasterizer.shutdown()
 
 @app.get("/")
 def read_root():
+    if warmup.status()["status"] == "warming":
+        return {"message": "Scan-Drawing API is running", "engine": "Starting..."}
+    import extractor
     return {
         "message": "Scan-Drawing API is running", 
         "engine": extractor.get_active_engine()
     }
 
-@app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    allowed_types = ["application/pdf", "image/jpeg", "image/png", "image/tiff", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PDF or Image (JPEG/PNG/TIFF/WEBP).")
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process serves requests. Answers before the engines are warm."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the engines are constructed and their connections are open (503 until then)."""
+    state = warmup.status()
+    return JSONResponse(status_code=200 if state["status"] == "ready" else 503, content=state)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return result_cache.cache.stats()
 
-    # Save uploaded file typically
+@app.get("/engines/stats")
+def engine_stats():
+    import extractor
+    stats = extractor.router.stats()
+    if extractor.fast_router:
+        stats["cascade"] = extractor.fast_router.stats()
+    return stats
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text format: stage latencies, engine calls/errors/tokens, bytes and queue depths of this process."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+async def _receive_upload(request, endpoint):
+    """Streams the multipart upload into memory (ingest.py), hashing and type-sniffing it on the way."""
     try:
-        suffix = ".pdf" if file.content_type == "application/pdf" else os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            shutil.copyfileobj(file.file, tmp_file)
-            tmp_file_path = tmp_file.name
-        
-        # Process the file
-        results = extractor.process_file(tmp_file_path)
-        
-        # Cleanup
-        os.remove(tmp_file_path)
+        with metrics.stage("ingest"):
+            upload = await ingest.receive(request)
+    except ingest.IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    metrics.UPLOAD_BYTES.inc(upload.size, endpoint=endpoint)
+    return upload
+
+def _save_run(upload, document, source, part_number=None, user=None):
+    return drawing_store.save_run(
+        document, upload.sha256, filename=upload.filename, source=source, user_id=user.id if user else None,
+        part_number=part_number, mime_type=upload.mime_type, size_bytes=upload.size,
+    )
+
+def _refinement_saver(upload, part_number, user):
+    """
+    (on_refined, provisional_saved) for CASCADE_REFINE=background: the refined document is stored
+    as a run of its own, after the fast one (so it is the newest run of the drawing) and pointing to it.
+    """
+    provisional = {}
+    saved = threading.Event()
+
+    def on_refined(document):
+        saved.wait(60)
+        document["refinement"]["provisional_run_id"] = provisional.get("run_id")
+        _save_run(upload, document, "refine", part_number, user)
+
+    def provisional_saved(run_id):
+        provisional["run_id"] = run_id
+        saved.set()
+
+    return on_refined, provisional_saved
+
+@app.post("/upload/", openapi_extra=ingest.OPENAPI_UPLOAD_BODY)
+async def upload_file(
+    request: Request,
+    format: str = "json",
+    part_number: Optional[str] = None,
+    user: Optional[CurrentUser] = Depends(get_current_user),
+):
+    """
+    format=columnar returns the features as typed columns (see tolerance_normalizer) instead of objects.
+    The extraction is kept in the history tables (see /history) under part_number, by default the file name,
+    and the user of the bearer token if one is sent (required with REQUIRE_AUTH=1).
+    """
+    import extractor
+    import tolerance_normalizer
+
+    upload = await _receive_upload(request, "upload")
+    try:
+        # Process the file in a worker thread so the event loop keeps serving other requests
+        on_refined, provisional_saved = _refinement_saver(upload, part_number, user)
+        document = await run_in_threadpool(extractor.process_upload, upload, on_refined, user.id if user else None)
+        document["run_id"] = await run_in_threadpool(_save_run, upload, document, "upload", part_number, user)
+        provisional_saved(document["run_id"])
         
-        return JSONResponse(content={"results": results})
+        with metrics.stage("serialize"):
+            if format == "columnar":
+                columns = tolerance_normalizer.normalize(document.pop("results")).to_columns()
+                return Response(content=tolerance_normalizer.dumps({"columns": columns, **document}), media_type="application/json")
+            return JSONResponse(content=document)
         
     except Exception as e:
+        logger.exception(f"Upload failed: {e}")
         return JSONResponse(status_code=500, content={"message": str(e)})
+    finally:
+        upload.close()
+
+@app.post("/upload/stream", openapi_extra=ingest.OPENAPI_UPLOAD_BODY)
+async def upload_file_stream(
+    request: Request,
+    part_number: Optional[str] = None,
+    user: Optional[CurrentUser] = Depends(get_current_user),
+):
+    """
+    Same extraction as /upload/, streamed as NDJSON: one event per line,
+    every feature is sent the moment the model has finished writing it.
+    """
+    import extractor
+
+    upload = await _receive_upload(request, "stream")
+
+    async def events():
+        try:
+            with upload.source() as source:
+                async for event in extractor.stream_document(source, file_hash=upload.sha256, is_pdf=upload.is_pdf,
+                                                             user_id=user.id if user else None):
+                    if event["event"] == "done":
+                        document = event.pop("document")
+                        event["run_id"] = await run_in_threadpool(_save_run, upload, document, "stream", part_number, user)
+                    yield json.dumps(event) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "message": str(e)}) + "\n"
+        finally:
+            upload.close()
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,188 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds. Covers fast CPU stages (ms) up to slow model calls (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Base of the hand-rolled Prometheus metrics (no client library needed).
+    Label values are passed as keyword arguments: COUNTER.inc(engine="qwen").
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label values, extra labels, value)]"""
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(Metric):
+    """A value that goes up and down. set_function() reads it from a callback at scrape time instead."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def samples(self):
+        samples = super().samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                samples.append(("", key, (), function()))
+            except Exception:
+                # A broken callback must not take the whole scrape down
+                continue
+        return samples
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in values:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append(("_bucket", key, (("le", _format_value(float(bound))),), bucket_count))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), count))
+        return samples
+
+def render():
+    """Every registered metric in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- METRICS ---
+HTTP_SECONDS = Histogram("drawingscan_http_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+UPLOAD_BYTES = Counter("drawingscan_upload_bytes_total", "Bytes of uploaded drawings received.", ("endpoint",))
+STAGE_SECONDS = Histogram("drawingscan_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+PAGES = Counter("drawingscan_pages_total", "Pages extracted.", ("outcome",))
+FEATURES = Counter("drawingscan_features_total", "Features extracted.")
+CACHE_LOOKUPS = Counter("drawingscan_cache_lookups_total", "Result cache lookups.", ("result",))
+EXPORT_ROWS = Counter("drawingscan_export_rows_total", "Features written to exports.", ("format",))
+
+ENGINE_SECONDS = Histogram("drawingscan_engine_request_seconds", "Duration of single engine attempts.", ("engine", "outcome"))
+ENGINE_ERRORS = Counter("drawingscan_engine_errors_total", "Failed engine attempts by HTTP status or error type.", ("engine", "reason"))
+ENGINE_RETRIES = Counter("drawingscan_engine_retries_total", "Engine attempts retried after a backoff.", ("engine",))
+ENGINE_BYTES_SENT = Counter("drawingscan_engine_image_bytes_sent_total", "Encoded image bytes sent to the engines.", ("engine",))
+ENGINE_TOKENS = Counter("drawingscan_engine_tokens_total", "Tokens reported by the engine APIs.", ("engine", "kind"))
+ENGINE_PROMPT_TOKENS = Histogram("drawingscan_engine_prompt_tokens", "Prompt tokens per engine call (text, few-shot examples and image).", ("engine",),
+                                 buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+ENGINE_TRUNCATED = Counter("drawingscan_engine_truncated_total", "Answers cut off at the output token limit (complete features are kept).", ("engine",))
+ENGINE_CONTINUATIONS = Counter("drawingscan_engine_continuations_total", "Follow-up requests for the rest of a cut-off answer.", ("engine", "outcome"))
+CASCADE_PAGES = Counter("drawingscan_cascade_pages_total", "Pages answered by the fast model, escalated to the large one or refined later.", ("outcome",))
+ENGINE_IN_FLIGHT = Gauge("drawingscan_engine_in_flight", "Engine requests currently running.", ("engine",))
+QUEUE_DEPTH = Gauge("drawingscan_queue_depth", "Work waiting for a slot.", ("queue",))
+
+class StageTimer:
+    seconds = None
+
+@contextmanager
+def stage(name):
+    """
+    Times a pipeline stage into drawingscan_stage_seconds.
+    The elapsed time is also available afterwards as `timer.seconds`.
+    """
+    timer = StageTimer()
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(timer.seconds, stage=name)
@@ -1,6 +1,10 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from datetime import datetime
+from sqlalchemy import JSON, BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text, UniqueConstraint
 from database import Base
 
+# 64-bit ids on Postgres; on SQLite only INTEGER PRIMARY KEY is the auto-incrementing rowid
+BigId = BigInteger().with_variant(Integer, "sqlite")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -10,3 +14,119 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     is_approved = Column(Boolean, default=False) # Requires Admin Approval
     reset_token = Column(String, nullable=True)
+
+class ExtractionJob(Base):
+    __tablename__ = "extraction_jobs"
+
+    id = Column(String, primary_key=True, index=True) # uuid4 hex
+    status = Column(String, index=True, default="queued") # queued | running | done | failed
+    filename = Column(String)
+    file_path = Column(String) # Spooled upload, deleted once the job finishes
+    result = Column(Text, nullable=True) # JSON encoded results
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    worker = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True) # Renewed by the worker's heartbeat while running
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True) # Who queued it; only they can read the result
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class ExtractionCacheEntry(Base):
+    __tablename__ = "extraction_cache"
+
+    key = Column(String, primary_key=True) # sha256(file hash, engine, prompt hash)
+    engine = Column(String, nullable=True)
+    payload = Column(Text) # JSON encoded results
+    size_bytes = Column(Integer)
+    created_at = Column(Float) # Unix timestamps, compared against the TTL
+    last_access = Column(Float, index=True)
+
+class Drawing(Base):
+    """One uploaded file (by content), per user. Re-uploads add runs, not drawings."""
+    __tablename__ = "drawings"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "user_id", name="uq_drawings_hash_user"),
+        Index("ix_drawings_user_id_id", "user_id", "id"),
+        Index("ix_drawings_part_number_id", "part_number", "id"),
+    )
+
+    id = Column(BigId, primary_key=True)
+    content_hash = Column(String(64), index=True) # sha256 of the file
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    filename = Column(String)
+    part_number = Column(String, nullable=True)
+    mime_type = Column(String, nullable=True)
+    size_bytes = Column(Integer, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ExtractionRun(Base):
+    __tablename__ = "extraction_runs"
+    __table_args__ = (
+        Index("ix_extraction_runs_drawing_id_id", "drawing_id", "id"),
+        Index("ix_extraction_runs_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(BigId, primary_key=True)
+    drawing_id = Column(BigId, ForeignKey("drawings.id", ondelete="CASCADE"))
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    engine = Column(String, nullable=True)
+    source = Column(String) # upload | stream | batch | job
+    cached = Column(Boolean, default=False)
+    feature_count = Column(Integer, default=0)
+    failed_pages = Column(Integer, default=0)
+    seconds = Column(Float, nullable=True)
+    pages = Column(JSON, nullable=True) # Per-page timings
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Feature(Base):
+    """
+    One extracted dimension / GD&T frame. drawing_id is denormalized from the run
+    so searches don't need a join. Numeric fields come from tolerance_normalizer.
+    """
+    __tablename__ = "features"
+    __table_args__ = (
+        Index("ix_features_run_id_id", "run_id", "id"),
+        Index("ix_features_drawing_id_id", "drawing_id", "id"),
+        Index("ix_features_type_id", "type", "id"),
+    )
+
+    id = Column(BigId, primary_key=True)
+    run_id = Column(BigId, ForeignKey("extraction_runs.id", ondelete="CASCADE"))
+    drawing_id = Column(BigId, ForeignKey("drawings.id", ondelete="CASCADE"))
+    page = Column(Integer, default=1)
+    type = Column(String)
+    subtype = Column(String, nullable=True)
+    value = Column(String, nullable=True)
+    tolerance = Column(String, nullable=True)
+    datum = Column(String, nullable=True)
+    original_text = Column(Text, nullable=True)
+    box_2d = Column(JSON, nullable=True) # [ymin, xmin, ymax, xmax], 0-1000 on the page
+    nominal = Column(Float, nullable=True)
+    upper = Column(Float, nullable=True)
+    lower = Column(Float, nullable=True)
+    upper_limit = Column(Float, nullable=True)
+    lower_limit = Column(Float, nullable=True)
+    unit = Column(String, nullable=True)
+    iso_code = Column(String, nullable=True)
+    data = Column(JSON) # The feature as returned by the API
+
+class PageFingerprint(Base):
+    """
+    A processed page, kept to recognise later revisions of it (revisions.py): its perceptual hash
+    and its ink mask at diff resolution. Features are looked up through the drawing's content hash.
+    """
+    __tablename__ = "page_fingerprints"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "page", name="uq_page_fingerprints_hash_page"),
+    )
+
+    id = Column(BigId, primary_key=True)
+    content_hash = Column(String(64)) # sha256 of the file the page belongs to
+    page = Column(Integer)
+    phash = Column(String(16)) # 64-bit DCT hash, hex
+    width = Column(Integer) # Size of the mask
+    height = Column(Integer)
+    mask = Column(LargeBinary) # 1-bit PNG of the ink
+    created_at = Column(DateTime, default=datetime.utcnow)
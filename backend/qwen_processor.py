@@ -1,10 +1,16 @@
 import os
-import base64
-import json
-from openai import OpenAI
+import hashlib
+import logging
+from openai import AsyncOpenAI
 from pathlib import Path
+import few_shot
+import metrics
+from engine_client import CONTINUE_PROMPT, TRUNCATED, AsyncEngine, continuation_answer, engine_limits, shared_http_client
+from image_preprocess import ensure_prepared
 
-class QwenProcessor:
+logger = logging.getLogger(__name__)
+
+class QwenProcessor(AsyncEngine):
     def __init__(self, api_key, base_url=None, model="qwen/qwen-2.5-vl-72b-instruct"):
         """
         Initialize Qwen Processor.
@@ -15,16 +21,38 @@ class QwenProcessor:
         if not api_key:
             raise ValueError("API Key is required for Qwen Processor")
         
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             api_key=api_key,
-            base_url=base_url if base_url else "https://openrouter.ai/api/v1" 
+            base_url=base_url if base_url else "https://openrouter.ai/api/v1",
+            http_client=shared_http_client(),
+            max_retries=0 # Retries and backoff are handled by AsyncEngine
         )
         self.model = model
-        print(f"🚀 Qwen Processor Initialized with Model: {self.model}")
+        self.max_tokens = 2000
+        self.engine_id = f"qwen:{self.model}"
+        self.setup_limits(**engine_limits("QWEN"))
+
+        # The static part of every request is assembled once, not per call
+        self.few_shot = few_shot.get_store()
+        self.system_prompt = few_shot.compact(self.get_system_prompt())
+        self.user_prompt = few_shot.compact(self.get_user_prompt())
+        self._prompt_tokens = few_shot.estimate_text_tokens(self.system_prompt) + few_shot.estimate_text_tokens(self.user_prompt)
+        self._fingerprint = hashlib.sha256(
+            "\x00".join((self.system_prompt, self.user_prompt, self.few_shot.fingerprint())).encode("utf-8")
+        ).hexdigest()[:16]
+        self._prefixes = {} # Selected example names -> messages before the request image
+        logger.info(f"🚀 Qwen Processor Initialized with Model: {self.model}")
+
+    def encode_image(self, image):
+        """
+        Data URL for the vision request. Runs the shared preprocessing stage
+        unless the image was already prepared, so the MIME type always matches the bytes.
+        """
+        return ensure_prepared(image).data_url()
 
-    def encode_image(self, image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    async def probe(self):
+        # Free for every OpenAI-compatible provider and goes through the shared connection pool
+        await self.client.models.list()
 
     def get_system_prompt(self):
         return """
@@ -53,13 +81,9 @@ class QwenProcessor:
         ]
         """
 
-    def extract_data(self, image_path):
-        base64_image = self.encode_image(image_path)
-        
-        system_instruction = self.get_system_prompt()
-        
+    def get_user_prompt(self):
         # User prompt with specific Qwen-optimized instructions
-        user_prompt = """
+        return """
         Extract all dimensions and GD&T from this drawing.
         
         Critical Rules:
@@ -73,46 +97,100 @@ class QwenProcessor:
         Return pure JSON.
         """
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_instruction
-                    },
+    def prompt_fingerprint(self):
+        """Changes whenever the prompts or the few-shot examples change, so cached results are invalidated."""
+        return self._fingerprint
+
+    def estimate_request_tokens(self, prepared):
+        few_shot_tokens = self.few_shot.stats("qwen")["example_tokens_max"]
+        return self._prompt_tokens + few_shot_tokens + prepared.stats()["tokens"]["qwen"] + self.max_tokens
+
+    def prompt_stats(self):
+        return {"text_tokens": self._prompt_tokens, "few_shot": self.few_shot.stats("qwen")}
+
+    def _prefix(self, examples):
+        """System prompt and the example turns (image, then its answer), built once per selection."""
+        key = tuple(example.name for example in examples)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = [{"role": "system", "content": self.system_prompt}]
+            for example in examples:
+                prefix.append({
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Example drawing:"},
+                        {"type": "image_url", "image_url": {"url": example.data_url, "detail": "high"}},
+                    ]
+                })
+                prefix.append({"role": "assistant", "content": example.answer})
+            self._prefixes[key] = prefix
+        return prefix
+
+    def _encode(self, prepared):
+        with metrics.stage("encode"):
+            prepared.data_url()
+        with metrics.stage("few_shot"):
+            self.few_shot.select(prepared)
+
+    def _messages(self, prepared, continuation=None):
+        # Both cached on `prepared` by _encode
+        image_url = self.encode_image(prepared)
+        examples = self.few_shot.select(prepared)
+
+        return self._prefix(examples) + [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": self.user_prompt},
                     {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": user_prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}",
-                                    "detail": "high" # Force high resolution processing
-                                }
-                            }
-                        ]
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                            "detail": "high" # Force high resolution processing
+                        }
                     }
-                ],
-                temperature=0.1, # Low temperature for factual extraction
-                max_tokens=2000
-            )
-
-            # Extract content
-            content = response.choices[0].message.content.strip()
-            
-            print(f"QWEN RAW RESPONSE: {content[:200]}...")
-            
-            # Clean Markdown if present
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0]
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0]
-            
-            # Attempt parsing
-            return json.loads(content)
-
-        except Exception as e:
-            print(f"Qwen Processing Error: {e}")
-            return []
+                ]
+            }
+        ] + ([
+            # Follow-up for a cut-off answer: what arrived so far, then ask for the rest
+            {"role": "assistant", "content": continuation_answer(continuation)},
+            {"role": "user", "content": CONTINUE_PROMPT},
+        ] if continuation is not None else [])
+
+    async def _call(self, prepared, continuation=None):
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prepared, continuation),
+            temperature=0.1, # Low temperature for factual extraction
+            max_tokens=self.max_tokens
+        )
+
+        if response.usage:
+            self.record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+
+        # Parsed (fences, cut-off tails and all) by AsyncEngine
+        choice = response.choices[0]
+        content = (choice.message.content or "").strip()
+        
+        logger.debug(f"QWEN RAW RESPONSE: {content[:200]}...")
+        
+        return content, choice.finish_reason == "length"
+
+    async def _stream(self, prepared):
+        """Text deltas of a streamed completion."""
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(prepared),
+            temperature=0.1,
+            max_tokens=self.max_tokens,
+            stream=True,
+            # The last chunk then carries the token usage
+            stream_options={"include_usage": True}
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                self.record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.choices and chunk.choices[0].finish_reason == "length":
+                yield TRUNCATED
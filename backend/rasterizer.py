@@ -0,0 +1,256 @@
+import importlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+# --- CONFIGURATION ---
+RASTER_PROCESSES = int(os.environ.get("RASTER_PROCESSES", 2)) # 0 renders in the calling process
+RASTER_MEMORY_BUDGET_MB = int(os.environ.get("RASTER_MEMORY_BUDGET_MB", 1024))
+RASTER_MAX_DPI = int(os.environ.get("RASTER_MAX_DPI", 200))
+RASTER_MIN_DPI = int(os.environ.get("RASTER_MIN_DPI", 72))
+# Longest edge of a rendered page in pixels. Keeps A0/A1 sheets from exploding in size
+RASTER_MAX_LONG_EDGE_PX = int(os.environ.get("RASTER_MAX_LONG_EDGE_PX", 7000))
+RASTER_SPOOL_DIR = os.environ.get("RASTER_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "drawingscan_raster"))
+
+# Output modes for rendered pages
+OUTPUT_IMAGE = "image"   # PIL image
+OUTPUT_RAW = "raw"       # Decoded pixel bytes, wrapped by PIL without a PNG encode/decode round trip
+OUTPUT_MMAP = "mmap"     # Raw PPM on disk, opened by PIL as a memory map
+
+_PAGE_SIZE_RE = re.compile(r"([\d.]+)\s*x\s*([\d.]+)\s*pts")
+
+class MemoryBudget:
+    """
+    Global limit on the bytes of decoded bitmaps being rendered at once.
+    Callers block until enough budget is free, so concurrent uploads queue
+    instead of pushing the container over its memory limit.
+    A single request larger than the whole budget is still let through, alone.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        with self._cond:
+            self.waiting += 1
+            while self.used_bytes and self.used_bytes + nbytes > self.limit_bytes:
+                self._cond.wait()
+            self.waiting -= 1
+            self.used_bytes += nbytes
+
+    def release(self, nbytes):
+        with self._cond:
+            self.used_bytes -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit_bytes": self.limit_bytes,
+                "used_bytes": self.used_bytes,
+                "waiting": self.waiting,
+            }
+
+class RenderedPage:
+    """
+    One rasterized page. Exactly one of image / raw / path is set, depending on the output mode.
+    Pages returned by render_page hold their share of the memory budget until close(), so use
+    them as a context manager (or close them) once the page image is no longer needed.
+    """
+
+    def __init__(self, page, dpi, width, height, image=None, raw=None, mode="RGB", path=None):
+        self.page = page
+        self.dpi = dpi
+        self.width = width
+        self.height = height
+        self.image = image
+        self.raw = raw
+        self.mode = mode
+        self.path = path
+        self.reserved_bytes = 0
+        self._opened = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        """Returns a PIL image, wrapping the raw pixels or memory-mapping the file as needed."""
+        from PIL import Image
+        if self._opened is None:
+            if self.image is not None:
+                self._opened = self.image
+            elif self.raw is not None:
+                self._opened = Image.frombuffer(self.mode, (self.width, self.height), self.raw, "raw", self.mode, 0, 1)
+            else:
+                self._opened = Image.open(self.path)
+        return self._opened
+
+    def save(self, target_path, format="PNG"):
+        self.open().save(target_path, format=format)
+
+    def close(self):
+        if self._opened is not None:
+            self._opened.close()
+            self._opened = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.image = None
+        self.raw = None
+        self.path = None
+        if self.reserved_bytes:
+            budget.release(self.reserved_bytes)
+            self.reserved_bytes = 0
+
+budget = MemoryBudget(RASTER_MEMORY_BUDGET_MB * 1024 * 1024)
+metrics.QUEUE_DEPTH.set_function(lambda: budget.waiting, queue="render")
+_pool = None
+_pool_lock = threading.Lock()
+
+def renders_in_process():
+    """
+    True if pages are rendered by this process rather than the pool: with RASTER_PROCESSES=0, and in
+    daemonic processes (e.g. job workers), which cannot fork children.
+    """
+    return RASTER_PROCESSES <= 0 or multiprocessing.current_process().daemon
+
+def _get_pool():
+    """The warm render pool, created once and reused for every page. None when rendering in-process."""
+    global _pool
+    if renders_in_process():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=RASTER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _pool
+
+def _preload(_):
+    """Imports the rendering stack inside a pool process."""
+    importlib.import_module("pdf2image")
+    importlib.import_module("PIL.Image")
+    return os.getpid()
+
+def warm_up():
+    """Starts the render processes ahead of the first upload."""
+    pool = _get_pool()
+    if pool is not None:
+        list(pool.map(_preload, range(RASTER_PROCESSES)))
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def page_count(file_path):
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(file_path)["Pages"])
+
+def page_sizes(file_path, first_page, last_page):
+    """Physical page sizes in points, {page_number: (width_pt, height_pt)}."""
+    from pdf2image import pdfinfo_from_path
+    info = pdfinfo_from_path(file_path, first_page=first_page, last_page=last_page)
+    sizes = {}
+    for key, value in info.items():
+        match = _PAGE_SIZE_RE.search(str(value))
+        if not match or "size" not in key:
+            continue
+        # "Page    3 size" for ranges, plain "Page size" for single page documents
+        number = re.findall(r"\d+", key)
+        page = int(number[0]) if number else first_page
+        sizes[page] = (float(match.group(1)), float(match.group(2)))
+    return sizes
+
+def choose_dpi(width_pt, height_pt):
+    """Highest DPI up to RASTER_MAX_DPI that keeps the long edge within RASTER_MAX_LONG_EDGE_PX."""
+    long_edge_inches = max(width_pt, height_pt) / 72.0
+    if long_edge_inches <= 0:
+        return RASTER_MAX_DPI
+    dpi = int(RASTER_MAX_LONG_EDGE_PX / long_edge_inches)
+    return max(RASTER_MIN_DPI, min(RASTER_MAX_DPI, dpi))
+
+def _render(file_path, page, dpi, output, spool_dir):
+    """Runs inside a pool process. Returns a picklable RenderedPage."""
+    from pdf2image import convert_from_path
+
+    if output == OUTPUT_MMAP:
+        os.makedirs(spool_dir, exist_ok=True)
+        # pdftoppm writes the bitmap straight to disk, it never passes through this process
+        paths = convert_from_path(
+            file_path, dpi=dpi, first_page=page, last_page=page,
+            output_folder=spool_dir, output_file=uuid.uuid4().hex, fmt="ppm", paths_only=True,
+        )
+        from PIL import Image
+        with Image.open(paths[0]) as img:
+            width, height = img.size
+        return RenderedPage(page, dpi, width, height, path=paths[0])
+
+    image = convert_from_path(file_path, dpi=dpi, first_page=page, last_page=page)[0]
+    if output == OUTPUT_RAW:
+        # Pickled back to the caller as plain bytes: no full-resolution encode here and decode there
+        return RenderedPage(page, dpi, image.width, image.height, raw=image.tobytes(), mode=image.mode)
+    return RenderedPage(page, dpi, image.width, image.height, image=image)
+
+def render_page(file_path, page, output=OUTPUT_RAW, dpi=None, size_pt=None):
+    """
+    Renders a single page at a DPI derived from its physical size.
+    Blocks while the global memory budget is exhausted. The returned page keeps its
+    reservation until it is closed, since the bitmap lives as long as the page does.
+    """
+    if dpi is None:
+        if size_pt is None:
+            size_pt = page_sizes(file_path, page, page).get(page, (595.0, 842.0)) # Fallback: A4
+        dpi = choose_dpi(*size_pt)
+
+    # Decoded RGB bitmap estimate
+    width_pt, height_pt = size_pt or (595.0, 842.0)
+    estimate = int(width_pt / 72.0 * dpi) * int(height_pt / 72.0 * dpi) * 3
+
+    budget.acquire(estimate)
+    try:
+        pool = _get_pool()
+        if pool is None:
+            # Same process: the PIL image itself is already the cheapest handover
+            rendered = _render(file_path, page, dpi, OUTPUT_IMAGE if output == OUTPUT_RAW else output, RASTER_SPOOL_DIR)
+        else:
+            rendered = pool.submit(_render, file_path, page, dpi, output, RASTER_SPOOL_DIR).result()
+    except BaseException:
+        budget.release(estimate)
+        raise
+    rendered.reserved_bytes = estimate
+    return rendered
+
+def render_pages(file_path, first_page=1, last_page=None, output=OUTPUT_RAW):
+    """
+    Renders only the requested page range, one page at a time. Sizes are read with a single pdfinfo call.
+    Close each page before asking for the next one, or the memory budget can run dry.
+    """
+    if last_page is None:
+        last_page = page_count(file_path)
+    sizes = page_sizes(file_path, first_page, last_page)
+    for page in range(first_page, last_page + 1):
+        yield render_page(file_path, page, output=output, size_pt=sizes.get(page))
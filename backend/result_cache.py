@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+import models
+from database import SessionLocal, engine
+
+# --- CONFIGURATION ---
+CACHE_ENABLED = os.environ.get("CACHE_ENABLED", "1") == "1"
+CACHE_MEMORY_ENTRIES = int(os.environ.get("CACHE_MEMORY_ENTRIES", 256))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 256 * 1024 * 1024)) # Disk tier budget
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks so large PDFs are never fully in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_key(file_hash, engine_id, prompt_hash):
+    return hashlib.sha256(f"{file_hash}:{engine_id}:{prompt_hash}".encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Two-tier cache for extraction results.
+    Tier 1: in-process LRU (OrderedDict) holding the serialized JSON.
+    Tier 2: the extraction_cache table, shared by the API and all job workers.
+    Entries expire after ttl_seconds; the disk tier is trimmed to max_bytes
+    by evicting the least recently used rows.
+    """
+
+    def __init__(self, memory_entries=CACHE_MEMORY_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 ttl_seconds=CACHE_TTL_SECONDS, enabled=CACHE_ENABLED):
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._memory = OrderedDict() # key -> (created_at, payload)
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+        if self.enabled:
+            models.ExtractionCacheEntry.__table__.create(bind=engine, checkfirst=True)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, payload):
+        with self._lock:
+            self._memory[key] = (created_at, payload)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns a fresh copy of the cached results, or None on a miss."""
+        if not self.enabled:
+            return None
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_expired(entry[0], now):
+                    del self._memory[key]
+                    entry = None
+                else:
+                    self._memory.move_to_end(key)
+        if entry is not None:
+            self._count("memory_hits")
+            return json.loads(entry[1])
+
+        db = SessionLocal()
+        try:
+            row = db.get(models.ExtractionCacheEntry, key)
+            if row is None:
+                self._count("misses")
+                return None
+            if self._is_expired(row.created_at, now):
+                db.delete(row)
+                db.commit()
+                self._count("expired")
+                self._count("misses")
+                return None
+            row.last_access = now
+            db.commit()
+            created_at, payload = row.created_at, row.payload
+        finally:
+            db.close()
+
+        self._remember(key, created_at, payload)
+        self._count("disk_hits")
+        return json.loads(payload)
+
+    def put(self, key, results, engine_id=None):
+        if not self.enabled:
+            return
+        now = time.time()
+        payload = json.dumps(results)
+        self._remember(key, now, payload)
+
+        db = SessionLocal()
+        try:
+            db.merge(models.ExtractionCacheEntry(
+                key=key,
+                engine=engine_id,
+                payload=payload,
+                size_bytes=len(payload),
+                created_at=now,
+                last_access=now,
+            ))
+            db.commit()
+            self._evict(db)
+        finally:
+            db.close()
+        self._count("stores")
+
+    def _evict(self, db):
+        """Drops expired rows, then least recently used rows until under max_bytes."""
+        Entry = models.ExtractionCacheEntry
+        if self.ttl_seconds > 0:
+            expired = db.query(Entry).filter(Entry.created_at < time.time() - self.ttl_seconds).delete()
+            if expired:
+                self._count("expired", expired)
+
+        total = db.query(func.coalesce(func.sum(Entry.size_bytes), 0)).scalar()
+        if total > self.max_bytes:
+            victims = []
+            for key, size_bytes in db.query(Entry.key, Entry.size_bytes).order_by(Entry.last_access):
+                if total <= self.max_bytes:
+                    break
+                total -= size_bytes
+                victims.append(key)
+            db.query(Entry).filter(Entry.key.in_(victims)).delete(synchronize_session=False)
+            with self._lock:
+                for key in victims:
+                    self._memory.pop(key, None)
+                self.counters["evictions"] += len(victims)
+        db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        db = SessionLocal()
+        try:
+            db.query(models.ExtractionCacheEntry).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            memory_size = len(self._memory)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": memory_size,
+            "memory_capacity": self.memory_entries,
+            "disk_budget_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+cache = ResultCache()
@@ -0,0 +1,347 @@
+import io
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import drawing_store
+import image_preprocess
+import models
+import roi_detect
+import tiling
+from database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+REVISION_REUSE = os.environ.get("REVISION_REUSE", "1") == "1" # Re-extract only what changed since a similar stored page
+REVISION_MAX_DISTANCE = int(os.environ.get("REVISION_MAX_DISTANCE", 12)) # Perceptual hash bits (of 64) a revision may differ in
+REVISION_MAX_CHANGE = float(os.environ.get("REVISION_MAX_CHANGE", 0.4)) # Changed share of the page above which it is re-extracted whole
+REVISION_DIFF_PX = int(os.environ.get("REVISION_DIFF_PX", 1600)) # Long edge of the stored ink masks that pages are diffed at
+
+CELL_PX = 16 # Diff grid; a cell with MIN_CHANGED_PIXELS changed pixels counts as changed
+MIN_CHANGED_PIXELS = 6
+MAX_SHIFT = 0.05 # Largest page offset (share of the size) that is aligned before diffing
+ASPECT_TOLERANCE = 0.02
+
+def enabled():
+    # Features of the previous revision come from the history tables
+    return REVISION_REUSE and drawing_store.STORE_RESULTS
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2.0 / n)
+
+_DCT = _dct_matrix(32)
+
+def perceptual_hash(gray):
+    """64-bit DCT hash: low frequencies of a 32x32 thumbnail above their median. Stable across small edits."""
+    thumb = np.asarray(gray.resize((32, 32), Image.BOX), dtype=np.float64)
+    low = (_DCT @ thumb @ _DCT.T)[:8, :8].ravel()
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def _bit_counts(values):
+    return np.unpackbits(values.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+def encode_mask(mask):
+    buffer = io.BytesIO()
+    Image.fromarray(mask).convert("1").save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def decode_mask(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return np.asarray(image.convert("L")) > 0
+
+class PageIndex:
+    """
+    Perceptual hashes of every stored page, kept in memory as a NumPy array so the closest
+    previous page is one vectorised Hamming distance away. New rows (also from job workers in other
+    processes) are picked up incrementally by id on each lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._aspects = np.zeros(0)
+        self._table_ready = False
+
+    def _ensure_table(self):
+        if not self._table_ready:
+            models.PageFingerprint.__table__.create(bind=engine, checkfirst=True)
+            self._table_ready = True
+
+    def refresh(self, db):
+        Row = models.PageFingerprint
+        rows = db.execute(
+            select(Row.id, Row.phash, Row.width, Row.height).where(Row.id > self._last_id).order_by(Row.id)
+        ).all()
+        with self._lock:
+            # A concurrent lookup may have appended (some of) these rows meanwhile
+            rows = [row for row in rows if row.id > self._last_id]
+            if not rows:
+                return
+            self._ids = np.concatenate([self._ids, np.array([row.id for row in rows], dtype=np.int64)])
+            self._hashes = np.concatenate([self._hashes, np.array([int(row.phash, 16) for row in rows], dtype=np.uint64)])
+            self._aspects = np.concatenate([self._aspects, np.array([row.width / max(1, row.height) for row in rows])])
+            self._last_id = rows[-1].id
+
+    def closest(self, db, phash, aspect, exclude_hash):
+        """Stored pages within REVISION_MAX_DISTANCE bits and the same aspect ratio, closest first."""
+        self._ensure_table()
+        self.refresh(db)
+        with self._lock:
+            ids, hashes, aspects = self._ids, self._hashes, self._aspects
+        if not ids.size:
+            return []
+        distances = _bit_counts(hashes ^ np.uint64(phash))
+        close = (distances <= REVISION_MAX_DISTANCE) & (np.abs(aspects / aspect - 1) <= ASPECT_TOLERANCE)
+        order = np.flatnonzero(close)[np.argsort(distances[close], kind="stable")]
+        Row = models.PageFingerprint
+        matches = []
+        for index in order[:5]:
+            row = db.get(Row, int(ids[index]))
+            if row is not None and row.content_hash != exclude_hash:
+                matches.append((row, int(distances[index])))
+        return matches
+
+    def add(self, content_hash, page, fingerprint):
+        self._ensure_table()
+        db = SessionLocal()
+        try:
+            db.add(models.PageFingerprint(
+                content_hash=content_hash,
+                page=page,
+                phash=f"{fingerprint.phash:016x}",
+                width=fingerprint.mask.shape[1],
+                height=fingerprint.mask.shape[0],
+                mask=encode_mask(fingerprint.mask),
+            ))
+            db.commit()
+        except IntegrityError:
+            # Page already known (re-upload of the same file)
+            db.rollback()
+        finally:
+            db.close()
+
+index = PageIndex()
+
+class Fingerprint:
+    """Ink mask at diff resolution and perceptual hash of a page."""
+
+    def __init__(self, gray):
+        self.page_size = gray.size
+        self.scale = min(1.0, REVISION_DIFF_PX / max(gray.size))
+        small = gray if self.scale == 1.0 else gray.resize(
+            (max(1, round(gray.width * self.scale)), max(1, round(gray.height * self.scale))), Image.BOX)
+        self.mask = roi_detect.ink_mask(small)
+        self.phash = perceptual_hash(small)
+
+def _block_sum(mask, block):
+    h, w = mask.shape[0] // block * block, mask.shape[1] // block * block
+    return mask[:h, :w].reshape(h // block, block, w // block, block).sum(axis=(1, 3), dtype=np.float32)
+
+def _shift(mask, dy, dx):
+    """The mask moved by (dy, dx), blank where it moved in from outside."""
+    shifted = np.zeros_like(mask)
+    h, w = mask.shape
+    shifted[max(0, dy):h + min(0, dy), max(0, dx):w + min(0, dx)] = mask[max(0, -dy):h - max(0, dy), max(0, -dx):w - max(0, dx)]
+    return shifted
+
+def align(current, previous):
+    """
+    Offset (dy, dx) that moves the previous page onto the current one: FFT cross-correlation
+    at quarter resolution, refined at full resolution. (0, 0) for offsets beyond MAX_SHIFT.
+    """
+    a, b = _block_sum(current, 4), _block_sum(previous, 4)
+    correlation = np.fft.irfft2(np.fft.rfft2(a) * np.conj(np.fft.rfft2(b)), s=a.shape)
+    dy, dx = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    dy = dy - a.shape[0] if dy > a.shape[0] // 2 else dy
+    dx = dx - a.shape[1] if dx > a.shape[1] // 2 else dx
+    if abs(dy) > MAX_SHIFT * a.shape[0] or abs(dx) > MAX_SHIFT * a.shape[1]:
+        return 0, 0
+    candidates = [(int(dy) * 4 + y, int(dx) * 4 + x) for y in range(-2, 3) for x in range(-2, 3)]
+    return min(candidates, key=lambda offset: np.count_nonzero(current ^ _shift(previous, *offset)))
+
+def changed_regions(current, previous):
+    """
+    (left, top, right, bottom) boxes, in mask px, around everything drawn, erased or moved
+    between two ink masks, and the (dy, dx) offset of the previous page. Differences of one
+    pixel (anti-aliasing, rendering) are ignored.
+    """
+    if previous.shape != current.shape:
+        previous = np.asarray(Image.fromarray(previous).resize(current.shape[::-1], Image.NEAREST))
+    offset = align(current, previous)
+    previous = _shift(previous, *offset)
+    changed = (current & ~roi_detect.dilate(previous)) | (previous & ~roi_detect.dilate(current))
+    cells = _block_sum(np.pad(changed, ((0, -current.shape[0] % CELL_PX), (0, -current.shape[1] % CELL_PX))), CELL_PX)
+    components = roi_detect.Components(roi_detect.dilate(cells >= MIN_CHANGED_PIXELS))
+    boxes = [
+        (int(components.left[i]) * CELL_PX, int(components.top[i]) * CELL_PX,
+         int(components.right[i]) * CELL_PX, int(components.bottom[i]) * CELL_PX)
+        for i in range(components.count)
+    ]
+    return boxes, offset
+
+def _normalized(box, page_size):
+    """(left, top, right, bottom) px -> [ymin, xmin, ymax, xmax] 0-1000."""
+    width, height = page_size
+    return [box[1] / height * 1000, box[0] / width * 1000, box[3] / height * 1000, box[2] / width * 1000]
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _previous_features(db, content_hash, page, user_id):
+    """(run, features of the page) of the user's latest stored run of a file whose page did not fail."""
+    run = db.execute(
+        select(models.ExtractionRun)
+        .join(models.Drawing, models.Drawing.id == models.ExtractionRun.drawing_id)
+        .where(models.Drawing.content_hash == content_hash, models.Drawing.user_id == user_id)
+        .order_by(models.ExtractionRun.id.desc())
+        .limit(1)
+    ).scalars().first()
+    if run is None or any(timing.get("page") == page and "error" in timing for timing in run.pages or []):
+        return None, []
+    rows = db.execute(
+        select(models.Feature.data)
+        .where(models.Feature.run_id == run.id, models.Feature.page == page)
+        .order_by(models.Feature.id)
+    ).scalars().all()
+    return run, [dict(data) for data in rows]
+
+class Revision:
+    """
+    What a page has in common with the closest stored page. `carried` are the previous features
+    outside the changed regions; `mosaic` holds the changed regions to extract (None if nothing changed).
+    Without a usable match, `match` is None and the page is extracted whole.
+    """
+
+    def __init__(self, gray, content_hash, page, user_id):
+        self.gray = gray
+        self.content_hash = content_hash
+        self.page = page
+        self.user_id = user_id
+        self.fingerprint = Fingerprint(gray)
+        self.match = None
+        self.carried = []
+        self.mosaic = None
+        self.engine = None
+        self.stats = None
+
+    def _find(self):
+        started = time.perf_counter()
+        fingerprint = self.fingerprint
+        db = SessionLocal()
+        try:
+            aspect = fingerprint.mask.shape[1] / max(1, fingerprint.mask.shape[0])
+            for row, distance in index.closest(db, fingerprint.phash, aspect, self.content_hash):
+                # Only the user's own drawings: pages of other users are never carried over
+                run, features = _previous_features(db, row.content_hash, row.page, self.user_id)
+                if run is None:
+                    continue
+                if features and not all(tiling._has_box(item) for item in features):
+                    # Without boxes (e.g. Gemini) the features cannot be matched to regions
+                    continue
+                self._plan(row, distance, run, features, started)
+                return self
+        finally:
+            db.close()
+        return self
+
+    def _plan(self, row, distance, run, features, started):
+        fingerprint = self.fingerprint
+        changed, (dy, dx) = changed_regions(fingerprint.mask, decode_mask(row.mask))
+        page_w, page_h = self.gray.size
+        scale = fingerprint.scale
+        if dy or dx:
+            # Previous boxes onto the current page (sheet scanned or plotted with an offset)
+            height, width = fingerprint.mask.shape
+            for item in features:
+                box = item["box_2d"]
+                item["box_2d"] = [round(box[0] + dy / height * 1000), round(box[1] + dx / width * 1000),
+                                  round(box[2] + dy / height * 1000), round(box[3] + dx / width * 1000)]
+        regions = [
+            (max(0, int(l / scale)), max(0, int(t / scale)), min(page_w, int(r / scale) + 1), min(page_h, int(b / scale) + 1))
+            for l, t, r, b in changed
+        ]
+        # A changed region that touches a previous feature takes in the whole feature, so it is read again in one piece
+        boxes = [_normalized(region, self.gray.size) for region in regions]
+        grown = True
+        while grown:
+            grown = False
+            for item in features:
+                box = item["box_2d"]
+                for i, region in enumerate(boxes):
+                    if _overlaps(box, region) and not (region[0] <= box[0] and region[1] <= box[1]
+                                                       and region[2] >= box[2] and region[3] >= box[3]):
+                        boxes[i] = [min(box[0], region[0]), min(box[1], region[1]), max(box[2], region[2]), max(box[3], region[3])]
+                        grown = True
+        pad = max(page_w, page_h) * 0.01
+        regions = roi_detect.merge_boxes([
+            (max(0, int(b[1] / 1000 * page_w - pad)), max(0, int(b[0] / 1000 * page_h - pad)),
+             min(page_w, int(b[3] / 1000 * page_w + pad)), min(page_h, int(b[2] / 1000 * page_h + pad)))
+            for b in boxes
+        ])
+        change = sum((r - l) * (b - t) for l, t, r, b in regions) / float(page_w * page_h)
+        self.stats = {
+            "previous_run": run.id,
+            "previous_page": row.page,
+            "distance": distance,
+            "offset": [dy, dx],
+            "changed": round(change, 3),
+            "changed_regions": len(regions),
+        }
+        if change > REVISION_MAX_CHANGE:
+            self.stats["reused"] = False
+            return
+
+        normalized = [_normalized(region, self.gray.size) for region in regions]
+        self.match = row
+        self.engine = run.engine
+        self.carried = []
+        for item in features:
+            if not any(_overlaps(item["box_2d"], region) for region in normalized):
+                item["page"] = self.page
+                item["reused_from_run"] = run.id
+                self.carried.append(item)
+        if regions:
+            self.mosaic = roi_detect.region_mosaic(self.gray, regions)
+            self.stats["mosaic"] = self.mosaic.stats
+        self.stats.update({"reused": True, "carried_over": len(self.carried),
+                           "seconds": round(time.perf_counter() - started, 3)})
+        logger.info(f"♻️ Page {self.page} matches run {run.id} (distance {distance}): {len(self.carried)} feature(s) carried over, "
+                    f"{len(regions)} changed region(s) ({change:.1%} of the page) to extract",
+                    extra={"page": self.page, **{k: v for k, v in self.stats.items() if k != "mosaic"}})
+
+    def merge(self, extracted):
+        """Carried-over features plus those read from the changed regions, de-duplicated where the two meet."""
+        return tiling.dedupe_features(self.carried + extracted)
+
+    def carries(self, item):
+        """True if a feature read from the changed regions is one of the carried-over ones (a changed region's padding)."""
+        return tiling._has_box(item) and any(
+            other.get("type") == item.get("type")
+            and tiling.box_overlap(item["box_2d"], other["box_2d"]) >= tiling.DEDUP_OVERLAP
+            and tiling.text_similarity(item, other) >= tiling.DEDUP_TEXT_SIMILARITY
+            for other in self.carried
+        )
+
+    def remember(self):
+        """Stores the page, so later revisions can be matched against it."""
+        index.add(self.content_hash, self.page, self.fingerprint)
+
+def find(image, content_hash, page, user_id):
+    """
+    Revision of a page (see Revision), matched against the stored drawings of user_id.
+    Its match is None when the page has to be extracted whole.
+    """
+    return Revision(image_preprocess.to_grayscale(image), content_hash, page, user_id)._find()
@@ -0,0 +1,380 @@
+import logging
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import image_preprocess
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+ROI_MODE = os.environ.get("ROI_MODE", "off") # off | on: send only the annotated regions of a page, packed into a mosaic
+ROI_MAX_COVERAGE = float(os.environ.get("ROI_MAX_COVERAGE", 0.5)) # Pages whose regions cover more than this are sent whole
+ROI_ANALYSIS_PX = int(os.environ.get("ROI_ANALYSIS_PX", 2000)) # Long edge the page is analysed at
+ROI_TITLE_BLOCK = os.environ.get("ROI_TITLE_BLOCK", "1") == "1" # Send the title block (general tolerances, part number)
+
+MIN_TEXT_COMPONENTS = 10 # Fewer character-sized components: no text to go by, send the page
+MOSAIC_GAP = 16 # White px between packed regions
+
+def settings_fingerprint():
+    """Part of the result cache key: the mosaic is a different image than the page."""
+    return f"roi:{ROI_MODE}:{ROI_MAX_COVERAGE}:{ROI_ANALYSIS_PX}:{int(ROI_TITLE_BLOCK)}"
+
+def ink_mask(gray):
+    """True where there is ink. Otsu's threshold, capped so light scan noise stays paper."""
+    return np.asarray(gray) < min(image_preprocess.otsu_threshold(gray), 200)
+
+def _runs(mask):
+    """Horizontal runs of True: (row, start, end) arrays, end exclusive, ordered by row and start."""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    diff = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return rows, starts, ends
+
+class Components:
+    """
+    8-connected components of a binary mask with their bounding boxes, labelled on the
+    horizontal runs of the mask rather than pixel by pixel, so a page takes a few hundred ms in NumPy.
+    Also measures how much of each box's edges is inked, which singles out rectangular frames.
+    """
+
+    def __init__(self, mask):
+        rows, starts, ends = _runs(mask)
+        self.runs = (rows, starts, ends)
+        count = len(rows)
+        # Runs of the next row that touch each run, diagonals included
+        stride = mask.shape[1] + 2
+        key_start = rows * stride + starts
+        key_end = rows * stride + ends
+        lo = np.searchsorted(key_end, (rows + 1) * stride + starts - 1, side="right")
+        hi = np.searchsorted(key_start, (rows + 1) * stride + ends, side="right")
+        touching = np.maximum(hi - lo, 0)
+        a = np.repeat(np.arange(count), touching)
+        b = np.repeat(lo, touching) + np.arange(touching.sum()) - np.repeat(np.cumsum(touching) - touching, touching)
+
+        # Union-find on arrays: hook every root onto the smaller one, compress, repeat
+        parent = np.arange(count)
+        while a.size:
+            root_a, root_b = parent[a], parent[b]
+            low, high = np.minimum(root_a, root_b), np.maximum(root_a, root_b)
+            pending = low != high
+            if not pending.any():
+                break
+            np.minimum.at(parent, high[pending], low[pending])
+            while True:
+                grand = parent[parent]
+                if np.array_equal(grand, parent):
+                    break
+                parent = grand
+        _, labels = np.unique(parent, return_inverse=True)
+        self.labels = labels
+        self.count = int(labels.max()) + 1 if count else 0
+
+        n = self.count
+        self.top = np.full(n, mask.shape[0])
+        self.left = np.full(n, mask.shape[1])
+        self.bottom = np.zeros(n, dtype=np.int64)
+        self.right = np.zeros(n, dtype=np.int64)
+        self.pixels = np.zeros(n, dtype=np.int64)
+        np.minimum.at(self.top, labels, rows)
+        np.maximum.at(self.bottom, labels, rows + 1)
+        np.minimum.at(self.left, labels, starts)
+        np.maximum.at(self.right, labels, ends)
+        np.add.at(self.pixels, labels, ends - starts)
+
+        # Inked share of each edge of the bounding box (1.0 all round for a closed rectangle)
+        lengths = ends - starts
+        self.edges = np.zeros((4, n))
+        for side, selected, amount in (
+            (0, rows == self.top[labels], lengths),
+            (1, rows == self.bottom[labels] - 1, lengths),
+            (2, starts <= self.left[labels] + 1, 1),
+            (3, ends >= self.right[labels] - 1, 1),
+        ):
+            np.add.at(self.edges[side], labels[selected], amount if np.isscalar(amount) else amount[selected])
+        self.edges[:2] /= np.maximum(self.width, 1)
+        self.edges[2:] /= np.maximum(self.height, 1)
+
+    @property
+    def width(self):
+        return self.right - self.left
+
+    @property
+    def height(self):
+        return self.bottom - self.top
+
+    def box(self, index):
+        return (int(self.left[index]), int(self.top[index]), int(self.right[index]), int(self.bottom[index]))
+
+    def label_image(self, shape):
+        """Component index per pixel (-1 for background). Only meant for small masks like the text grid."""
+        image = np.full(shape, -1, dtype=np.int64)
+        for row, start, end, label in zip(*self.runs, self.labels):
+            image[row, start:end] = label
+        return image
+
+def dilate(mask):
+    """3x3 binary dilation."""
+    grown = mask.copy()
+    grown[1:, :] |= mask[:-1, :]
+    grown[:-1, :] |= mask[1:, :]
+    horizontal = grown.copy()
+    grown[:, 1:] |= horizontal[:, :-1]
+    grown[:, :-1] |= horizontal[:, 1:]
+    return grown
+
+def _touch(a, b, gap=0):
+    return a[0] <= b[2] + gap and b[0] <= a[2] + gap and a[1] <= b[3] + gap and b[1] <= a[3] + gap
+
+def merge_boxes(boxes, gap=0):
+    """Unions (left, top, right, bottom) boxes that overlap or lie within gap of each other, until none do."""
+    boxes = [tuple(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if _touch(box, other, gap):
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return sorted(boxes, key=lambda box: (box[1], box[0]))
+
+def find_border(components, shape):
+    """The drawing border: the component spanning most of the sheet, else the extent of all ink."""
+    if not components.count:
+        return None
+    spans = (components.width >= 0.8 * shape[1]) & (components.height >= 0.8 * shape[0])
+    if spans.any():
+        index = int(np.argmax(np.where(spans, components.width * components.height, -1)))
+        return components.box(index)
+    return (int(components.left.min()), int(components.top.min()), int(components.right.max()), int(components.bottom.max()))
+
+def find_title_block(mask, border):
+    """
+    The title block: the rectangle in the bottom-right corner of the border that is closed off by a
+    horizontal line running to the border's right edge and a vertical line running down to its bottom.
+    The topmost such rectangle is taken, so a revision table stacked on top is included.
+    """
+    left, top, right, bottom = border
+    width, height = right - left, bottom - top
+    tolerance = max(3, round(0.01 * max(width, height)))
+
+    rows, starts, ends = _runs(mask)
+    horizontal = ((ends - starts >= 0.15 * width) & (ends >= right - tolerance) & (starts > left + 0.3 * width)
+                  & (rows > top + 0.5 * height) & (rows < bottom - tolerance))
+    columns, vertical_tops, vertical_bottoms = _runs(mask.T)
+    vertical = (vertical_bottoms - vertical_tops >= 0.05 * height) & (vertical_bottoms >= bottom - tolerance)
+    columns, vertical_tops = columns[vertical], vertical_tops[vertical]
+
+    for row, start in sorted(zip(rows[horizontal].tolist(), starts[horizontal].tolist())):
+        closed = (np.abs(columns - start) <= tolerance) & (vertical_tops <= row + tolerance)
+        if closed.any():
+            return (int(start), int(row), int(right), int(bottom))
+    return None
+
+def find_regions(gray):
+    """
+    Annotated regions of a page: groups of character-sized components (dimension text, tolerances,
+    notes), rectangular frames the size of a few characters (feature control frames, basic dimensions)
+    and the title block. Geometry, the border and centre lines are left out.
+    Returns ([(left, top, right, bottom)] in page px, details) or (None, details) when there is no text to go by.
+    """
+    scale = min(1.0, ROI_ANALYSIS_PX / max(gray.size))
+    small = gray if scale == 1.0 else gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.BOX)
+    mask = ink_mask(small)
+    components = Components(mask)
+    height, width = components.height, components.width
+    details = {"components": components.count}
+
+    # Character height: the typical height of the small components, which are mostly text
+    candidates = (height >= 4) & (height <= 0.04 * max(mask.shape)) & (width <= 3 * height)
+    if np.count_nonzero(candidates) < MIN_TEXT_COMPONENTS:
+        return None, details
+    char = float(np.median(height[candidates]))
+    details["char_px"] = round(char / scale, 1)
+
+    longest, shortest = np.maximum(height, width), np.minimum(height, width)
+    dash = (shortest <= max(2.0, 0.15 * char)) & (longest > 1.5 * char) # Centre and hidden line dashes
+    text = (height <= 2 * char) & (width <= 4 * char) & (longest >= 0.4 * char) & ~dash
+    frames = ((components.edges >= 0.85).all(axis=0) & (height >= 1.2 * char) & (height <= 5 * char)
+              & (width >= height) & (width <= 40 * char))
+
+    # Characters closer than about one character height form one annotation
+    cell = max(2, int(round(char)))
+    grid = np.zeros((mask.shape[0] // cell + 1, mask.shape[1] // cell + 1), dtype=bool)
+    text_indices = np.flatnonzero(text)
+    for index in text_indices:
+        grid[components.top[index] // cell:(components.bottom[index] - 1) // cell + 1,
+             components.left[index] // cell:(components.right[index] - 1) // cell + 1] = True
+    groups = Components(dilate(grid))
+    group_of = groups.label_image(grid.shape)
+    group_boxes = {}
+    for index in text_indices:
+        group = int(group_of[components.top[index] // cell, components.left[index] // cell])
+        box = components.box(index)
+        current = group_boxes.get(group)
+        group_boxes[group] = box if current is None else (
+            min(box[0], current[0]), min(box[1], current[1]), max(box[2], current[2]), max(box[3], current[3]))
+    frame_boxes = [components.box(index) for index in np.flatnonzero(frames)]
+
+    boxes = list(group_boxes.values()) + frame_boxes
+    border = find_border(components, mask.shape)
+    title_block = find_title_block(mask, border) if border else None
+    if title_block:
+        # Text inside the title block goes with it, or not at all
+        boxes = [box for box in boxes if not (box[0] >= title_block[0] and box[1] >= title_block[1])]
+        if ROI_TITLE_BLOCK:
+            boxes.append(title_block)
+
+    pad = char
+    regions = [
+        (max(0, int((left - pad) / scale)), max(0, int((top - pad) / scale)),
+         min(gray.width, int(math.ceil((right + pad) / scale))), min(gray.height, int(math.ceil((bottom + pad) / scale))))
+        for left, top, right, bottom in boxes
+    ]
+    details.update({
+        "text_groups": len(group_boxes),
+        "frames": len(frame_boxes),
+        "title_block": [int(v / scale) for v in title_block] if title_block else None,
+    })
+    return merge_boxes(regions), details
+
+class Mosaic:
+    """
+    Regions cut from a page and packed into one smaller image, with the map back to the page:
+    `placements` pairs each region (page px) with its rectangle in the mosaic (x, y, w, h).
+    """
+
+    def __init__(self, image, placements, page_size, stats):
+        self.image = image
+        self.placements = placements
+        self.page_size = page_size
+        self.stats = stats
+
+    def _placement(self, x, y):
+        """The region at (or, in a gap, nearest to) a mosaic position."""
+        def distance(placement):
+            px, py, pw, ph = placement[1]
+            dx = max(px - x, 0, x - (px + pw))
+            dy = max(py - y, 0, y - (py + ph))
+            return dx * dx + dy * dy
+        return min(self.placements, key=distance)
+
+    def to_page_box(self, box_2d):
+        """[ymin, xmin, ymax, xmax] normalised 0-1000 on the mosaic -> same format on the page."""
+        ymin, xmin, ymax, xmax = [float(v) for v in box_2d]
+        width, height = self.image.size
+        x0, x1 = xmin / 1000.0 * width, xmax / 1000.0 * width
+        y0, y1 = ymin / 1000.0 * height, ymax / 1000.0 * height
+        (left, top, right, bottom), (px, py, pw, ph) = self._placement((x0 + x1) / 2, (y0 + y1) / 2)
+        sx, sy = (right - left) / pw, (bottom - top) / ph
+        page_w, page_h = self.page_size
+
+        def page_x(x):
+            return (left + (min(max(x, px), px + pw) - px) * sx) / page_w * 1000.0
+
+        def page_y(y):
+            return (top + (min(max(y, py), py + ph) - py) * sy) / page_h * 1000.0
+
+        return [round(page_y(y0)), round(page_x(x0)), round(page_y(y1)), round(page_x(x1))]
+
+    def remap_boxes(self, features):
+        """Rewrites every valid 'box_2d' in place from mosaic to page coordinates."""
+        for item in features:
+            box = item.get("box_2d")
+            if isinstance(box, (list, tuple)) and len(box) == 4:
+                try:
+                    item["box_2d"] = self.to_page_box(box)
+                except (TypeError, ValueError):
+                    item.pop("box_2d")
+        return features
+
+def pack(sizes, gap=MOSAIC_GAP):
+    """
+    Shelf packing: tallest first, left to right, into rows about as wide as a square of the
+    same area. Returns the (x, y) of every size, in input order, and the canvas size.
+    """
+    total = sum((w + gap) * (h + gap) for w, h in sizes)
+    row_width = max(max(w for w, _ in sizes), int(math.sqrt(total) * 1.2))
+    positions = [None] * len(sizes)
+    x = y = shelf = canvas_w = 0
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[index]
+        if x and x + w > row_width:
+            y += shelf + gap
+            x = shelf = 0
+        positions[index] = (x, y)
+        canvas_w = max(canvas_w, x + w)
+        x += w + gap
+        shelf = max(shelf, h)
+    return positions, (canvas_w, y + shelf)
+
+def build_mosaic(image, long_edge=None):
+    """
+    Mosaic of a page's annotated regions, or None when the page should be sent whole (no text
+    found, or the regions cover more than ROI_MAX_COVERAGE of it).
+    """
+    started = time.perf_counter()
+    gray = image_preprocess.to_grayscale(image)
+    regions, details = find_regions(gray)
+    coverage = sum((r - l) * (b - t) for l, t, r, b in regions) / float(gray.width * gray.height) if regions else None
+    if not regions or coverage > ROI_MAX_COVERAGE:
+        logger.debug(f"🔍 Sending the whole page (coverage {coverage})", extra={"coverage": coverage, **details})
+        return None
+    mosaic = region_mosaic(gray, regions, long_edge)
+    mosaic.stats.update({"coverage": round(coverage, 3), "seconds": round(time.perf_counter() - started, 3), **details})
+    return mosaic
+
+def region_mosaic(gray, regions, long_edge=None):
+    """
+    Packs (left, top, right, bottom) regions of a greyscale page into a Mosaic. Regions are scaled
+    like the whole page would be by preprocessing, so the text stays as legible and only the rest is saved.
+    """
+    scale = min(1.0, (long_edge or image_preprocess.PREPROCESS_LONG_EDGE) / max(gray.size))
+    sizes = [(max(1, round((r - l) * scale)), max(1, round((b - t) * scale))) for l, t, r, b in regions]
+    positions, canvas_size = pack(sizes)
+    mosaic = Image.new("L", canvas_size, 255)
+    placements = []
+    for region, (x, y), (w, h) in zip(regions, positions, sizes):
+        crop = gray.crop(region)
+        mosaic.paste(crop if crop.size == (w, h) else crop.resize((w, h), Image.LANCZOS), (x, y))
+        placements.append((region, (x, y, w, h)))
+
+    page_tokens = image_preprocess.estimate_tokens(max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+    stats = {
+        "regions": len(regions),
+        "mosaic": list(canvas_size),
+        "page_tokens": page_tokens,
+        "mosaic_tokens": image_preprocess.estimate_tokens(*canvas_size),
+    }
+    return Mosaic(mosaic, placements, gray.size, stats)
+
+def annotated_regions(image):
+    """Regions for skipping empty tiles of a large sheet, None if the whole sheet should be covered."""
+    regions, _ = find_regions(image_preprocess.to_grayscale(image))
+    return regions or None
+
+if __name__ == "__main__":
+    # python roi_detect.py drawing.png [mosaic.png]: the regions found and the tokens saved
+    logging.basicConfig(level=logging.DEBUG)
+    with Image.open(sys.argv[1]) as page:
+        result = build_mosaic(page)
+    if result is None:
+        print("No mosaic: the page would be sent whole.")
+    else:
+        print(result.stats)
+        for region, rect in result.placements:
+            print(f"  page {region} -> mosaic {rect}")
+        if len(sys.argv) > 2:
+            result.image.save(sys.argv[2])
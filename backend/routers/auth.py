@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import List
 from datetime import timedelta
-import models, schemas, auth, email_utils, database
+import models, schemas, auth, database
 from sqlalchemy.exc import IntegrityError
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/auth",
     tags=["authentication"]
@@ -15,12 +19,12 @@ router = APIRouter(
 @router.post("/register", response_model=schemas.UserResponse)
 async def register(user: schemas.UserCreate, request: Request, db: Session = Depends(database.get_db)):
     # 1. Check if user exists
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_user = await run_in_threadpool(db.query(models.User).filter(models.User.email == user.email).first)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
     # 2. Create User (Unapproved)
-    hashed_password = auth.get_password_hash(user.password)
+    hashed_password = await auth.get_password_hash_async(user.password)
     new_user = models.User(
         email=user.email,
         hashed_password=hashed_password,
@@ -41,9 +45,11 @@ async def register(user: schemas.UserCreate, request: Request, db: Session = Dep
     approval_link = f"{base_url}/auth/approve?email={new_user.email}&secret={os.environ.get('SECRET_KEY')}"
     
     try:
+        # fastapi_mail takes a quarter second to import; only registrations need it
+        import email_utils
         await email_utils.send_approval_request(new_user.email, approval_link)
     except Exception as e:
-        print(f"FAILED TO SEND EMAIL: {e}")
+        logger.error(f"FAILED TO SEND EMAIL: {e}")
         # We do NOT raise an HTTP exception here, because the user is already created.
         # We just log it. The user will see "Application Received" but admin won't get email.
         # In a real app, we might want to return a warning.
@@ -52,10 +58,10 @@ async def register(user: schemas.UserCreate, request: Request, db: Session = Dep
 
 @router.post("/login", response_model=schemas.Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
+    user = await run_in_threadpool(db.query(models.User).filter(models.User.email == form_data.username).first)
     
-    # Check User & Password
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    # Check User & Password (bcrypt runs in the auth hash pool, off the event loop)
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -88,5 +94,10 @@ async def approve_user(email: str, secret: str, db: Session = Depends(database.g
         
     user.is_approved = True
     db.commit()
+    auth.token_cache.invalidate(email)
     
     return {"message": f"User {email} has been approved. They can now log in."}
+
+@router.get("/me")
+async def read_current_user(user: auth.CurrentUser = Depends(auth.require_user)):
+    return {"id": user.id, "email": user.email, "is_approved": user.is_approved}
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Optional
+import auth, batch_pipeline
+
+router = APIRouter(
+    prefix="/batch",
+    tags=["batch"],
+    dependencies=[Depends(auth.get_current_user)]
+)
+
+@router.post("", status_code=202)
+async def create_batch(files: List[UploadFile] = File(...), user: Optional[auth.CurrentUser] = Depends(auth.get_current_user)):
+    """Accepts any number of drawings and/or ZIP archives of drawings. Returns immediately with a batch id."""
+    uploads = [(file.file, file.filename or "upload", file.content_type) for file in files]
+    try:
+        # Spooling is blocking, keep it off the event loop
+        batch = await run_in_threadpool(batch_pipeline.create_batch, uploads, user.id if user else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="No drawings found in the upload.")
+
+    await batch_pipeline.submit(batch)
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": len(batch.items),
+        "counts": batch.counts(),
+    }
+
+@router.get("/{batch_id}")
+def get_batch(batch_id: str, include_results: bool = False, user: Optional[auth.CurrentUser] = Depends(auth.get_current_user)):
+    batch = batch_pipeline.get_batch(batch_id, user.id if user else None)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.to_dict(include_results)
+
+@router.get("/{batch_id}/files/{index}")
+def get_batch_file(batch_id: str, index: int, user: Optional[auth.CurrentUser] = Depends(auth.get_current_user)):
+    batch = batch_pipeline.get_batch(batch_id, user.id if user else None)
+    if not batch or not 0 <= index < len(batch.items):
+        raise HTTPException(status_code=404, detail="File not found")
+    item = batch.items[index]
+    data = item.to_dict(include_results=True)
+    data["pages_timing"] = (item.document or {}).get("pages")
+    return data
@@ -0,0 +1,143 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Optional
+import auth, batch_pipeline, database, exporter, metrics, models
+
+router = APIRouter(
+    prefix="/export",
+    tags=["export"],
+    dependencies=[Depends(auth.require_user)]
+)
+
+# Every export is streamed in feature id order. `after` (the id of the last feature received) resumes
+# a broken download, `until` pins it to the features that existed when it started (X-Export-Until).
+FORMAT = Query("csv", pattern="^(csv|xlsx|ndjson)$")
+BATCH_POLL_SECONDS = 0.5
+
+def _response(chunks, format, name, after, until=None):
+    writer = exporter.WRITERS[format](header=after is None)
+
+    async def body():
+        yield writer.start()
+        rows = 0
+        async for records in chunks:
+            rows += len(records)
+            yield writer.write(records)
+        yield writer.finish()
+        metrics.EXPORT_ROWS.inc(rows, format=format)
+
+    headers = {"Content-Disposition": f'attachment; filename="{name}.{writer.extension}"'}
+    if until is not None:
+        headers["X-Export-Until"] = str(until)
+    return StreamingResponse(body(), media_type=writer.media_type, headers=headers)
+
+async def _chunks(query, after, until):
+    while True:
+        records = await run_in_threadpool(exporter.fetch, query, after, until)
+        if not records:
+            return
+        yield records
+        after = records[-1]["id"]
+
+async def _snapshot(query, format):
+    count, until = await run_in_threadpool(exporter.snapshot, query)
+    if format == "xlsx" and count >= exporter.XlsxWriter.MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"{count} features do not fit on one sheet, export them as CSV")
+    return until
+
+@router.get("/runs/{run_id}")
+async def export_run(
+    run_id: int,
+    format: str = FORMAT,
+    after: Optional[int] = None,
+    db: Session = Depends(database.get_db),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """The features of one stored run (see /history)."""
+    run = db.get(models.ExtractionRun, run_id)
+    if not run or run.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    query = exporter.feature_query(user.id).where(models.Feature.run_id == run_id)
+    until = await _snapshot(query, format)
+    return _response(_chunks(query, after, until), format, f"run-{run_id}", after, until)
+
+@router.get("/features")
+async def export_features(
+    format: str = FORMAT,
+    type: Optional[str] = None,
+    subtype: Optional[str] = None,
+    drawing_id: Optional[int] = None,
+    part_number: Optional[str] = None,
+    after: Optional[int] = None,
+    until: Optional[int] = Query(None, description="X-Export-Until of the download being resumed"),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """The user's stored features with the filters of /history/features, oldest first."""
+    query = exporter.feature_query(user.id)
+    if type is not None:
+        query = query.where(models.Feature.type == type)
+    if subtype is not None:
+        query = query.where(models.Feature.subtype == subtype)
+    if drawing_id is not None:
+        query = query.where(models.Feature.drawing_id == drawing_id)
+    if part_number is not None:
+        query = query.where(models.Drawing.part_number == part_number)
+    if until is None:
+        until = await _snapshot(query, format)
+    return _response(_chunks(query, after, until), format, "features", after, until)
+
+@router.get("/batches/{batch_id}")
+async def export_batch(
+    batch_id: str,
+    format: str = FORMAT,
+    after: Optional[int] = None,
+    wait: bool = Query(True, description="Keep the download open and add files as they finish"),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """
+    The features of a batch, file by file in upload order. With wait, files still being extracted
+    are streamed as soon as they finish, so the download can start with the batch.
+    """
+    batch = batch_pipeline.get_batch(batch_id, user.id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if format == "xlsx" and sum(len((item.document or {}).get("results") or []) for item in batch.items) >= exporter.XlsxWriter.MAX_ROWS:
+        raise HTTPException(status_code=400, detail="The batch does not fit on one sheet, export it as CSV")
+
+    resume_run = None
+    if after is not None:
+        feature = await run_in_threadpool(_get_feature, after)
+        if feature is None or feature.run_id not in {item.run_id for item in batch.items}:
+            raise HTTPException(status_code=400, detail="Unknown feature id in after")
+        resume_run = feature.run_id
+
+    async def chunks():
+        skipping = resume_run is not None
+        for item in batch.items:
+            while wait and item.status in ("queued", "running"):
+                await asyncio.sleep(BATCH_POLL_SECONDS)
+            if item.run_id is None:
+                # Failed, skipped, still running without wait, or not stored (STORE_RESULTS=0)
+                continue
+            if skipping:
+                if item.run_id != resume_run:
+                    continue
+                skipping = False
+                start = after
+            else:
+                start = None
+            query = exporter.feature_query(user.id).where(models.Feature.run_id == item.run_id)
+            async for records in _chunks(query, start, None):
+                yield records
+
+    return _response(chunks(), format, f"batch-{batch_id}", after)
+
+def _get_feature(feature_id):
+    db = database.SessionLocal()
+    try:
+        return db.get(models.Feature, feature_id)
+    finally:
+        db.close()
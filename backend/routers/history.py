@@ -0,0 +1,150 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Optional
+import auth, database, models
+
+router = APIRouter(
+    prefix="/history",
+    tags=["history"],
+    dependencies=[Depends(auth.require_user)]
+)
+
+# Every query is scoped to the signed-in user: other users' drawings, runs and features are not found (404).
+# Keyset pagination: every list is ordered by id and `cursor` is the last id of the previous page,
+# so page 1000 costs the same index range scan as page 1 (no OFFSET).
+MAX_PAGE_SIZE = 500
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+def _drawing_to_dict(drawing):
+    return {
+        "id": drawing.id,
+        "content_hash": drawing.content_hash,
+        "filename": drawing.filename,
+        "part_number": drawing.part_number,
+        "user_id": drawing.user_id,
+        "mime_type": drawing.mime_type,
+        "size_bytes": drawing.size_bytes,
+        "page_count": drawing.page_count,
+        "created_at": _iso(drawing.created_at),
+    }
+
+def _run_to_dict(run):
+    return {
+        "id": run.id,
+        "drawing_id": run.drawing_id,
+        "user_id": run.user_id,
+        "engine": run.engine,
+        "source": run.source,
+        "cached": run.cached,
+        "feature_count": run.feature_count,
+        "failed_pages": run.failed_pages,
+        "seconds": run.seconds,
+        "created_at": _iso(run.created_at),
+    }
+
+def _feature_to_dict(feature):
+    return {**(feature.data or {}), "id": feature.id, "run_id": feature.run_id, "drawing_id": feature.drawing_id}
+
+def _page(db, query, column, cursor, limit, newest_first=True):
+    """Runs a keyset-paginated query. Returns (rows, next_cursor); next_cursor is None on the last page."""
+    if cursor is not None:
+        query = query.where(column < cursor if newest_first else column > cursor)
+    query = query.order_by(column.desc() if newest_first else column).limit(limit + 1)
+    rows = db.execute(query).scalars().all()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1].id
+    return rows, None
+
+def _own_drawing(db, drawing_id, user):
+    drawing = db.get(models.Drawing, drawing_id)
+    if not drawing or drawing.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Drawing not found")
+    return drawing
+
+def _own_run(db, run_id, user):
+    run = db.get(models.ExtractionRun, run_id)
+    if not run or run.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Run not found")
+    return run
+
+def _own_drawing_ids(user):
+    return select(models.Drawing.id).where(models.Drawing.user_id == user.id)
+
+@router.get("/drawings")
+def list_drawings(
+    part_number: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(database.get_db),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """The user's stored drawings, newest first."""
+    query = select(models.Drawing).where(models.Drawing.user_id == user.id)
+    if part_number is not None:
+        query = query.where(models.Drawing.part_number == part_number)
+    drawings, next_cursor = _page(db, query, models.Drawing.id, cursor, limit)
+    return {"drawings": [_drawing_to_dict(drawing) for drawing in drawings], "next_cursor": next_cursor}
+
+@router.get("/drawings/{drawing_id}")
+def get_drawing(
+    drawing_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(database.get_db),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """A drawing with its extraction runs, newest first."""
+    drawing = _own_drawing(db, drawing_id, user)
+    query = select(models.ExtractionRun).where(models.ExtractionRun.drawing_id == drawing_id)
+    runs, next_cursor = _page(db, query, models.ExtractionRun.id, cursor, limit)
+    return {**_drawing_to_dict(drawing), "runs": [_run_to_dict(run) for run in runs], "next_cursor": next_cursor}
+
+@router.get("/runs/{run_id}")
+def get_run(run_id: int, db: Session = Depends(database.get_db), user: auth.CurrentUser = Depends(auth.require_user)):
+    run = _own_run(db, run_id, user)
+    return {**_run_to_dict(run), "pages": run.pages}
+
+@router.get("/runs/{run_id}/features")
+def list_run_features(
+    run_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(200, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(database.get_db),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """The features of one run in extraction order."""
+    _own_run(db, run_id, user)
+    query = select(models.Feature).where(models.Feature.run_id == run_id)
+    features, next_cursor = _page(db, query, models.Feature.id, cursor, limit, newest_first=False)
+    return {"features": [_feature_to_dict(feature) for feature in features], "next_cursor": next_cursor}
+
+@router.get("/features")
+def search_features(
+    type: Optional[str] = None,
+    subtype: Optional[str] = None,
+    drawing_id: Optional[int] = None,
+    part_number: Optional[str] = None,
+    q: Optional[str] = Query(None, description="Substring of the original text (not indexed, combine with another filter on large databases)"),
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(database.get_db),
+    user: auth.CurrentUser = Depends(auth.require_user),
+):
+    """Features across all of the user's stored drawings, newest first."""
+    query = select(models.Feature).where(models.Feature.drawing_id.in_(_own_drawing_ids(user)))
+    if type is not None:
+        query = query.where(models.Feature.type == type)
+    if subtype is not None:
+        query = query.where(models.Feature.subtype == subtype)
+    if drawing_id is not None:
+        query = query.where(models.Feature.drawing_id == drawing_id)
+    if part_number is not None:
+        drawing_ids = _own_drawing_ids(user).where(models.Drawing.part_number == part_number)
+        query = query.where(models.Feature.drawing_id.in_(drawing_ids))
+    if q:
+        query = query.where(models.Feature.original_text.contains(q, autoescape=True))
+    features, next_cursor = _page(db, query, models.Feature.id, cursor, limit)
+    return {"features": [_feature_to_dict(feature) for feature in features], "next_cursor": next_cursor}
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Optional
+import auth, database, ingest, job_queue, models
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    dependencies=[Depends(auth.get_current_user)]
+)
+
+@router.post("", status_code=202)
+async def create_job(file: UploadFile = File(...), user: Optional[auth.CurrentUser] = Depends(auth.get_current_user)):
+    # The declared Content-Type is not trusted, the first bytes decide (like /upload/)
+    mime_type = ingest.sniff(await file.read(16))
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail="Invalid file type. Please upload a PDF or Image (JPEG/PNG/TIFF/WEBP).")
+    await file.seek(0)
+
+    # Spooling and the DB insert are blocking, keep them off the event loop
+    job_id = await run_in_threadpool(
+        job_queue.enqueue, file.file, file.filename or "", ingest.SUFFIXES[mime_type], user.id if user else None
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+@router.get("/{job_id}")
+def get_job(job_id: str, db: Session = Depends(database.get_db), user: Optional[auth.CurrentUser] = Depends(auth.get_current_user)):
+    job = db.get(models.ExtractionJob, job_id)
+    # Someone else's job is not found; anonymous jobs are only visible without a token
+    if not job or job.user_id != (user.id if user else None):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    response = job_queue.job_to_dict(job)
+    if job.status == "queued":
+        response["queue_depth"] = job_queue.queue_depth(db)
+    return response
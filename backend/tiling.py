@@ -0,0 +1,174 @@
+import difflib
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import image_preprocess
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+TILING_MODE = os.environ.get("TILING_MODE", "auto") # off | auto | on
+TILE_TRIGGER_PX = int(os.environ.get("TILE_TRIGGER_PX", 4000)) # auto: tile pages whose long edge exceeds this
+TILE_SIZE_PX = int(os.environ.get("TILE_SIZE_PX", 2048))
+TILE_OVERLAP_PX = int(os.environ.get("TILE_OVERLAP_PX", 256)) # Must exceed the largest annotation
+TILE_CONCURRENCY = int(os.environ.get("TILE_CONCURRENCY", 4))
+DEDUP_OVERLAP = float(os.environ.get("DEDUP_OVERLAP", 0.5))
+DEDUP_TEXT_SIMILARITY = float(os.environ.get("DEDUP_TEXT_SIMILARITY", 0.8))
+
+def should_tile(width, height, mode=None):
+    mode = (mode or TILING_MODE).lower()
+    if mode == "on":
+        return max(width, height) > TILE_SIZE_PX
+    if mode == "auto":
+        return max(width, height) > TILE_TRIGGER_PX
+    return False
+
+def _axis_starts(length, tile, overlap):
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile) # Last tile flush with the edge
+    return starts
+
+def tile_boxes(width, height, tile_size=None, overlap=None):
+    """Overlapping (left, top, right, bottom) pixel boxes covering the whole page."""
+    tile_size = tile_size or TILE_SIZE_PX
+    overlap = TILE_OVERLAP_PX if overlap is None else overlap
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in _axis_starts(height, tile_size, overlap)
+        for x in _axis_starts(width, tile_size, overlap)
+    ]
+
+def tile_to_page_box(box_2d, tile, page_size):
+    """[ymin, xmin, ymax, xmax] 0-1000 relative to a tile -> 0-1000 relative to the page."""
+    left, top, right, bottom = tile
+    page_w, page_h = page_size
+    ymin, xmin, ymax, xmax = [float(v) for v in box_2d]
+    tile_w, tile_h = right - left, bottom - top
+    return [
+        round((top + ymin / 1000.0 * tile_h) / page_h * 1000),
+        round((left + xmin / 1000.0 * tile_w) / page_w * 1000),
+        round((top + ymax / 1000.0 * tile_h) / page_h * 1000),
+        round((left + xmax / 1000.0 * tile_w) / page_w * 1000),
+    ]
+
+def box_overlap(a, b):
+    """
+    max(IoU, intersection / smaller area). The second term catches a feature that was
+    cut at a tile edge: its partial box sits inside the complete one with a low IoU.
+    """
+    ymin, xmin = max(a[0], b[0]), max(a[1], b[1])
+    ymax, xmax = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ymax - ymin) * max(0.0, xmax - xmin)
+    if inter <= 0:
+        return 0.0
+    area_a = max(0.0, a[2] - a[0]) * max(0.0, a[3] - a[1])
+    area_b = max(0.0, b[2] - b[0]) * max(0.0, b[3] - b[1])
+    union = area_a + area_b - inter
+    iou = inter / union if union else 0.0
+    containment = inter / min(area_a, area_b) if min(area_a, area_b) else 0.0
+    return max(iou, containment)
+
+def _feature_text(item):
+    text = item.get("original_text") or f"{item.get('value', '')} {item.get('tolerance', '')}"
+    return re.sub(r"\s+", "", str(text)).replace(",", ".").lower()
+
+def text_similarity(a, b):
+    ta, tb = _feature_text(a), _feature_text(b)
+    if not ta or not tb:
+        return 0.0
+    if ta in tb or tb in ta:
+        # A truncated read of the same annotation
+        return 1.0
+    return difflib.SequenceMatcher(None, ta, tb).ratio()
+
+def _has_box(item):
+    box = item.get("box_2d")
+    return isinstance(box, (list, tuple)) and len(box) == 4
+
+def dedupe_features(features):
+    """
+    Drops features reported twice from overlapping tiles.
+    Two features are duplicates when they share a type, their boxes overlap and their text matches.
+    The copy with the longer text is kept, since it was not cut by a tile edge, and its
+    box is widened to cover both reads.
+    """
+    ordered = sorted(features, key=lambda item: len(_feature_text(item)), reverse=True)
+    kept = []
+    for item in ordered:
+        duplicate = False
+        if _has_box(item):
+            for other in kept:
+                if other.get("type") != item.get("type") or not _has_box(other):
+                    continue
+                if (box_overlap(item["box_2d"], other["box_2d"]) >= DEDUP_OVERLAP
+                        and text_similarity(item, other) >= DEDUP_TEXT_SIMILARITY):
+                    a, b = other["box_2d"], item["box_2d"]
+                    other["box_2d"] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    duplicate = True
+                    break
+        if not duplicate:
+            kept.append(item)
+    # Back to reading order
+    kept.sort(key=lambda item: tuple(item["box_2d"][:2]) if _has_box(item) else (1001, 1001))
+    return kept
+
+def _extract_tile(image, tile, extract_fn):
+    started = time.perf_counter()
+    # Tiles are cut from the (already straight) page: no trimming or deskew, so offsets stay exact
+    prepared = image_preprocess.prepare_image(image.crop(tile), trim=False, deskew=False)
+    results, engine_id = extract_fn(prepared)
+    for item in results:
+        if _has_box(item):
+            try:
+                item["box_2d"] = tile_to_page_box(prepared.to_source_box(item["box_2d"]), tile, image.size)
+            except (TypeError, ValueError):
+                item.pop("box_2d")
+    stats = {
+        "tile": list(tile),
+        "features": len(results),
+        "encoded_bytes": len(prepared.data),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if not engine_id:
+        stats["error"] = "No engine answered"
+    return results, engine_id, stats
+
+def _intersects(tile, region):
+    return tile[0] < region[2] and region[0] < tile[2] and tile[1] < region[3] and region[1] < tile[3]
+
+def extract_tiled(image, extract_fn, regions=None):
+    """
+    Splits a large page into overlapping tiles, extracts them concurrently with
+    extract_fn(prepared_image) -> (results, engine_id), maps every box_2d back to
+    page coordinates and merges the overlap zones.
+    With regions (annotated (left, top, right, bottom) boxes from roi_detect), tiles that
+    touch none of them are not sent.
+    Returns (results, engine_id, per-tile stats). engine_id is None when any tile failed: the
+    page is then incomplete and must not be cached or remembered as a revision.
+    """
+    image.load() # Decode once; tiles are cropped from several threads
+    tiles = tile_boxes(*image.size)
+    if regions:
+        annotated = [tile for tile in tiles if any(_intersects(tile, region) for region in regions)]
+        if annotated and len(annotated) < len(tiles):
+            logger.info(f"🔍 Skipping {len(tiles) - len(annotated)} of {len(tiles)} tiles without annotations.")
+            tiles = annotated
+    workers = max(1, min(TILE_CONCURRENCY, len(tiles)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as pool:
+        outcomes = list(pool.map(lambda tile: _extract_tile(image, tile, extract_fn), tiles))
+
+    merged = [item for results, _, _ in outcomes for item in results]
+    engine_ids = [engine_id for _, engine_id, _ in outcomes]
+    results = dedupe_features(merged)
+    logger.info(f"🧩 {len(tiles)} tiles: {len(merged)} raw features, {len(results)} after de-duplication.")
+    failed = sum(1 for engine_id in engine_ids if not engine_id)
+    if failed:
+        logger.warning(f"⚠️ {failed} of {len(tiles)} tiles failed, the page is incomplete.")
+        return results, None, [stats for _, _, stats in outcomes]
+    return results, engine_ids[0], [stats for _, _, stats in outcomes]
@@ -0,0 +1,297 @@
+import json
+import re
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError: # Optional, only makes large responses faster to serialize
+    orjson = None
+
+# Parses the free-text 'value' / 'tolerance' strings returned by the engines into typed numbers:
+#   "Ø10" + "H7 (+0,015)"  ->  nominal 10.0, upper +0.015, lower 0.0, unit mm, modifiers [diameter]
+# Strings are matched with precompiled regexes (memoized, drawings repeat the same callouts),
+# then the deviations / limits of all features are resolved together with NumPy.
+
+MODIFIERS = ["diameter", "radius", "spherical", "square", "thread", "chamfer", "angle",
+             "reference", "basic", "max", "min"]
+_FLAG = {name: 1 << i for i, name in enumerate(MODIFIERS)}
+
+_NUMBER = r"\d+(?:[.,]\d+)?|[.,]\d+"
+_NUMBER_RE = re.compile(_NUMBER)
+_SIGNED_RE = re.compile(rf"([+-]?)\s*({_NUMBER})")
+# "4x Ø6.6", "2X R5", "3 x 10", but not the chamfer "1x45°"
+_MULTIPLIER_RE = re.compile(r"^\s*(\d+)\s*[xX×]\s*(?=[ØⲪ⌀RrSsMm□(]|DIA|\d(?![\d.,]*\s*°))")
+_CHAMFER_RE = re.compile(rf"({_NUMBER})\s*(?:mm)?\s*[xX×]\s*({_NUMBER})\s*°")
+_THREAD_RE = re.compile(rf"\bM\s*({_NUMBER})(?:\s*[xX×]\s*({_NUMBER}))?")
+_PLUS_MINUS_RE = re.compile(rf"(?:±|\+/-|\+-)\s*({_NUMBER})")
+_ISO_RE = re.compile(r"(?<![A-Za-z])([A-Za-z]{1,2}(?:01|0|1[0-8]|[1-9]))(?![0-9.,])")
+_THREAD_CLASS_RE = re.compile(r"^\s*\d[A-Ha-h](?:\s*\d[A-Ha-h])?\s*$") # 6H, 6g, 5g6g (ISO 965, no ISO 286 deviations)
+_LIMITS_RE = re.compile(rf"^\s*({_NUMBER})\s*(?:/|-|–)\s*({_NUMBER})\s*$")
+
+_DIAMETER_RE = re.compile(r"[Ø⌀Ⲫ∅]|\bDIA\b|\bdia\b")
+_SPHERICAL_RE = re.compile(r"\bS[Ø⌀R]|\bSPHER", re.IGNORECASE)
+_RADIUS_RE = re.compile(r"(?:^|[\s(x×])C?R\s*\d|\bRAD\b|\bR\b")
+_BASIC_RE = re.compile(r"\b(?:BASIC|BSC|TED)\b", re.IGNORECASE)
+_MAX_RE = re.compile(r"\bMAX\b", re.IGNORECASE)
+_MIN_RE = re.compile(r"\bMIN\b", re.IGNORECASE)
+_INCH_RE = re.compile(r"\d\s*(?:\"|in\b|inch)", re.IGNORECASE)
+
+def _num(text):
+    """'12,5' -> 12.5 (comma decimal separator), '.5' -> 0.5."""
+    return float(text.replace(",", "."))
+
+def _clean(text):
+    # Unicode minus / dashes and spaces used inside numbers by some OCR outputs
+    return str(text or "").replace("−", "-").replace("–", "-").replace(" ", " ").replace(" ", " ").strip()
+
+class _Parsed:
+    __slots__ = ("nominal", "upper", "lower", "symmetric", "limit_high", "limit_low",
+                 "iso_code", "unit", "flags", "multiplier")
+
+    def __init__(self):
+        self.nominal = self.upper = self.lower = self.symmetric = np.nan
+        self.limit_high = self.limit_low = np.nan
+        self.iso_code = None
+        self.unit = "mm"
+        self.flags = 0
+        self.multiplier = 1
+
+def _parse_deviations(text, parsed):
+    """Explicit tolerances: ±t, +a/-b, a/-b, lower/upper limits, ISO code (kept for the NumPy stage)."""
+    if not text or _THREAD_CLASS_RE.match(text):
+        return
+    match = _PLUS_MINUS_RE.search(text)
+    if match:
+        parsed.symmetric = _num(match.group(1))
+        return
+
+    iso = _ISO_RE.search(text)
+    if iso:
+        from iso_fits import parse_code
+        if parse_code(iso.group(1)):
+            parsed.iso_code = iso.group(1)
+        # "H7 (+0,015/0)": the explicit values, if any, are read below
+        text = text[:iso.start()] + " " + text[iso.end():]
+
+    limits = _LIMITS_RE.match(text)
+    if limits:
+        first, second = _num(limits.group(1)), _num(limits.group(2))
+        if "-" not in text or first > second:
+            parsed.limit_high, parsed.limit_low = max(first, second), min(first, second)
+            return
+
+    values = []
+    for sign, number in _SIGNED_RE.findall(text):
+        value = _num(number)
+        values.append(-value if sign == "-" else value)
+    if len(values) >= 2:
+        parsed.upper, parsed.lower = max(values[:2]), min(values[:2])
+    elif len(values) == 1 and values[0] != 0:
+        # Unilateral: "+0.1" or "-0.05", the other deviation is zero
+        parsed.upper, parsed.lower = max(values[0], 0.0), min(values[0], 0.0)
+
+def _parse(value, tolerance, subtype):
+    parsed = _Parsed()
+    value, tolerance = _clean(value), _clean(tolerance)
+    text = f"{value} {tolerance}"
+
+    multiplier = _MULTIPLIER_RE.match(value)
+    if multiplier:
+        parsed.multiplier = int(multiplier.group(1))
+        value = value[multiplier.end():]
+
+    if value.startswith("(") and value.endswith(")"):
+        parsed.flags |= _FLAG["reference"]
+        value = value[1:-1]
+    if _SPHERICAL_RE.search(value):
+        parsed.flags |= _FLAG["spherical"]
+    if _DIAMETER_RE.search(value) or subtype == "Diameter":
+        parsed.flags |= _FLAG["diameter"]
+    if _RADIUS_RE.search(value) or subtype == "Radius":
+        parsed.flags |= _FLAG["radius"]
+    if "□" in value:
+        parsed.flags |= _FLAG["square"]
+    if _BASIC_RE.search(text) or subtype == "Basic":
+        parsed.flags |= _FLAG["basic"]
+    if _MAX_RE.search(text):
+        parsed.flags |= _FLAG["max"]
+    if _MIN_RE.search(text):
+        parsed.flags |= _FLAG["min"]
+    if _INCH_RE.search(value):
+        parsed.unit = "in"
+
+    remainder = value
+    chamfer = _CHAMFER_RE.search(value)
+    thread = _THREAD_RE.search(value)
+    if chamfer:
+        parsed.flags |= _FLAG["chamfer"]
+        parsed.nominal = _num(chamfer.group(1))
+        remainder = value[chamfer.end():]
+    elif thread:
+        parsed.flags |= _FLAG["thread"]
+        parsed.nominal = _num(thread.group(1))
+        remainder = value[thread.end():]
+    else:
+        number = _NUMBER_RE.search(value)
+        limits = _LIMITS_RE.match(value[number.start():]) if number and not tolerance else None
+        if limits:
+            # Limit dimension written as the value ("10.02/10.00"): the nominal becomes the mid value
+            first, second = _num(limits.group(1)), _num(limits.group(2))
+            parsed.limit_high, parsed.limit_low = max(first, second), min(first, second)
+            return parsed
+        if number:
+            parsed.nominal = _num(number.group())
+            remainder = value[number.end():]
+            if remainder.lstrip().startswith("°"):
+                parsed.flags |= _FLAG["angle"]
+                parsed.unit = "deg"
+                remainder = remainder.lstrip()[1:]
+
+    # The tolerance field wins; otherwise a tolerance written into the value ("50 ±0.1", "Ø10 H7")
+    _parse_deviations(tolerance if tolerance else remainder, parsed)
+    if tolerance and "°" in tolerance and parsed.unit == "mm" and not parsed.flags & _FLAG["chamfer"]:
+        parsed.unit = "deg"
+    return parsed
+
+_cache = {}
+_CACHE_LIMIT = 50000
+
+def _parse_cached(value, tolerance, subtype):
+    key = (str(value), str(tolerance), subtype)
+    parsed = _cache.get(key)
+    if parsed is None:
+        parsed = _parse(value, tolerance, subtype)
+        if len(_cache) < _CACHE_LIMIT:
+            _cache[key] = parsed
+    return parsed
+
+class NormalizedTable:
+    """Columnar, typed view of a list of features. Numeric columns are float64 arrays (NaN = unknown)."""
+
+    def __init__(self, features, nominal, upper, lower, unit, iso_code, flags, multiplier):
+        self.features = features
+        self.nominal = nominal
+        self.upper = upper
+        self.lower = lower
+        self.upper_limit = np.round(nominal + upper, 6)
+        self.lower_limit = np.round(nominal + lower, 6)
+        self.unit = unit
+        self.iso_code = iso_code
+        self.flags = flags
+        self.multiplier = multiplier
+
+    def __len__(self):
+        return len(self.features)
+
+    def modifiers(self, index):
+        flags = int(self.flags[index])
+        return [name for name in MODIFIERS if flags & _FLAG[name]]
+
+    def to_columns(self):
+        """JSON-ready column lists, one entry per feature (NaN -> None)."""
+        return {
+            "count": len(self),
+            "modifier_names": MODIFIERS,
+            "page": [item.get("page") for item in self.features],
+            "type": [item.get("type") for item in self.features],
+            "subtype": [item.get("subtype") for item in self.features],
+            "nominal": _column(self.nominal),
+            "upper": _column(self.upper),
+            "lower": _column(self.lower),
+            "upper_limit": _column(self.upper_limit),
+            "lower_limit": _column(self.lower_limit),
+            "unit": self.unit,
+            "iso_code": self.iso_code,
+            "modifiers": self.flags.tolist(), # Bit i set = modifier_names[i]
+            "multiplier": self.multiplier.tolist(),
+        }
+
+    def attach(self):
+        """Writes a 'normalized' dict onto every feature."""
+        columns = {name: _column(getattr(self, name))
+                   for name in ("nominal", "upper", "lower", "upper_limit", "lower_limit")}
+        for i, item in enumerate(self.features):
+            item["normalized"] = {
+                "nominal": columns["nominal"][i],
+                "upper": columns["upper"][i],
+                "lower": columns["lower"][i],
+                "upper_limit": columns["upper_limit"][i],
+                "lower_limit": columns["lower_limit"][i],
+                "unit": self.unit[i],
+                "iso_code": self.iso_code[i],
+                "modifiers": self.modifiers(i),
+                "multiplier": int(self.multiplier[i]),
+            }
+        return self.features
+
+def _column(values):
+    # + 0.0 turns -0.0 into 0.0
+    return [None if v != v else v for v in (np.round(values, 6) + 0.0).tolist()]
+
+def normalize(features):
+    """Parses every feature and resolves all deviations in one batch. Returns a NormalizedTable."""
+    rows = [_parse_cached(item.get("value", ""), item.get("tolerance", ""), item.get("subtype")) for item in features]
+    count = len(rows)
+
+    nominal = np.fromiter((row.nominal for row in rows), dtype=float, count=count)
+    upper = np.fromiter((row.upper for row in rows), dtype=float, count=count)
+    lower = np.fromiter((row.lower for row in rows), dtype=float, count=count)
+    symmetric = np.fromiter((row.symmetric for row in rows), dtype=float, count=count)
+    limit_high = np.fromiter((row.limit_high for row in rows), dtype=float, count=count)
+    limit_low = np.fromiter((row.limit_low for row in rows), dtype=float, count=count)
+    flags = np.fromiter((row.flags for row in rows), dtype=np.int64, count=count)
+    multiplier = np.fromiter((row.multiplier for row in rows), dtype=np.int64, count=count)
+    iso_code = [row.iso_code for row in rows]
+    unit = [row.unit for row in rows]
+
+    # ±t
+    has_symmetric = ~np.isnan(symmetric)
+    upper = np.where(has_symmetric, symmetric, upper)
+    lower = np.where(has_symmetric, -symmetric, lower)
+
+    # Limit dimensioning (10.02/10.00): deviations relative to the nominal, or the mid value if there is none
+    has_limits = ~np.isnan(limit_high)
+    nominal = np.where(has_limits & np.isnan(nominal), (limit_high + limit_low) / 2.0, nominal)
+    limit_is_nominal = has_limits & (limit_high < nominal / 2.0)
+    # "10 0.02/0.00" style is just two deviations
+    upper = np.where(has_limits & ~limit_is_nominal, limit_high - nominal, np.where(limit_is_nominal, limit_high, upper))
+    lower = np.where(has_limits & ~limit_is_nominal, limit_low - nominal, np.where(limit_is_nominal, limit_low, lower))
+
+    # ISO codes without explicit deviations, resolved by the vectorized ISO 286 lookup (mm only)
+    needs_iso = np.array([code is not None for code in iso_code], dtype=bool) & np.isnan(upper)
+    needs_iso &= np.array([u == "mm" for u in unit], dtype=bool)
+    if needs_iso.any():
+        from iso_fits import iso_deviations
+        index = np.flatnonzero(needs_iso)
+        iso_upper, iso_lower = iso_deviations(nominal[index].tolist(), [iso_code[i] for i in index])
+        upper[index] = iso_upper / 1000.0
+        lower[index] = iso_lower / 1000.0
+
+    # MAX / MIN callouts: one-sided limits
+    is_max = (flags & _FLAG["max"]).astype(bool) & np.isnan(upper)
+    is_min = (flags & _FLAG["min"]).astype(bool) & np.isnan(lower)
+    upper = np.where(is_max, 0.0, upper)
+    lower = np.where(is_min, 0.0, lower)
+
+    # Basic dimensions carry no tolerance of their own
+    is_basic = (flags & _FLAG["basic"]).astype(bool)
+    upper = np.where(is_basic, np.nan, upper)
+    lower = np.where(is_basic, np.nan, lower)
+
+    # Upper is always the larger deviation
+    both = ~np.isnan(upper) & ~np.isnan(lower)
+    upper, lower = np.where(both, np.maximum(upper, lower), upper), np.where(both, np.minimum(upper, lower), lower)
+    return NormalizedTable(features, nominal, upper, lower, unit, iso_code, flags, multiplier)
+
+def normalize_features(features):
+    """Adds a typed 'normalized' block to every feature (in place). Returns the features."""
+    if not features:
+        return features
+    return normalize(features).attach()
+
+def dumps(data):
+    """Fast JSON encoding (orjson when installed). Returns bytes."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,76 @@
+import importlib
+import logging
+import os
+import threading
+import time
+
+# --- CONFIGURATION ---
+WARMUP_PROBE = os.environ.get("WARMUP_PROBE", "1") == "1" # Tiny API call per engine to open its connection early
+WARMUP_PROBE_TIMEOUT = float(os.environ.get("WARMUP_PROBE_TIMEOUT", 15))
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_thread = None
+_state = {"status": "idle", "seconds": None, "steps": {}, "engines": [], "error": None}
+
+def _step(name, function):
+    started = time.perf_counter()
+    try:
+        result = function()
+        _state["steps"][name] = {"ok": True, "seconds": round(time.perf_counter() - started, 3)}
+        return result
+    except Exception as e:
+        logger.error(f"⚠️ Warm-up step {name} failed: {e}", extra={"step": name})
+        _state["steps"][name] = {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+        return None
+
+def _run():
+    started = time.perf_counter()
+    # The engine SDKs (openai, google.generativeai) take seconds to import, so they load here, not in main
+    modules = _step("imports", lambda: (importlib.import_module("extractor"), importlib.import_module("rasterizer")))
+    if modules is None:
+        _state["status"] = "failed"
+        _state["error"] = _state["steps"]["imports"]["error"]
+        return
+    extractor, rasterizer = modules
+
+    _step("engines", extractor.ensure_reader)
+    _state["engines"] = [client.engine_id for client in extractor._active_clients()]
+    if WARMUP_PROBE and _state["engines"]:
+        probes = _step("probe", lambda: extractor.probe_engines(WARMUP_PROBE_TIMEOUT)) or {}
+        _state["steps"]["probe"]["engines"] = probes
+    # Spawn the PDF render processes now rather than on the first upload
+    _step("render", rasterizer.warm_up)
+
+    _state["seconds"] = round(time.perf_counter() - started, 3)
+    if _state["engines"]:
+        _state["status"] = "ready"
+        logger.info(f"🔥 Warm-up done in {_state['seconds']}s.", extra={"seconds": _state["seconds"], "engines": _state["engines"]})
+    else:
+        _state["status"] = "failed"
+        _state["error"] = extractor.init_error or "No active extraction engine available"
+
+def start():
+    """
+    Runs engine construction, connection probes and the render pool start-up in a background
+    thread, so the server answers /healthz (and takes requests, which wait for the engines) right away.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _state["status"] = "warming"
+        _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        _thread.start()
+
+def wait(timeout=None):
+    if _thread is not None:
+        _thread.join(timeout)
+    return is_ready()
+
+def is_ready():
+    return _state["status"] == "ready"
+
+def status():
+    return {**_state, "steps": dict(_state["steps"]), "engines": list(_state["engines"])}
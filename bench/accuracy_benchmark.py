@@ -0,0 +1,382 @@
+"""
+Accuracy-vs-latency benchmark over a synthetic drawing corpus.
+
+Uploads every drawing of a corpus (generate_test_pdf.py --corpus, generated on the fly unless
+--corpus points at one) to the backend and scores the extracted features against the ground truth:
+precision, recall and F1, tolerance limits, box IoU and recall per tag, subtype, sheet and text size,
+next to latency percentiles and the image bytes and tokens each drawing cost. A performance change
+that saves time by losing features shows up here. Every run is appended to
+bench/results/accuracy_history.jsonl:
+
+    python bench/accuracy_benchmark.py --count 50 --format png
+    python bench/accuracy_benchmark.py --count 50 --set ROI_MODE=on --label "roi mosaics"
+    python bench/accuracy_benchmark.py --corpus corpus --engine env --label "qwen-vl-max"
+    python bench/accuracy_benchmark.py --compare 10
+
+With the default --engine standin the backend talks to the mock engine, which reads each drawing
+from the image it is sent (bench/corpus_reader.py): features that an optimization crops, merges
+away or shrinks below --min-text-px are missed, like a model would miss them. --engine env uses the
+engines configured in the environment (real API keys and their cost). PDF corpora need poppler on
+the backend, as in production; --format png does not.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from run_benchmark import (BACKEND, FAST_MODEL, ROOT, content_type, free_port, git_commit, stop, summarize,
+                           wait_until_ready)
+
+HISTORY = os.path.join(ROOT, "bench", "results", "accuracy_history.jsonl")
+METRIC_BYTES = "drawingscan_engine_image_bytes_sent_total"
+METRIC_TOKENS = "drawingscan_engine_tokens_total"
+_SAMPLE = re.compile(r"^(\w+)(?:\{[^}]*\})?\s+([0-9.eE+-]+|NaN)$")
+
+sys.path.insert(0, BACKEND)
+sys.path.insert(0, ROOT)
+import tolerance_normalizer # noqa: E402
+from generate_test_pdf import DPIS, SHEETS, generate_corpus # noqa: E402
+
+def load_corpus(args, workdir):
+    """Ground truths of the corpus, generated into the scratch directory unless --corpus is given."""
+    if args.corpus:
+        names = sorted(name for name in os.listdir(args.corpus) if name.startswith("drawing_") and name.endswith(".json"))
+        paths = [os.path.join(args.corpus, name) for name in names][:args.count or None]
+        if not paths:
+            raise SystemExit(f"No drawing_*.json in {args.corpus}, generate a corpus with generate_test_pdf.py --corpus")
+    else:
+        started = time.perf_counter()
+        paths = generate_corpus(os.path.join(workdir, "corpus"), args.count or 20, args.seed, args.format,
+                                args.sheets.split(","), [int(dpi) for dpi in args.dpi.split(",")])
+        print(f"🖨️  Generated {len(paths)} drawings in {time.perf_counter() - started:.1f}s")
+    truths = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            truth = json.load(f)
+        truth["path"] = os.path.abspath(path)
+        truth["drawing"] = os.path.join(os.path.dirname(truth["path"]), truth["file"])
+        truths.append(truth)
+    return truths
+
+def parse_settings(pairs):
+    settings = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise SystemExit(f"--set expects KEY=VALUE, got {pair!r}")
+        settings[key] = value
+    return settings
+
+def start_stack(args, workdir, settings):
+    """Backend (plus the mock engine for --engine standin) as subprocesses. Returns (backend url, mock url, processes)."""
+    processes, mock_url = [], None
+    env = dict(os.environ)
+    env.update({"CACHE_ENABLED": "0", "JOB_WORKERS": "0", "PYTHONUNBUFFERED": "1"})
+    if args.engine == "standin":
+        mock_port = free_port()
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.join(ROOT, "bench", "mock_engine.py"),
+            "--port", str(mock_port), "--latency", args.mock_latency, "--seed", "1",
+            "--min-text-px", str(args.min_text_px),
+            "--fast-model", FAST_MODEL, "--fast-latency", args.mock_fast_latency,
+            "--fast-misread-rate", str(args.mock_fast_misread_rate),
+        ]))
+        mock_url = f"http://127.0.0.1:{mock_port}"
+        env.update({
+            "QWEN_API_KEY": "mock",
+            "QWEN_BASE_URL": f"{mock_url}/v1",
+            "GEMINI_API_KEY": "",
+            "CASCADE_FAST_MODEL": FAST_MODEL if args.cascade else "",
+        })
+    env.update(settings)
+
+    api_port = free_port()
+    # Own working directory, so the benchmark's SQLite database never touches backend/app.db
+    processes.insert(0, subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND,
+         "--port", str(api_port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        # Own process group, so the rasterizer pool's workers go down with it
+        start_new_session=hasattr(os, "killpg"),
+    ))
+    api_url = f"http://127.0.0.1:{api_port}"
+    if mock_url:
+        wait_until_ready(f"{mock_url}/v1/models", processes[1])
+    wait_until_ready(f"{api_url}/readyz", processes[0], timeout=120, expect_ok=True)
+    return api_url, mock_url, processes
+
+def counters(client, url):
+    """Totals of the engine byte and token counters on /metrics, summed over engines."""
+    totals = {METRIC_BYTES: 0.0, METRIC_TOKENS: 0.0}
+    try:
+        response = client.get(f"{url}/metrics")
+    except httpx.HTTPError:
+        return totals
+    for line in response.text.splitlines():
+        match = _SAMPLE.match(line.strip())
+        if match and match.group(1) in totals:
+            totals[match.group(1)] += float(match.group(2))
+    return totals
+
+def extract(client, url, endpoint, path):
+    """(features, seconds) of one drawing; features is None when the upload failed."""
+    with open(path, "rb") as f:
+        files = {"file": (os.path.basename(path), f.read(), content_type(path))}
+    started = time.perf_counter()
+    if endpoint == "stream":
+        features = []
+        with client.stream("POST", f"{url}/upload/stream", files=files) as response:
+            if response.status_code != 200:
+                return None, time.perf_counter() - started
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["event"] == "feature":
+                    features.append(event["feature"])
+                elif event["event"] == "refined":
+                    # The large model's answer replaces the fast one of that page
+                    features = [item for item in features if item.get("page") != event["page"]] + event["features"]
+        return features, time.perf_counter() - started
+    response = client.post(f"{url}/upload/", files=files)
+    seconds = time.perf_counter() - started
+    if response.status_code != 200:
+        return None, seconds
+    return response.json().get("results", []), seconds
+
+def _iou(a, b):
+    try:
+        ay0, ax0, ay1, ax1 = [float(v) for v in a]
+        by0, bx0, by1, bx1 = [float(v) for v in b]
+    except (TypeError, ValueError):
+        return 0.0
+    ix, iy = max(0.0, min(ax1, bx1) - max(ax0, bx0)), max(0.0, min(ay1, by1) - max(ay0, by0))
+    union = (ax1 - ax0) * (ay1 - ay0) + (bx1 - bx0) * (by1 - by0) - ix * iy
+    return ix * iy / union if union > 0 else 0.0
+
+def _value_key(value):
+    return re.sub(r"\s+", "", str(value or "")).replace(",", ".").lower()
+
+def _same(a, b):
+    return a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b)) \
+        or (isinstance(a, float) and isinstance(b, float) and abs(a - b) < 1e-6)
+
+def score(truth, extracted, min_iou):
+    """
+    Matches extracted features to ground-truth ones: same type, same value (as text or as the
+    normalizer's nominal) and boxes overlapping by at least min_iou, best overlaps first.
+    Returns the per-feature outcome of the drawing.
+    """
+    expected = truth["features"]
+    if not expected and not extracted:
+        return {"expected": [], "extracted": 0, "matches": []}
+    table_truth = tolerance_normalizer.normalize([dict(item) for item in expected]) if expected else None
+    table_got = tolerance_normalizer.normalize([dict(item) for item in extracted]) if extracted else None
+    pairs = []
+    for i, want in enumerate(expected):
+        for j, got in enumerate(extracted):
+            if got.get("type") != want.get("type"):
+                continue
+            if _value_key(got.get("value")) != _value_key(want.get("value")) \
+                    and not (not math.isnan(table_truth.nominal[i]) and _same(table_truth.nominal[i], table_got.nominal[j])):
+                continue
+            iou = _iou(want.get("box_2d"), got.get("box_2d"))
+            if iou >= min_iou:
+                pairs.append((iou, i, j))
+    matched, used, matches = {}, set(), []
+    for iou, i, j in sorted(pairs, reverse=True):
+        if i in matched or j in used:
+            continue
+        matched[i] = j
+        used.add(j)
+        limits = _same(table_truth.upper[i], table_got.upper[j]) and _same(table_truth.lower[i], table_got.lower[j])
+        matches.append({"iou": iou, "limits": limits})
+    return {"expected": [(want, i in matched) for i, want in enumerate(expected)], "extracted": len(extracted), "matches": matches}
+
+def _ratio(part, whole):
+    return round(part / whole, 4) if whole else None
+
+def report(args, settings, truths, outcomes, samples, mock_stats):
+    expected = sum(len(outcome["expected"]) for outcome in outcomes)
+    extracted = sum(outcome["extracted"] for outcome in outcomes)
+    matches = [match for outcome in outcomes for match in outcome["matches"]]
+    precision, recall = _ratio(len(matches), extracted), _ratio(len(matches), expected)
+    f1 = round(2 * precision * recall / (precision + recall), 4) if precision and recall else 0.0
+
+    # Recall of the features grouped by what makes them hard
+    groups = defaultdict(lambda: [0, 0])
+    for truth, outcome in zip(truths, outcomes):
+        for feature, found in outcome["expected"]:
+            keys = [f"subtype:{feature.get('subtype')}", f"sheet:{truth.get('sheet')}", f"text_mm:{truth.get('text_size')}"]
+            keys += [f"tag:{tag}" for tag in feature.get("tags") or []]
+            for key in keys:
+                groups[key][0] += found
+                groups[key][1] += 1
+    ok = [sample for sample in samples if sample["ok"]]
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "config": {
+            "engine": args.engine,
+            "endpoint": args.endpoint,
+            "settings": settings,
+            "drawings": len(truths),
+            "corpus": args.corpus or f"generated:seed={args.seed}:format={args.format}",
+            "min_iou": args.iou,
+            "mock_latency": args.mock_latency if args.engine == "standin" else None,
+            "min_text_px": args.min_text_px if args.engine == "standin" else None,
+            "cascade": args.cascade,
+        },
+        "expected": expected,
+        "extracted": extracted,
+        "matched": len(matches),
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "limits_accuracy": _ratio(sum(match["limits"] for match in matches), len(matches)),
+        "mean_iou": round(sum(match["iou"] for match in matches) / len(matches), 4) if matches else None,
+        "recall_by": {key: {"recall": _ratio(found, total), "features": total} for key, (found, total) in sorted(groups.items())},
+        "failed": len(samples) - len(ok),
+        "latency": summarize([sample["seconds"] for sample in ok]),
+        "image_bytes": summarize([sample["bytes"] for sample in ok]),
+        "tokens": summarize([sample["tokens"] for sample in ok]),
+        "mock": mock_stats,
+    }
+
+def print_report(result):
+    latency, image_bytes, tokens = result["latency"] or {}, result["image_bytes"] or {}, result["tokens"] or {}
+    print(f"\n🎯 {result['config']['engine']} over {result['config']['drawings']} drawings "
+          f"{result['config']['settings'] or ''} (commit {result['commit']})")
+    print(f"   precision    {result['precision']}   recall {result['recall']}   F1 {result['f1']}   "
+          f"({result['matched']} of {result['expected']} found, {result['extracted']} extracted, {result['failed']} failed)")
+    print(f"   limits       {result['limits_accuracy']} of matched features with the right upper/lower limits   mean IoU {result['mean_iou']}")
+    print(f"   latency      p50 {latency.get('p50')}s   p95 {latency.get('p95')}s   p99 {latency.get('p99')}s")
+    print(f"   per drawing  {image_bytes.get('mean', 0) / 1024:.0f} KiB sent   {tokens.get('mean', 0):.0f} tokens")
+    weak = sorted((value["recall"], key, value["features"]) for key, value in result["recall_by"].items()
+                  if value["recall"] is not None and value["features"] >= 5)[:5]
+    if weak:
+        print("   lowest recall  " + "   ".join(f"{key} {recall:.2f} ({features})" for recall, key, features in weak))
+    read = (result.get("mock") or {}).get("read")
+    if read:
+        print(f"   stand-in     {read.get('images')} image(s): {read.get('seen')} features seen, {read.get('unseen')} not found, "
+              f"{read.get('illegible')} too small to read, {read.get('outside')} outside the image")
+
+def compare(count):
+    if not os.path.exists(HISTORY):
+        print("No accuracy history yet.")
+        return
+    with open(HISTORY, encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f if line.strip()][-count:]
+    print(f"{'timestamp':<26}{'commit':<16}{'engine':<9}{'draw':>5}{'prec':>7}{'recall':>7}{'F1':>7}{'p50':>8}{'p95':>8}"
+          f"{'KiB':>8}{'tokens':>8}  label")
+    for run in runs:
+        latency, image_bytes, tokens = run.get("latency") or {}, run.get("image_bytes") or {}, run.get("tokens") or {}
+        print(f"{run['timestamp']:<26}{str(run['commit']):<16}{run['config']['engine']:<9}{run['config']['drawings']:>5}"
+              f"{run['precision'] or 0:>7.3f}{run['recall'] or 0:>7.3f}{run['f1'] or 0:>7.3f}"
+              f"{latency.get('p50') or 0:>8.2f}{latency.get('p95') or 0:>8.2f}"
+              f"{(image_bytes.get('mean') or 0) / 1024:>8.0f}{tokens.get('mean') or 0:>8.0f}  {run.get('label') or ''}")
+
+def run(args, url, mock_url, truths):
+    outcomes, samples, read = [], [], defaultdict(int)
+    # One drawing at a time: the mock engine reads one expected drawing, and the /metrics deltas belong to it
+    with httpx.Client(timeout=args.timeout) as client:
+        if mock_url:
+            client.post(f"{mock_url}/mock/expect", json={"ground_truth": None})
+        for truth in truths:
+            if mock_url:
+                client.post(f"{mock_url}/mock/expect", json={"ground_truth": truth["path"]}).raise_for_status()
+            before = counters(client, url)
+            try:
+                features, seconds = extract(client, url, args.endpoint, truth["drawing"])
+            except httpx.HTTPError as e:
+                print(f"   ⚠️ {truth['name']}: {e}")
+                features, seconds = None, None
+            after = counters(client, url)
+            if mock_url:
+                # The reader is replaced with every drawing, so its statistics are added up here
+                for key, value in (client.get(f"{mock_url}/mock/stats").json().get("read") or {}).items():
+                    read[key] += value
+            samples.append({
+                "ok": features is not None,
+                "seconds": seconds,
+                "bytes": after[METRIC_BYTES] - before[METRIC_BYTES],
+                "tokens": after[METRIC_TOKENS] - before[METRIC_TOKENS],
+            })
+            outcome = score(truth, features or [], args.iou)
+            outcomes.append(outcome)
+            if args.verbose:
+                print(f"   {truth['name']} {truth['sheet']} {truth['dpi']}dpi {truth['text_size']}mm: "
+                      f"{len(outcome['matches'])}/{len(truth['features'])} found, {outcome['extracted']} extracted"
+                      + (f", {seconds:.2f}s" if seconds is not None else ""))
+        mock_stats = None
+        if mock_url:
+            mock_stats = {**client.get(f"{mock_url}/mock/stats").json(), "read": dict(read)}
+    return outcomes, samples, mock_stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Corpus directory (default: generate --count drawings for this run)")
+    parser.add_argument("--count", type=int, default=None, help="Drawings to run (default: 20 generated, or all of --corpus)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--format", choices=["pdf", "png", "mixed"], default="pdf", help="Format of generated drawings")
+    parser.add_argument("--sheets", default=",".join(SHEETS), help="Sheet sizes of generated drawings")
+    parser.add_argument("--dpi", default=",".join(str(dpi) for dpi in DPIS), help="Raster DPIs of generated drawings")
+    parser.add_argument("--engine", choices=["standin", "env"], default="standin",
+                        help="standin: mock engine reading the corpus; env: the engines configured in the environment")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Backend setting for this run, e.g. ROI_MODE=on or PREPROCESS_LONG_EDGE=1536 (repeatable)")
+    parser.add_argument("--url", help="Benchmark a running backend instead of starting one")
+    parser.add_argument("--mock-url", help="Mock engine the running --url backend talks to, to have it read the corpus")
+    parser.add_argument("--endpoint", choices=["upload", "stream"], default="upload")
+    parser.add_argument("--iou", type=float, default=0.5, help="Box overlap a feature needs to count as found")
+    parser.add_argument("--min-text-px", type=float, default=6, help="Text height the stand-in engine can still read")
+    parser.add_argument("--mock-latency", default="lognormal:1.5:0.4")
+    parser.add_argument("--cascade", action="store_true", help="Answer with a fast mock model first (CASCADE_FAST_MODEL)")
+    parser.add_argument("--mock-fast-latency", default="lognormal:0.4:0.3", help="Latency model of the fast mock model")
+    parser.add_argument("--mock-fast-misread-rate", type=float, default=0.2, help="Share of fast answers with a misread feature")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument("--compare", type=int, metavar="N", help="Print the last N runs and exit")
+    parser.add_argument("--verbose", action="store_true", help="Show every drawing and the backend's log")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    settings = parse_settings(args.set)
+
+    processes = []
+    with tempfile.TemporaryDirectory(prefix="drawingscan_accuracy_") as workdir:
+        try:
+            truths = load_corpus(args, workdir)
+            if args.url:
+                url, mock_url = args.url.rstrip("/"), args.mock_url and args.mock_url.rstrip("/")
+            else:
+                url, mock_url, processes = start_stack(args, workdir, settings)
+            outcomes, samples, mock_stats = run(args, url, mock_url, truths)
+            result = report(args, settings, truths, outcomes, samples, mock_stats)
+        finally:
+            for process in processes:
+                stop(process)
+
+    print_report(result)
+    if not args.no_history:
+        os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+        with open(HISTORY, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"   appended to {os.path.relpath(HISTORY, ROOT)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Stand-in reader for the mock engine: answers like a vision model that reads a synthetic corpus drawing
+(generate_test_pdf.py --corpus) without mistakes, but only as far as the image it was sent shows it.
+
+The backend sends a trimmed and downscaled page, a tile of a large sheet, or a mosaic of the annotated
+regions (ROI_MODE=on). Every ground-truth feature is looked for in that image by normalised
+cross-correlation with its patch of the page, and answered with its box in the image's own 0-1000
+coordinates, the way a model would. Features cut off at a tile edge, left out of a mosaic, or whose
+text has become smaller than MIN_TEXT_PX are not seen, so an optimization that costs accuracy loses
+recall in bench/accuracy_benchmark.py.
+"""
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, ROOT)
+import roi_detect # noqa: E402 (connected components)
+from generate_test_pdf import rasterize # noqa: E402
+
+MIN_TEXT_PX = 6 # Features whose text is less tall than this in the sent image are unreadable
+MIN_MATCH = 0.6 # Correlation a feature's patch needs to count as seen
+SEARCH_PX = 512 # Long edge the sent image is searched at before matches are refined at full size
+SCALES = np.geomspace(0.08, 2.5, 24) # Sent image px per page px tried when the image is not a view of the page
+VIEW_MATCH = 0.5 # Correlation of a whole-page view with the page
+CROP_MATCH = 0.8 # Correlation of a tile with its place on the page (sparse mosaics reach about 0.55)
+
+def _ink(image):
+    return 1.0 - np.asarray(image.convert("L"), dtype=np.float32) / 255.0
+
+def _resize(array, factor):
+    h, w = array.shape
+    size = (max(1, round(w * factor)), max(1, round(h * factor)))
+    image = Image.fromarray(array, "F")
+    return np.asarray(image.resize(size, Image.BOX if factor < 1 else Image.BILINEAR), dtype=np.float32)
+
+def _bbox(ink, threshold=0.5):
+    rows, cols = np.nonzero(ink.max(axis=1) > threshold)[0], np.nonzero(ink.max(axis=0) > threshold)[0]
+    if not len(rows):
+        return None
+    return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+def _char_px(ink):
+    """Typical character height in px (median height of the small components), None without enough text."""
+    components = roi_detect.Components(ink > 0.5)
+    height, width = components.height, components.width
+    candidates = (height >= 4) & (height <= 0.04 * max(ink.shape)) & (width <= 3 * height)
+    if np.count_nonzero(candidates) < roi_detect.MIN_TEXT_COMPONENTS:
+        return None
+    return float(np.median(height[candidates]))
+
+class Search:
+    """
+    Normalised cross-correlation of templates with one image. The image's spectrum and running sums
+    are computed once, for templates up to max_template (h, w) in size.
+    """
+
+    def __init__(self, image, max_template=None):
+        self.image = image
+        h, w = image.shape
+        th, tw = max_template or image.shape
+        self.shape = (h + min(th, h), w + min(tw, w))
+        self.spectrum = np.fft.rfft2(image, self.shape)
+        padded = np.pad(image.astype(np.float64), ((1, 0), (1, 0)))
+        self.sums, self.squares = padded.cumsum(0).cumsum(1), (padded ** 2).cumsum(0).cumsum(1)
+
+    def __call__(self, template):
+        """Scores of template at every position where it fits in the image, None if it does not."""
+        th, tw = template.shape
+        h, w = self.image.shape
+        if th > h or tw > w or th < 2 or tw < 2 or h + th - 1 > self.shape[0] or w + tw - 1 > self.shape[1]:
+            return None
+        t = template - template.mean()
+        norm = math.sqrt(float((t * t).sum()))
+        if norm < 1e-6:
+            return None
+        corr = np.fft.irfft2(self.spectrum * np.fft.rfft2(t[::-1, ::-1], self.shape), self.shape)[th - 1:h, tw - 1:w]
+
+        def window(c):
+            return c[th:, tw:] - c[:-th, tw:] - c[th:, :-tw] + c[:-th, :-tw]
+
+        n = th * tw
+        s1 = window(self.sums)
+        variance = np.maximum(window(self.squares) - s1 * s1 / n, n * 1e-3)
+        return corr / (np.sqrt(variance) * norm)
+
+def ncc(image, template):
+    return Search(image, template.shape)(template)
+
+def _peaks(scores, count, radius):
+    """(score, x, y) of the best `count` positions, at least radius apart."""
+    scores = scores.copy()
+    found = []
+    for _ in range(count):
+        index = int(np.argmax(scores))
+        y, x = divmod(index, scores.shape[1])
+        found.append((float(scores[y, x]), x, y))
+        scores[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = -1
+    return found
+
+def _overlap(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+    return ix * iy / smaller if smaller > 0 else 0.0
+
+def _area(feature):
+    x0, y0, x1, y1 = feature["box"]
+    return (x1 - x0) * (y1 - y0)
+
+class CorpusReader:
+    def __init__(self, ground_truth_path, min_text_px=MIN_TEXT_PX):
+        with open(ground_truth_path, encoding="utf-8") as f:
+            self.truth = json.load(f)
+        self.min_text_px = min_text_px
+        self.page = _ink(rasterize(self.truth))
+        height, width = self.page.shape
+        self.page_bbox = _bbox(self.page)
+        self.page_factor = min(1.0, 1024 / max(width, height))
+        self.page_small = _resize(self.page, self.page_factor)
+        self.page_char = _char_px(self.page)
+        self.features = []
+        for feature in self.truth["features"]:
+            ymin, xmin, ymax, xmax = feature["box_2d"]
+            box = (xmin * width / 1000, ymin * height / 1000, xmax * width / 1000, ymax * height / 1000)
+            # The patch takes in some of the surroundings (dimension lines, arrows), which tells repeated values apart
+            margin = 0.3 * min(box[2] - box[0], box[3] - box[1])
+            patch = (max(0, int(box[0] - margin)), max(0, int(box[1] - margin)),
+                     min(width, math.ceil(box[2] + margin)), min(height, math.ceil(box[3] + margin)))
+            answer = {key: value for key, value in feature.items() if key not in ("box_2d", "tags")}
+            self.features.append({"answer": answer, "box": box, "patch": patch,
+                                  "text_px": min(box[2] - box[0], box[3] - box[1])})
+        self.page_search = Search(self.page_small)
+        self.stats = {"images": 0, "views": 0, "crops": 0, "pieces": 0, "seen": 0, "unseen": 0, "illegible": 0, "outside": 0}
+        self._last = (None, None)
+
+    def read(self, data):
+        """Ground-truth features visible in the encoded image `data`, with box_2d in its coordinates."""
+        digest = hashlib.sha256(data).hexdigest()
+        if self._last[0] == digest:
+            # Continuations of a cut-off answer send the same image again
+            return [dict(feature) for feature in self._last[1]]
+        with Image.open(io.BytesIO(data)) as image:
+            sent = _ink(image)
+        self.stats["images"] += 1
+        view, crop = self._view(sent), None
+        if view is None:
+            crop = self._crop(sent)
+        search, slack = None, 0
+        if view is not None or crop is not None:
+            self.stats["views" if view is not None else "crops"] += 1
+            scale, offset, slack = view or crop
+        else:
+            self.stats["pieces"] += 1
+            scale, offset = self._scale(sent), None
+            factor = min(1.0, SEARCH_PX / max(sent.shape))
+            largest = max(self.features, key=_area, default=None)
+            if largest is not None:
+                box = largest["box"]
+                size = (math.ceil((box[3] - box[1]) * scale * factor) + 2, math.ceil((box[2] - box[0]) * scale * factor) + 2)
+                search = (Search(_resize(sent, factor), size), factor)
+
+        # Every place a feature matches, then the best matches first: where near-identical callouts
+        # ("116.4 ±0.5", "118.4 ±0.5") compete for one place, the exact one gets it
+        options, legible = [], 0
+        for index, feature in enumerate(self.features):
+            found = self._locate(sent, feature, scale, offset, search, slack)
+            if found is None:
+                self.stats["outside"] += 1
+            elif feature["text_px"] * scale < self.min_text_px:
+                self.stats["illegible"] += 1
+            else:
+                legible += 1
+                options += [(score, index, box) for score, box in found]
+        chosen = {}
+        for score, index, box in sorted(options, key=lambda option: -option[0]):
+            if index not in chosen and all(_overlap(box, other) < 0.5 for other in chosen.values()):
+                chosen[index] = box
+        self.stats["seen"] += len(chosen)
+        self.stats["unseen"] += legible - len(chosen)
+
+        height, width = sent.shape
+        answers = []
+        for index in sorted(chosen):
+            x0, y0, x1, y1 = chosen[index]
+            answers.append({**self.features[index]["answer"], "box_2d": [round(y0 / height * 1000), round(x0 / width * 1000),
+                                                                         round(y1 / height * 1000), round(x1 / width * 1000)]})
+        self._last = (digest, answers)
+        return [dict(feature) for feature in answers]
+
+    def _view(self, sent):
+        """(scale, (dx, dy), 0) when the image shows the whole page (trimmed and/or downscaled), else None."""
+        box = _bbox(sent)
+        if box is None or self.page_bbox is None:
+            return None
+        px0, py0, px1, py1 = self.page_bbox
+        sx, sy = (box[2] - box[0]) / (px1 - px0), (box[3] - box[1]) / (py1 - py0)
+        if abs(sx / sy - 1) > 0.03:
+            return None
+        scale = (sx + sy) / 2
+        offset = (box[0] - px0 * scale, box[1] - py0 * scale)
+        # Compare with the page mapped onto the image, both small
+        factor = min(1.0, SEARCH_PX / max(sent.shape))
+        small = _resize(sent, factor)
+        ratio = self.page_factor / (factor * scale)
+        warped = Image.fromarray(self.page_small, "F").transform(
+            (small.shape[1], small.shape[0]), Image.AFFINE,
+            (ratio, 0, -offset[0] * self.page_factor / scale, 0, ratio, -offset[1] * self.page_factor / scale),
+            Image.BILINEAR)
+        warped = np.asarray(warped, dtype=np.float32)
+        if warped.std() < 1e-6 or small.std() < 1e-6:
+            return None
+        if np.corrcoef(small.ravel(), warped.ravel())[0, 1] < VIEW_MATCH:
+            return None
+        return scale, offset, 0
+
+    def _crop(self, sent):
+        """
+        (scale, (dx, dy), slack) when the image is a cut-out of the page (a tile), else None. The image is
+        found on the small page, which places it to within `slack` px.
+        """
+        char = _char_px(sent)
+        scales = {1.0}
+        if char is not None and self.page_char is not None:
+            scales.add(round(char / self.page_char, 3))
+        best = None
+        for scale in sorted(scales):
+            factor = self.page_factor / scale
+            template = _resize(sent, factor)
+            if template.shape[0] > self.page_small.shape[0] or template.shape[1] > self.page_small.shape[1]:
+                continue
+            scores = self.page_search(template)
+            if scores is None:
+                continue
+            y, x = divmod(int(np.argmax(scores)), scores.shape[1])
+            if scores[y, x] >= CROP_MATCH and (best is None or scores[y, x] > best[0]):
+                best = (float(scores[y, x]), scale, x, y)
+        if best is None:
+            return None
+        _, scale, x, y = best
+        return scale, (-x / self.page_factor * scale, -y / self.page_factor * scale), math.ceil(2 * scale / self.page_factor)
+
+    def _template(self, feature, scale, tight=False):
+        # Mosaics hold tight crops of the annotations, without the lines around them
+        x0, y0, x1, y1 = [int(v) for v in feature["box"]] if tight else feature["patch"]
+        return _resize(self.page[y0:y1 + 1, x0:x1 + 1] if tight else self.page[y0:y1, x0:x1], scale)
+
+    def _scale(self, sent):
+        """
+        Scale of a tile or mosaic: estimated from the character height (sent image vs page), then
+        narrowed down to the one at which the largest features match best.
+        """
+        char = _char_px(sent)
+        if char is None or self.page_char is None:
+            scales = SCALES
+        else:
+            # The mix of text sizes differs between a mosaic and its page, so the estimate is rough
+            scales = char / self.page_char * np.geomspace(0.7, 1.45, 13)
+        factor = min(1.0, SEARCH_PX / max(sent.shape))
+        largest = sorted(self.features, key=_area, reverse=True)[:5]
+        if not largest:
+            return float(scales[len(scales) // 2])
+        box = largest[0]["box"]
+        size = (math.ceil((box[3] - box[1]) * scales[-1] * 1.2 * factor) + 2, math.ceil((box[2] - box[0]) * scales[-1] * 1.2 * factor) + 2)
+        search = Search(_resize(sent, factor), size)
+        best = self._best_scale(search, factor, largest, scales)
+        step = scales[1] / scales[0]
+        return self._best_scale(search, factor, largest, best * np.geomspace(1 / step, step, 7))
+
+    def _best_scale(self, search, factor, features, scales):
+        best, best_score = float(scales[len(scales) // 2]), -1.0
+        for scale in scales:
+            peaks = []
+            for feature in features:
+                template = self._template(feature, scale * factor, tight=True)
+                if min(template.shape) < 6:
+                    continue
+                scores = search(template)
+                if scores is not None:
+                    peaks.append(float(scores.max()))
+            if len(peaks) >= min(3, len(features)):
+                score = float(np.mean(sorted(peaks)[-3:]))
+                if score > best_score:
+                    best, best_score = float(scale), score
+        return best
+
+    def _locate(self, sent, feature, scale, offset, search, slack=0):
+        """
+        (score, (x0, y0, x1, y1)) of the places in the sent image where the feature can be seen,
+        None when the image is a view or tile that does not (fully) show it.
+        """
+        template = self._template(feature, scale, tight=offset is None)
+        th, tw = template.shape
+        if offset is not None:
+            x0, y0 = feature["patch"][0] * scale + offset[0], feature["patch"][1] * scale + offset[1]
+            candidates = [(round(x0), round(y0))]
+        else:
+            # Anywhere in the image: best few positions at search size, then refined
+            search, factor = search
+            scores = search(self._template(feature, scale * factor, tight=True))
+            if scores is None:
+                return []
+            radius = max(2, int(min(th, tw) * factor / 2))
+            candidates = [(round(x / factor), round(y / factor)) for score, x, y in _peaks(scores, 4, radius)
+                          if score >= MIN_MATCH * 0.7]
+        px0, py0 = feature["patch"][:2] if offset is not None else [int(v) for v in feature["box"][:2]]
+        bx0, by0, bx1, by1 = feature["box"]
+        found = []
+        for x, y in candidates:
+            # Refine at full size around the coarse position
+            pad = max(4, int(0.1 * max(th, tw)), slack)
+            if x + pad < 0 or y + pad < 0 or x + tw - pad > sent.shape[1] or y + th - pad > sent.shape[0]:
+                return None
+            left, top = max(0, x - pad), max(0, y - pad)
+            scores = ncc(sent[top:y + th + pad, left:x + tw + pad], template)
+            if scores is None:
+                continue
+            dy, dx = divmod(int(np.argmax(scores)), scores.shape[1])
+            if scores[dy, dx] >= MIN_MATCH:
+                x0, y0 = left + dx + (bx0 - px0) * scale, top + dy + (by0 - py0) * scale
+                found.append((float(scores[dy, dx]), (x0, y0, x0 + (bx1 - bx0) * scale, y0 + (by1 - by0) * scale)))
+        return found
@@ -0,0 +1,191 @@
+"""
+Login and token-verification benchmark.
+
+Starts the backend on a scratch database seeded with approved users, then fires concurrent
+POST /auth/login requests and reports logins/s and latency. While the logins run, GET / is
+polled to show how long the event loop is blocked (it should stay in the milliseconds,
+bcrypt runs in the AUTH_HASH_WORKERS pool). Afterwards GET /auth/me is hammered with the
+issued tokens to measure the cached bearer-token dependency:
+
+    python bench/login_benchmark.py --logins 200 --concurrency 16
+    python bench/login_benchmark.py --hash-workers 1 --label "single hash thread"
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from run_benchmark import BACKEND, ROOT, free_port, git_commit, stop, summarize, wait_until_ready
+
+HISTORY = os.path.join(ROOT, "bench", "results", "login_history.jsonl")
+PASSWORD = "bench-password"
+
+def seed_users(database_url, count):
+    """Approved users bench-0@example.com ... sharing one password hash (hashing is what's being measured)."""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, BACKEND)
+    import auth
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    hashed = auth.get_password_hash(PASSWORD)
+    db = SessionLocal()
+    try:
+        db.add_all([
+            models.User(email=f"bench-{i}@example.com", hashed_password=hashed, is_active=True, is_approved=True)
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+    engine.dispose()
+
+def start_backend(args, workdir, database_url):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": database_url,
+        "AUTH_HASH_WORKERS": str(args.hash_workers),
+        "GEMINI_API_KEY": "",
+        "QWEN_API_KEY": "",
+        "JOB_WORKERS": "0",
+        "RASTER_PROCESSES": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND, "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        start_new_session=hasattr(os, "killpg"),
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until_ready(f"{url}/", backend)
+    return url, backend
+
+async def probe_loop(client, url, stop_event, samples):
+    """GET / every 50 ms; its latency is the time the event loop was busy with something else."""
+    while not stop_event.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get(f"{url}/")
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+
+async def run_logins(args, url):
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        tokens, latencies, failures = [], [], 0
+
+        async def login(i):
+            nonlocal failures
+            form = {"username": f"bench-{i % args.users}@example.com", "password": PASSWORD}
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f"{url}/auth/login", data=form)
+                except httpx.HTTPError:
+                    failures += 1
+                    return
+                if response.status_code != 200:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+                tokens.append(response.json()["access_token"])
+
+        probes, stop_event = [], asyncio.Event()
+        probe = asyncio.create_task(probe_loop(client, url, stop_event, probes))
+        started = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(args.logins)))
+        wall = time.perf_counter() - started
+        stop_event.set()
+        await probe
+    return tokens, latencies, failures, wall, probes
+
+async def run_verified(args, url, tokens):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], 0
+
+        async def me(i):
+            nonlocal failures
+            headers = {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(f"{url}/auth/me", headers=headers)
+                if response.status_code != 200:
+                    failures += 1
+                    return
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(me(i) for i in range(args.verifications)))
+        wall = time.perf_counter() - started
+    return latencies, failures, wall
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--verifications", type=int, default=2000, help="Authenticated GET /auth/me requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--hash-workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's log")
+    args = parser.parse_args()
+
+    backend = None
+    with tempfile.TemporaryDirectory(prefix="drawingscan_login_bench_") as workdir:
+        database_url = f"sqlite:///{os.path.join(workdir, 'app.db')}"
+        try:
+            seed_users(database_url, args.users)
+            url, backend = start_backend(args, workdir, database_url)
+            tokens, login_latencies, login_failures, login_wall, probes = asyncio.run(run_logins(args, url))
+            if not tokens:
+                raise RuntimeError("No login succeeded")
+            me_latencies, me_failures, me_wall = asyncio.run(run_verified(args, url, tokens))
+        finally:
+            if backend is not None:
+                stop(backend)
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "config": {"logins": args.logins, "concurrency": args.concurrency, "hash_workers": args.hash_workers,
+                   "cpus": os.cpu_count()},
+        "logins_per_second": round(len(login_latencies) / login_wall, 2),
+        "login_failures": login_failures,
+        "login_latency": summarize(login_latencies),
+        "event_loop_probe": summarize(probes),
+        "verified_requests_per_second": round(len(me_latencies) / me_wall, 1),
+        "verified_failures": me_failures,
+        "verified_latency": summarize(me_latencies),
+    }
+
+    login, probe, verified = result["login_latency"] or {}, result["event_loop_probe"] or {}, result["verified_latency"] or {}
+    print(f"\n🔐 {args.logins} logins @ concurrency {args.concurrency}, {args.hash_workers} hash worker(s) (commit {result['commit']})")
+    print(f"   logins       {result['logins_per_second']}/s   p50 {login.get('p50')}s   p95 {login.get('p95')}s   failed {login_failures}")
+    print(f"   GET / probe  p50 {probe.get('p50')}s   max {probe.get('max')}s   (event loop stalls during logins)")
+    print(f"   /auth/me     {result['verified_requests_per_second']}/s   p50 {verified.get('p50')}s   p95 {verified.get('p95')}s   failed {me_failures}")
+    if not args.no_history:
+        os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+        with open(HISTORY, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"   appended to {os.path.relpath(HISTORY, ROOT)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Local stand-in for an OpenAI-compatible vision model (the protocol QwenProcessor talks).
+
+    python bench/mock_engine.py --port 9000 --latency lognormal:1.5:0.4 --error-rate 0.05
+
+Requests for --fast-model (the cascade's small model, CASCADE_FAST_MODEL) get --fast-latency and
+misread a feature in --fast-misread-rate of their answers:
+
+    python bench/mock_engine.py --fast-model fast --fast-latency lognormal:0.4:0.3 --fast-misread-rate 0.3
+
+For bench/accuracy_benchmark.py it reads synthetic corpus drawings (generate_test_pdf.py --corpus):
+after POST /mock/expect {"ground_truth": "corpus/drawing_00001.json"}, every image is answered with the
+features of that drawing it actually shows (bench/corpus_reader.py), instead of a canned answer.
+
+Then point the backend at it:
+
+    QWEN_API_KEY=mock QWEN_BASE_URL=http://localhost:9000/v1 uvicorn main:app
+
+Every option can also be set through the MOCK_* environment variable of the same name.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from corpus_reader import MIN_TEXT_PX, CorpusReader
+
+# Features of generate_test_pdf.py's calibration drawing, used when no --responses file is given
+DEFAULT_RESPONSE = [
+    {"type": "Dimension", "subtype": "Linear", "value": "50.0", "tolerance": "±0.1",
+     "original_text": "50.0 +/- 0.1", "box_2d": [110, 230, 135, 480]},
+    {"type": "GD&T", "subtype": "Perpendicularity", "value": "0.05", "tolerance": "", "datum": "A",
+     "original_text": "Perpendicularity 0.05 A", "box_2d": [200, 230, 225, 560]},
+    {"type": "GD&T", "subtype": "Position", "value": "0.1", "tolerance": "M", "datum": "A B",
+     "original_text": "⌖ 0.1 M A B", "box_2d": [305, 230, 330, 470]},
+    {"type": "Dimension", "subtype": "Linear", "value": "100.00", "tolerance": "",
+     "original_text": "100.00", "box_2d": [410, 230, 435, 350]},
+    {"type": "Dimension", "subtype": "Diameter", "value": "Ø25.0", "tolerance": "±0.05",
+     "original_text": "Ø 25.0 +/- 0.05", "box_2d": [110, 710, 135, 950]},
+    {"type": "Dimension", "subtype": "Linear", "value": "12,5", "tolerance": "±0,1",
+     "original_text": "12,5 +/- 0,1", "box_2d": [270, 710, 295, 900]},
+]
+
+def _env(name, default):
+    return os.environ.get(f"MOCK_{name}", default)
+
+class Latency:
+    """
+    Latency distribution from a spec string:
+    fixed:S | uniform:MIN:MAX | normal:MEAN:SD | lognormal:MEDIAN:SIGMA | exp:MEAN
+    """
+
+    def __init__(self, spec):
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        self.spec = spec
+
+    def sample(self):
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = random.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = random.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = random.lognormvariate(math.log(p[0]), p[1])
+        elif self.kind == "exp":
+            value = random.expovariate(1.0 / p[0])
+        else:
+            raise ValueError(f"Unknown latency distribution: {self.spec}")
+        return max(0.0, value)
+
+class MockEngine:
+    def __init__(self, latency, error_rate=0.0, error_statuses=(429, 500, 503), retry_after=1.0,
+                 hang_rate=0.0, hang_seconds=300.0, truncate_rate=0.0, responses=None, chunk_chars=24,
+                 fast_model=None, fast_latency=None, fast_misread_rate=0.0, min_text_px=MIN_TEXT_PX):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.retry_after = retry_after
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.truncate_rate = truncate_rate
+        self.responses = responses or [DEFAULT_RESPONSE]
+        self.chunk_chars = chunk_chars
+        self.fast_model = fast_model
+        self.fast_latency = fast_latency or latency
+        self.fast_misread_rate = fast_misread_rate
+        self.min_text_px = min_text_px
+        self.reader = None # CorpusReader of the drawing being benchmarked, see /mock/expect
+        self.stats = {"requests": 0, "streams": 0, "errors": 0, "hangs": 0, "truncated": 0, "continuations": 0, "in_flight": 0, "peak_in_flight": 0,
+                      "models": {}, "misread": 0}
+
+    def is_fast(self, model):
+        return bool(self.fast_model) and model == self.fast_model
+
+    def misread(self, features):
+        """A small model's typical slip: one feature's value or ISO code read wrong."""
+        self.stats["misread"] += 1
+        features = [dict(feature) for feature in features]
+        feature = random.choice(features)
+        tolerance = feature.get("tolerance") or ""
+        if len(tolerance) > 1 and tolerance[0].isalpha() and tolerance[-1].isdigit():
+            feature["tolerance"] = "W" + feature["tolerance"][1:] # No such ISO 286 fundamental deviation
+        else:
+            feature["value"] = str(feature.get("value", "")).replace("0", "O").replace("5", "S") or "?"
+        return features
+
+    def expect(self, ground_truth):
+        """Reads the corpus drawing with this ground-truth JSON from now on, or canned answers again with None."""
+        self.reader = CorpusReader(ground_truth, self.min_text_px) if ground_truth else None
+
+    def answer(self, messages=(), model=None, image=None):
+        """
+        (content, finish_reason). Truncated answers stop mid-array, like a max_tokens cut-off.
+        A continuation request (text-only last turn after the partial answer) gets the features
+        that were not in the partial answer. With a corpus drawing expected, `image` (the bytes
+        of the page image in the request) is read instead of picking a canned answer.
+        """
+        if self.reader is not None and image is not None:
+            features = self.reader.read(image)
+        else:
+            features = random.choice(self.responses)
+        if self.is_fast(model) and random.random() < self.fast_misread_rate:
+            features = self.misread(features)
+        if len(messages) >= 2 and isinstance(messages[-1].get("content"), str) and messages[-2].get("role") == "assistant":
+            self.stats["continuations"] += 1
+            try:
+                sent = json.loads(messages[-2]["content"])
+            except (TypeError, ValueError):
+                sent = []
+            features = [feature for feature in features if feature not in sent]
+        content = json.dumps(features, ensure_ascii=False)
+        if random.random() < self.truncate_rate:
+            self.stats["truncated"] += 1
+            return content[: max(1, int(len(content) * random.uniform(0.3, 0.9)))], "length"
+        return content, "stop"
+
+    @staticmethod
+    def image(messages):
+        """Bytes of the last image in the request (the page; few-shot examples come before it), None without one."""
+        for message in reversed(messages):
+            content = message.get("content")
+            if not isinstance(content, list):
+                continue
+            for part in reversed(content):
+                url = (part.get("image_url") or {}).get("url", "") if isinstance(part, dict) else ""
+                if url.startswith("data:") and "," in url:
+                    return base64.b64decode(url.split(",", 1)[1])
+        return None
+
+    def usage(self, body, content):
+        prompt = json.dumps(body.get("messages", []))
+        # Rough: 4 characters per text token, images counted by their payload size
+        prompt_tokens = len(prompt) // 4 if len(prompt) < 20000 else 1000 + len(prompt) // 1000
+        completion_tokens = max(1, len(content) // 4)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def error(self):
+        status = random.choice(self.error_statuses)
+        self.stats["errors"] += 1
+        headers = {"retry-after": str(self.retry_after)} if status == 429 else {}
+        return JSONResponse(
+            status_code=status,
+            headers=headers,
+            content={"error": {"message": f"Injected error {status}", "type": "mock_error", "code": status}},
+        )
+
+def create_app(engine):
+    app = FastAPI(title="DrawingScan mock engine")
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        engine.stats["requests"] += 1
+        engine.stats["models"][model] = engine.stats["models"].get(model, 0) + 1
+
+        if random.random() < engine.error_rate:
+            await asyncio.sleep(engine.latency.sample() * 0.1)
+            return engine.error()
+        if random.random() < engine.hang_rate:
+            engine.stats["hangs"] += 1
+            await asyncio.sleep(engine.hang_seconds)
+
+        messages = body.get("messages", [])
+        started = time.perf_counter()
+        if engine.reader is not None:
+            # Reading takes a while; it counts towards the model's latency
+            content, finish_reason = await run_in_threadpool(engine.answer, messages, model, engine.image(messages))
+        else:
+            content, finish_reason = engine.answer(messages, model)
+        usage = engine.usage(body, content)
+        latency = max(0.0, (engine.fast_latency if engine.is_fast(model) else engine.latency).sample() - (time.perf_counter() - started))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            engine.stats["streams"] += 1
+            chunks = [content[i:i + engine.chunk_chars] for i in range(0, len(content), engine.chunk_chars)]
+
+            async def events():
+                engine.stats["in_flight"] += 1
+                engine.stats["peak_in_flight"] = max(engine.stats["peak_in_flight"], engine.stats["in_flight"])
+                try:
+                    # Time to first token, then the rest spread over the remaining latency
+                    await asyncio.sleep(latency * 0.2)
+                    for chunk in chunks:
+                        await asyncio.sleep(latency * 0.8 / len(chunks))
+                        yield "data: " + json.dumps({
+                            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                            "choices": [{"index": 0, "delta": {"content": chunk}, "finish_reason": None}],
+                        }) + "\n\n"
+                    yield "data: " + json.dumps({
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                        "usage": usage,
+                    }) + "\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    engine.stats["in_flight"] -= 1
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        engine.stats["in_flight"] += 1
+        engine.stats["peak_in_flight"] = max(engine.stats["peak_in_flight"], engine.stats["in_flight"])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            engine.stats["in_flight"] -= 1
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": usage,
+        }
+
+    # QWEN_BASE_URL may or may not include /v1
+    app.add_api_route("/v1/chat/completions", chat_completions, methods=["POST"])
+    app.add_api_route("/chat/completions", chat_completions, methods=["POST"])
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/mock/stats")
+    def stats():
+        read = engine.reader.stats if engine.reader is not None else None
+        return {**engine.stats, "latency": engine.latency.spec, "error_rate": engine.error_rate, "read": read}
+
+    @app.post("/mock/expect")
+    async def expect(request: Request):
+        """{"ground_truth": path of a corpus drawing's JSON, or null for canned answers again}"""
+        body = await request.json()
+        try:
+            await run_in_threadpool(engine.expect, body.get("ground_truth"))
+        except (OSError, ValueError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Cannot read ground truth: {e}")
+        return {"ground_truth": body.get("ground_truth"), "features": len(engine.reader.features) if engine.reader else 0}
+
+    return app
+
+def load_responses(path):
+    """A JSON file holding one feature array, or a list of them (one is picked per request)."""
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data and all(isinstance(item, list) for item in data):
+        return data
+    return [data]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=_env("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(_env("PORT", 9000)))
+    parser.add_argument("--latency", default=_env("LATENCY", "lognormal:1.5:0.4"),
+                        help="fixed:S | uniform:MIN:MAX | normal:MEAN:SD | lognormal:MEDIAN:SIGMA | exp:MEAN (seconds)")
+    parser.add_argument("--error-rate", type=float, default=float(_env("ERROR_RATE", 0.0)))
+    parser.add_argument("--error-statuses", default=_env("ERROR_STATUSES", "429,500,503"))
+    parser.add_argument("--retry-after", type=float, default=float(_env("RETRY_AFTER", 1.0)))
+    parser.add_argument("--hang-rate", type=float, default=float(_env("HANG_RATE", 0.0)), help="Requests that never answer in time")
+    parser.add_argument("--hang-seconds", type=float, default=float(_env("HANG_SECONDS", 300.0)))
+    parser.add_argument("--truncate-rate", type=float, default=float(_env("TRUNCATE_RATE", 0.0)), help="Answers cut off with finish_reason=length")
+    parser.add_argument("--responses", default=_env("RESPONSES", ""), help="JSON file with canned feature arrays")
+    parser.add_argument("--fast-model", default=_env("FAST_MODEL", ""), help="Model name of the cascade's small model")
+    parser.add_argument("--fast-latency", default=_env("FAST_LATENCY", "lognormal:0.4:0.3"), help="Latency of --fast-model")
+    parser.add_argument("--fast-misread-rate", type=float, default=float(_env("FAST_MISREAD_RATE", 0.0)),
+                        help="Answers of --fast-model with one feature misread")
+    parser.add_argument("--min-text-px", type=float, default=float(_env("MIN_TEXT_PX", MIN_TEXT_PX)),
+                        help="Text less tall than this in the sent image is unreadable (corpus drawings, see /mock/expect)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    engine = MockEngine(
+        Latency(args.latency),
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",") if s],
+        retry_after=args.retry_after,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        truncate_rate=args.truncate_rate,
+        responses=load_responses(args.responses),
+        fast_model=args.fast_model or None,
+        fast_latency=Latency(args.fast_latency),
+        fast_misread_rate=args.fast_misread_rate,
+        min_text_px=args.min_text_px,
+    )
+    print(f"🧪 Mock engine on http://{args.host}:{args.port}/v1 (latency {args.latency}, errors {args.error_rate:.0%})")
+    uvicorn.run(create_app(engine), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+End-to-end load benchmark for the extraction API.
+
+Starts the mock engine and the backend (wired to it through QWEN_BASE_URL), fires concurrent
+uploads of the calibration drawing from generate_test_pdf.py and reports throughput,
+latency percentiles and per-stage timings. Every run is appended to bench/results/history.jsonl
+together with the git commit, so runs can be compared across commits:
+
+    python bench/run_benchmark.py --requests 100 --concurrency 8
+    python bench/run_benchmark.py --endpoint stream --mock-latency lognormal:3:0.5
+    python bench/run_benchmark.py --cascade --mock-fast-misread-rate 0.2 --label "cascade"
+    python bench/run_benchmark.py --compare 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, "backend")
+HISTORY = os.path.join(ROOT, "bench", "results", "history.jsonl")
+STAGES = ["render_seconds", "prepare_seconds", "extract_seconds", "seconds"]
+FAST_MODEL = "mock-fast" # Model name of the cascade's small model on the mock engine
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4),
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL) != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def test_drawings(paths, workdir):
+    """The given files, or the calibration drawing generated on the fly."""
+    if paths:
+        return paths
+    sys.path.insert(0, ROOT)
+    from generate_test_pdf import create_test_drawing
+    path = os.path.join(workdir, "test_drawing.pdf")
+    create_test_drawing(path)
+    return [path]
+
+def wait_until_ready(url, process, timeout=60, expect_ok=False):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            status = httpx.get(url, timeout=1).status_code
+            if status == 200 or (status < 500 and not expect_ok):
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready in {timeout}s")
+
+def start_stack(args, workdir):
+    """Mock engine + backend as subprocesses. Returns (backend url, mock url, processes)."""
+    mock_port, api_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "bench", "mock_engine.py"),
+        "--port", str(mock_port), "--latency", args.mock_latency,
+        "--error-rate", str(args.mock_error_rate), "--truncate-rate", str(args.mock_truncate_rate), "--seed", "1",
+        "--fast-model", FAST_MODEL, "--fast-latency", args.mock_fast_latency, "--fast-misread-rate", str(args.mock_fast_misread_rate),
+    ])
+    mock_url = f"http://127.0.0.1:{mock_port}"
+
+    env = dict(os.environ)
+    env.update({
+        "QWEN_API_KEY": "mock",
+        "QWEN_BASE_URL": f"{mock_url}/v1",
+        "GEMINI_API_KEY": "",
+        "CACHE_ENABLED": "1" if args.cache else "0",
+        "JOB_WORKERS": "0",
+        "CASCADE_FAST_MODEL": FAST_MODEL if args.cascade else "",
+        "PYTHONUNBUFFERED": "1",
+    })
+    # Own working directory, so the benchmark's SQLite database never touches backend/app.db
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND,
+         "--port", str(api_port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        # Own process group, so the rasterizer pool's workers go down with it
+        start_new_session=hasattr(os, "killpg"),
+    )
+    api_url = f"http://127.0.0.1:{api_port}"
+    wait_until_ready(f"{mock_url}/v1/models", mock)
+    # /readyz answers 200 once the engines are warm (see backend/warmup.py)
+    wait_until_ready(f"{api_url}/readyz", backend, expect_ok=True)
+    return api_url, mock_url, [backend, mock]
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+def content_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    return {".pdf": "application/pdf", ".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+            ".tif": "image/tiff", ".tiff": "image/tiff", ".webp": "image/webp"}.get(ext, "application/octet-stream")
+
+async def one_request(client, url, endpoint, path, payload):
+    files = {"file": (os.path.basename(path), payload, content_type(path))}
+    started = time.perf_counter()
+    sample = {"ok": False, "pages": []}
+    try:
+        if endpoint == "stream":
+            async with client.stream("POST", f"{url}/upload/stream", files=files) as response:
+                sample["status"] = response.status_code
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["event"] == "feature" and "first_feature" not in sample:
+                        sample["first_feature"] = time.perf_counter() - started
+                    elif event["event"] == "page":
+                        sample["pages"].append(event)
+                    elif event["event"] == "done":
+                        sample["server_seconds"] = event["seconds"]
+                        sample["features"] = event["features"]
+                        sample["ok"] = response.status_code == 200 and not any("error" in p for p in sample["pages"])
+        else:
+            response = await client.post(f"{url}/upload/", files=files)
+            sample["status"] = response.status_code
+            if response.status_code == 200:
+                document = response.json()
+                sample["pages"] = document.get("pages", [])
+                sample["server_seconds"] = document.get("seconds")
+                sample["features"] = len(document.get("results", []))
+                sample["ok"] = not any("error" in p for p in sample["pages"])
+    except httpx.HTTPError as e:
+        sample["status"] = None
+        sample["error"] = str(e)
+    sample["latency"] = time.perf_counter() - started
+    return sample
+
+async def run_load(args, url, drawings):
+    payloads = [(path, open(path, "rb").read()) for path in drawings]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        for i in range(args.warmup):
+            path, payload = payloads[i % len(payloads)]
+            await one_request(client, url, args.endpoint, path, payload)
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded(i):
+            path, payload = payloads[i % len(payloads)]
+            async with semaphore:
+                return await one_request(client, url, args.endpoint, path, payload)
+
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+    return samples, wall
+
+def report(args, samples, wall, mock_stats):
+    ok = [s for s in samples if s["ok"]]
+    stages = {}
+    for stage in STAGES:
+        values = [page[stage] for s in ok for page in s["pages"] if stage in page]
+        stages["page_" + stage if stage == "seconds" else stage] = summarize(values)
+    overhead = [s["latency"] - s["server_seconds"] for s in ok if s.get("server_seconds") is not None]
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "config": {
+            "endpoint": args.endpoint,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mock_latency": args.mock_latency,
+            "mock_error_rate": args.mock_error_rate,
+            "mock_truncate_rate": args.mock_truncate_rate,
+            "cache": args.cache,
+            "cascade": args.cascade,
+            "mock_fast_latency": args.mock_fast_latency if args.cascade else None,
+            "mock_fast_misread_rate": args.mock_fast_misread_rate if args.cascade else None,
+        },
+        "requests_per_second": round(len(ok) / wall, 3) if wall else None,
+        "wall_seconds": round(wall, 3),
+        "succeeded": len(ok),
+        "failed": len(samples) - len(ok),
+        "latency": summarize([s["latency"] for s in ok]),
+        "first_feature": summarize([s["first_feature"] for s in ok if "first_feature" in s]),
+        "stages": stages,
+        "client_overhead": summarize(overhead),
+        "mock": mock_stats,
+    }
+
+def print_report(result):
+    latency = result["latency"] or {}
+    print(f"\n📊 {result['config']['endpoint']} x{result['config']['requests']} @ concurrency {result['config']['concurrency']} "
+          f"(commit {result['commit']})")
+    print(f"   throughput   {result['requests_per_second']} req/s   ok {result['succeeded']}   failed {result['failed']}")
+    print(f"   latency      p50 {latency.get('p50')}s   p95 {latency.get('p95')}s   p99 {latency.get('p99')}s")
+    if result["first_feature"]:
+        print(f"   first feat.  p50 {result['first_feature']['p50']}s   p95 {result['first_feature']['p95']}s")
+    for stage, stats in result["stages"].items():
+        if stats:
+            print(f"   {stage:<16} mean {stats['mean']}s   p95 {stats['p95']}s")
+    models = (result.get("mock") or {}).get("models") or {}
+    if result["config"].get("cascade") and models:
+        fast = models.get(FAST_MODEL, 0)
+        large = sum(count for model, count in models.items() if model != FAST_MODEL)
+        print(f"   cascade      {fast} fast / {large} large model request(s), "
+              f"{large / fast:.0%} escalated" if fast else f"   cascade      {large} large model request(s)")
+
+def compare(count):
+    if not os.path.exists(HISTORY):
+        print("No benchmark history yet.")
+        return
+    with open(HISTORY, encoding="utf-8") as f:
+        runs = [json.loads(line) for line in f if line.strip()][-count:]
+    print(f"{'timestamp':<26}{'commit':<16}{'endpoint':<9}{'conc':>5}{'req/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'fail':>6}  label")
+    for run in runs:
+        latency = run.get("latency") or {}
+        print(f"{run['timestamp']:<26}{str(run['commit']):<16}{run['config']['endpoint']:<9}{run['config']['concurrency']:>5}"
+              f"{run['requests_per_second'] or 0:>9.2f}{latency.get('p50') or 0:>8.2f}{latency.get('p95') or 0:>8.2f}"
+              f"{latency.get('p99') or 0:>8.2f}{run['failed']:>6}  {run.get('label') or ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--endpoint", choices=["upload", "stream"], default="upload")
+    parser.add_argument("--files", nargs="*", help="Drawings to upload (default: generated calibration drawing)")
+    parser.add_argument("--url", help="Benchmark a running backend instead of starting one")
+    parser.add_argument("--mock-latency", default="lognormal:1.5:0.4")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0)
+    parser.add_argument("--mock-truncate-rate", type=float, default=0.0, help="Share of mock answers cut off at the output limit")
+    parser.add_argument("--cascade", action="store_true", help="Answer with a fast mock model first (CASCADE_FAST_MODEL)")
+    parser.add_argument("--mock-fast-latency", default="lognormal:0.4:0.3", help="Latency model of the fast mock model")
+    parser.add_argument("--mock-fast-misread-rate", type=float, default=0.2, help="Share of fast answers with a misread feature")
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache on (measures cache hits)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument("--compare", type=int, metavar="N", help="Print the last N runs and exit")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's log")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+
+    processes = []
+    with tempfile.TemporaryDirectory(prefix="drawingscan_bench_") as workdir:
+        try:
+            drawings = test_drawings(args.files, workdir)
+            mock_url = None
+            if args.url:
+                url = args.url.rstrip("/")
+            else:
+                url, mock_url, processes = start_stack(args, workdir)
+
+            samples, wall = asyncio.run(run_load(args, url, drawings))
+            mock_stats = httpx.get(f"{mock_url}/mock/stats").json() if mock_url else None
+            result = report(args, samples, wall, mock_stats)
+        finally:
+            for process in processes:
+                stop(process)
+
+    print_report(result)
+    if not args.no_history:
+        os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+        with open(HISTORY, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"   appended to {os.path.relpath(HISTORY, ROOT)}")
+
+if __name__ == "__main__":
+    main()
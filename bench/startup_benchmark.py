@@ -0,0 +1,156 @@
+"""
+Cold-start benchmark for the backend.
+
+Measures, over several fresh processes, how long `import main` takes and how long a new
+backend needs until GET /healthz answers (the process serves requests), until GET /readyz
+answers 200 (engines constructed, connections probed, render pool up) and until the first
+upload returns its features. The engine is the mock from mock_engine.py, so the numbers are
+the server's own start-up cost, not the provider's:
+
+    python bench/startup_benchmark.py --runs 5
+    python bench/startup_benchmark.py --runs 3 --no-probe --label "without connection probe"
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from run_benchmark import (BACKEND, ROOT, content_type, free_port, git_commit, stop, summarize,
+                           test_drawings, wait_until_ready)
+
+HISTORY = os.path.join(ROOT, "bench", "results", "startup_history.jsonl")
+POLL_SECONDS = 0.02
+
+def import_seconds(env, workdir):
+    """Wall time of `import main` in a fresh interpreter (no server, no warm-up)."""
+    code = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=workdir, text=True,
+                                     env={**env, "PYTHONPATH": BACKEND}, stderr=subprocess.DEVNULL)
+    return float(output.strip().splitlines()[-1])
+
+def poll(url, started, process, timeout, expect_ok=True):
+    """Seconds since `started` until `url` answers (200 if expect_ok)."""
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            response = httpx.get(url, timeout=1)
+            if response.status_code == 200 or not expect_ok:
+                return time.perf_counter() - started, response
+        except httpx.HTTPError:
+            pass
+        time.sleep(POLL_SECONDS)
+    raise RuntimeError(f"{url} did not answer in {timeout}s")
+
+def one_start(args, env, workdir, drawing):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND, "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        start_new_session=hasattr(os, "killpg"),
+    )
+    try:
+        healthz, _ = poll(f"{url}/healthz", started, backend, args.timeout)
+        readyz, response = poll(f"{url}/readyz", started, backend, args.timeout)
+        with open(drawing, "rb") as f:
+            files = {"file": (os.path.basename(drawing), f.read(), content_type(drawing))}
+        upload_started = time.perf_counter()
+        upload = httpx.post(f"{url}/upload/", files=files, timeout=args.timeout)
+        upload.raise_for_status()
+        first_result = time.perf_counter() - started
+        return {
+            "healthz": healthz,
+            "readyz": readyz,
+            "first_upload": time.perf_counter() - upload_started,
+            "first_result": first_result,
+            "warmup": response.json(),
+        }
+    finally:
+        stop(backend)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--drawing", help="File for the first upload (default: the generated calibration drawing)")
+    parser.add_argument("--mock-latency", default="fixed:0.2", help="Latency model of the mock engine")
+    parser.add_argument("--no-probe", action="store_true", help="Start with WARMUP_PROBE=0")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--no-history", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's log")
+    args = parser.parse_args()
+
+    mock = None
+    with tempfile.TemporaryDirectory(prefix="drawingscan_startup_bench_") as workdir:
+        try:
+            drawing = test_drawings([args.drawing] if args.drawing else [], workdir)[0]
+            mock_port = free_port()
+            mock = subprocess.Popen([
+                sys.executable, os.path.join(ROOT, "bench", "mock_engine.py"),
+                "--port", str(mock_port), "--latency", args.mock_latency, "--seed", "1",
+            ])
+            wait_until_ready(f"http://127.0.0.1:{mock_port}/v1/models", mock)
+
+            env = dict(os.environ)
+            env.update({
+                "QWEN_API_KEY": "mock",
+                "QWEN_BASE_URL": f"http://127.0.0.1:{mock_port}/v1",
+                "GEMINI_API_KEY": "",
+                "CACHE_ENABLED": "0",
+                "JOB_WORKERS": "0",
+                "WARMUP_PROBE": "0" if args.no_probe else "1",
+                "LOG_LEVEL": "WARNING",
+                "PYTHONUNBUFFERED": "1",
+            })
+            imports, starts = [], []
+            for run in range(args.runs):
+                imports.append(import_seconds(env, workdir))
+                starts.append(one_start(args, env, workdir, drawing))
+                print(f"   run {run + 1}/{args.runs}: import {imports[-1]:.2f}s  /healthz {starts[-1]['healthz']:.2f}s  "
+                      f"/readyz {starts[-1]['readyz']:.2f}s  first result {starts[-1]['first_result']:.2f}s")
+        finally:
+            if mock is not None:
+                stop(mock)
+
+    steps = {}
+    for start in starts:
+        for name, step in start["warmup"].get("steps", {}).items():
+            steps.setdefault(name, []).append(step["seconds"])
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "config": {"runs": args.runs, "probe": not args.no_probe, "mock_latency": args.mock_latency,
+                   "cpus": os.cpu_count()},
+        "import_main": summarize(imports),
+        "healthz": summarize([start["healthz"] for start in starts]),
+        "readyz": summarize([start["readyz"] for start in starts]),
+        "first_upload": summarize([start["first_upload"] for start in starts]),
+        "first_result": summarize([start["first_result"] for start in starts]),
+        "warmup_steps": {name: summarize(values) for name, values in steps.items()},
+    }
+
+    print(f"\n🧊 Cold start over {args.runs} run(s) (commit {result['commit']})")
+    for key in ("import_main", "healthz", "readyz", "first_upload", "first_result"):
+        stats = result[key] or {}
+        print(f"   {key:<13} p50 {stats.get('p50')}s   max {stats.get('max')}s")
+    for name, stats in result["warmup_steps"].items():
+        print(f"   warm-up {name:<8} p50 {stats.get('p50')}s")
+    if not args.no_history:
+        os.makedirs(os.path.dirname(HISTORY), exist_ok=True)
+        with open(HISTORY, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"   appended to {os.path.relpath(HISTORY, ROOT)}")
+
+if __name__ == "__main__":
+    main()
@@ -56,6 +56,8 @@ function App() {
       const response = await axios.post(`${apiUrl}/upload/`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          // Saved by Login; lets the backend file the drawing under this user
+          ...(localStorage.getItem('token') && { Authorization: `Bearer ${localStorage.getItem('token')}` }),
         },
       });
 
@@ -1,6 +1,29 @@
+"""
+Test drawings for DrawingScan.
+
+    python generate_test_pdf.py                                  # test_drawing.pdf, the calibration drawing
+    python generate_test_pdf.py --corpus corpus --count 1000     # synthetic drawings with ground truth
+    python generate_test_pdf.py --corpus corpus --count 200 --format png --sheets A3,A2 --dpi 150,200
+
+Corpus drawings are random parts with dimensions, ISO fits, GD&T frames, comma decimals and rotated
+text, on sheets from A4 to A0 in different fonts, text sizes and densities. Every drawing
+(drawing_00001.pdf) comes with its ground truth (drawing_00001.json): the features an engine should
+return, with box_2d on the page. The same --seed always gives the same corpus.
+"""
+import argparse
+import json
+import math
+import os
+import random
+
+import reportlab
+from PIL import Image, ImageDraw, ImageFont
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
 
 def create_test_drawing(filename="test_drawing.pdf"):
     c = canvas.Canvas(filename, pagesize=A4)
@@ -38,5 +61,456 @@ def create_test_drawing(filename="test_drawing.pdf"):
     c.save()
     print(f"Created {filename}")
 
+# --- SYNTHETIC CORPUS ---
+SHEETS = {"A4": (297, 210), "A3": (420, 297), "A2": (594, 420), "A1": (841, 594), "A0": (1189, 841)} # Landscape, mm
+DPIS = [100, 150, 200, 300]
+MAX_PIXELS = 40_000_000 # DPIs that would make a sheet larger than this are not drawn for it
+REFERENCE_DPI = 150 # Raster of a vector PDF, for the benchmark's stand-in engine
+FONT_DIR = os.path.join(os.path.dirname(reportlab.__file__), "fonts")
+FONTS = {"Vera": "Vera.ttf", "Vera-Bold": "VeraBd.ttf", "Vera-Italic": "VeraIt.ttf"} # Bitstream Vera, shipped with reportlab
+TEXT_SIZES = [3.5, 5.0, 7.0] # Font size in mm, about ISO 3098 text heights 2.5, 3.5 and 5
+DENSITIES = {"sparse": (4, 10), "normal": (12, 25), "dense": (30, 60)} # Features on an A3 sheet, scaled by sheet area
+GDT_SHARES = [0.0, 0.15, 0.3]
+ROTATED_SHARES = [0.0, 0.2, 0.4]
+COMMA_SHARE = 0.3 # Drawings with European decimal commas
+SCANNED_SHARE = 0.3 # PDFs holding a raster of the drawing instead of vector graphics
+ISO_FITS = ["H7", "H8", "H11", "g6", "h6", "h7", "h9", "f7", "k6", "js6", "p6", "m6", "n6"]
+GDT_SYMBOLS = {"Position": "⌖", "Perpendicularity": "⏊", "Parallelism": "∥", "Flatness": "⏥", "Concentricity": "◎", "Runout": "↗"}
+BORDER = 10 # mm
+GAP = 3 # mm kept free around every annotation
+
+_registered = set()
+
+def _font(name):
+    if name not in _registered:
+        pdfmetrics.registerFont(TTFont(name, os.path.join(FONT_DIR, FONTS[name])))
+        _registered.add(name)
+    return name
+
+def text_extent(text, font, size):
+    """(width, ascent, descent) in mm of text set in font at size mm. Descent is negative."""
+    ascent, descent = pdfmetrics.getAscentDescent(_font(font), size)
+    return pdfmetrics.stringWidth(text, _font(font), size), ascent, descent
+
+class Drawing:
+    """Vector layout in mm (origin top left) that renders to a PDF or to a raster."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.ops = []
+
+    def line(self, x1, y1, x2, y2, weight=0.25):
+        self.ops.append(("line", x1, y1, x2, y2, weight))
+
+    def rect(self, x, y, w, h, weight=0.35):
+        self.ops.append(("rect", x, y, w, h, weight))
+
+    def circle(self, cx, cy, r, weight=0.35):
+        self.ops.append(("circle", cx, cy, r, weight))
+
+    def arrow(self, x, y, dx, dy, size):
+        """Filled arrowhead with its tip at (x, y), pointing along (dx, dy)."""
+        length = math.hypot(dx, dy) or 1.0
+        ux, uy = dx / length, dy / length
+        bx, by = x - ux * size, y - uy * size
+        half = size / 3
+        self.ops.append(("polygon", [(x, y), (bx - uy * half, by + ux * half), (bx + uy * half, by - ux * half)]))
+
+    def text(self, x, y, text, font, size, angle=0):
+        """Text whose box has its top left corner at (x, y). angle 90 reads bottom to top. Returns the box (x, y, w, h)."""
+        width, ascent, descent = text_extent(text, font, size)
+        self.ops.append(("text", x, y, text, font, size, angle))
+        return (x, y, width, ascent - descent) if angle == 0 else (x, y, ascent - descent, width)
+
+def render_pdf(drawing, path, raster_dpi=None):
+    """Vector PDF, or with raster_dpi a 'scanned' one: the raster of the drawing on a page of the same size."""
+    height = drawing.height
+    c = canvas.Canvas(path, pagesize=(drawing.width * mm, height * mm))
+    if raster_dpi:
+        c.drawImage(ImageReader(render_raster(drawing, raster_dpi)), 0, 0, drawing.width * mm, height * mm)
+        c.save()
+        return
+    for op in drawing.ops:
+        kind = op[0]
+        if kind == "line":
+            _, x1, y1, x2, y2, weight = op
+            c.setLineWidth(weight * mm)
+            c.line(x1 * mm, (height - y1) * mm, x2 * mm, (height - y2) * mm)
+        elif kind == "rect":
+            _, x, y, w, h, weight = op
+            c.setLineWidth(weight * mm)
+            c.rect(x * mm, (height - y - h) * mm, w * mm, h * mm)
+        elif kind == "circle":
+            _, cx, cy, r, weight = op
+            c.setLineWidth(weight * mm)
+            c.circle(cx * mm, (height - cy) * mm, r * mm)
+        elif kind == "polygon":
+            path_ = c.beginPath()
+            points = op[1]
+            path_.moveTo(points[0][0] * mm, (height - points[0][1]) * mm)
+            for px, py in points[1:]:
+                path_.lineTo(px * mm, (height - py) * mm)
+            path_.close()
+            c.drawPath(path_, stroke=0, fill=1)
+        elif kind == "text":
+            _, x, y, text, font, size, angle = op
+            width, ascent, _ = text_extent(text, font, size)
+            c.setFont(_font(font), size * mm)
+            if angle == 0:
+                c.drawString(x * mm, (height - y - ascent) * mm, text)
+            else:
+                c.saveState()
+                c.translate((x + ascent) * mm, (height - y - width) * mm)
+                c.rotate(90)
+                c.drawString(0, 0, text)
+                c.restoreState()
+    c.save()
+
+def render_raster(drawing, dpi):
+    """Greyscale PIL image of the drawing at dpi."""
+    k = dpi / 25.4
+    image = Image.new("L", (round(drawing.width * k), round(drawing.height * k)), 255)
+    draw = ImageDraw.Draw(image)
+    fonts = {}
+
+    def pen(weight):
+        return max(1, round(weight * k))
+
+    for op in drawing.ops:
+        kind = op[0]
+        if kind == "line":
+            _, x1, y1, x2, y2, weight = op
+            draw.line([(x1 * k, y1 * k), (x2 * k, y2 * k)], fill=0, width=pen(weight))
+        elif kind == "rect":
+            _, x, y, w, h, weight = op
+            draw.rectangle([x * k, y * k, (x + w) * k, (y + h) * k], outline=0, width=pen(weight))
+        elif kind == "circle":
+            _, cx, cy, r, weight = op
+            draw.ellipse([(cx - r) * k, (cy - r) * k, (cx + r) * k, (cy + r) * k], outline=0, width=pen(weight))
+        elif kind == "polygon":
+            draw.polygon([(px * k, py * k) for px, py in op[1]], fill=0)
+        elif kind == "text":
+            _, x, y, text, font, size, angle = op
+            width, ascent, descent = text_extent(text, font, size)
+            key = (font, round(size * k))
+            if key not in fonts:
+                fonts[key] = ImageFont.truetype(os.path.join(FONT_DIR, FONTS[font]), key[1])
+            # Drawn white on black, then used as the mask for black ink. Hinted widths at a whole pixel
+            # size differ a little from the PDF metrics, so the end of the line gets some room.
+            slack = key[1] // 2
+            glyphs = Image.new("L", (math.ceil(width * k) + slack, math.ceil((ascent - descent) * k) + 2), 0)
+            ImageDraw.Draw(glyphs).text((0, ascent * k), text, font=fonts[key], fill=255, anchor="ls")
+            if angle:
+                glyphs = glyphs.rotate(angle, expand=True)
+            image.paste(0, (round(x * k), round(y * k) - (slack if angle else 0)), glyphs)
+    return image
+
+def _number(rng, low, high, decimals, comma):
+    text = f"{rng.uniform(low, high):.{decimals}f}"
+    return text.replace(".", ",") if comma else text
+
+def _decimal(value, comma):
+    text = f"{value:g}"
+    return text.replace(".", ",") if comma else text
+
+def _dimension(rng, comma):
+    """(feature, label, framed) of a random dimension callout. framed: drawn in a box (basic dimension)."""
+    subtype = rng.choices(["Linear", "Diameter", "Radius", "Chamfer", "Basic"], weights=[45, 25, 10, 8, 12])[0]
+    if subtype == "Chamfer":
+        value = f"{_decimal(rng.choice([0.5, 1, 1.5, 2, 3]), comma)}x45°"
+        return {"type": "Dimension", "subtype": "Chamfer", "value": value, "tolerance": ""}, value, False
+
+    decimals = rng.choices([0, 1, 2], weights=[50, 35, 15])[0]
+    number = _number(rng, 1, 40, decimals, comma) if subtype == "Radius" else _number(rng, 2, 400, decimals, comma)
+    if subtype == "Basic":
+        return {"type": "Dimension", "subtype": "Linear", "value": number, "tolerance": "Basic"}, number, True
+
+    prefix = {"Diameter": "Ø", "Radius": "R"}.get(subtype, "")
+    value = prefix + number
+    kind = rng.choices(["none", "symmetric", "fit", "deviations"], weights=[35, 30, 20, 15])[0]
+    if subtype == "Radius" and kind in ("fit", "deviations"):
+        kind = "symmetric"
+    if kind == "symmetric":
+        tolerance = "±" + _decimal(rng.choice([0.02, 0.05, 0.1, 0.2, 0.5]), comma)
+    elif kind == "fit":
+        tolerance = rng.choice(ISO_FITS)
+    elif kind == "deviations":
+        upper, lower = rng.choice([(0.2, -0.1), (0.1, 0), (0, -0.05), (0.05, -0.02), (0.3, 0.1)])
+        tolerance = f"{'+' if upper > 0 else ''}{_decimal(upper, comma)}/{'+' if lower > 0 else ''}{_decimal(lower, comma)}"
+    else:
+        tolerance = ""
+    label = f"{value} {tolerance}".strip()
+    return {"type": "Dimension", "subtype": subtype, "value": value, "tolerance": tolerance}, label, False
+
+def _frame_content(rng, comma):
+    """(feature, cells) of a random GD&T feature control frame: cells are symbol, value, datums."""
+    subtype = rng.choice(list(GDT_SYMBOLS))
+    value = _decimal(rng.choice([0.01, 0.02, 0.05, 0.1, 0.2]), comma)
+    if subtype in ("Position", "Concentricity") and rng.random() < 0.7:
+        value = "Ø" + value
+    modifier = "M" if subtype == "Position" and rng.random() < 0.4 else ""
+    if subtype == "Flatness":
+        datums = []
+    elif subtype in ("Position", "Runout"):
+        datums = rng.choice([["A"], ["A", "B"], ["A", "B", "C"]])
+    else:
+        datums = [rng.choice("ABC")]
+    text = " ".join(part for part in [GDT_SYMBOLS[subtype], value, modifier, " ".join(datums)] if part)
+    feature = {"type": "GD&T", "subtype": subtype, "value": value, "tolerance": modifier, "datum": " ".join(datums),
+               "original_text": text}
+    return feature, (subtype, value, modifier, datums)
+
+def _symbol(drawing, subtype, cx, cy, s):
+    """GD&T characteristic symbol drawn with lines, centred on (cx, cy) with half size s."""
+    if subtype == "Position":
+        drawing.circle(cx, cy, s * 0.6, 0.25)
+        drawing.line(cx - s, cy, cx + s, cy)
+        drawing.line(cx, cy - s, cx, cy + s)
+    elif subtype == "Perpendicularity":
+        drawing.line(cx, cy - s, cx, cy + s * 0.8)
+        drawing.line(cx - s, cy + s * 0.8, cx + s, cy + s * 0.8)
+    elif subtype == "Parallelism":
+        drawing.line(cx - s * 0.7, cy + s, cx - s * 0.1, cy - s)
+        drawing.line(cx + s * 0.1, cy + s, cx + s * 0.7, cy - s)
+    elif subtype == "Flatness":
+        points = [(cx - s, cy + s * 0.5), (cx - s * 0.5, cy - s * 0.5), (cx + s, cy - s * 0.5), (cx + s * 0.5, cy + s * 0.5)]
+        for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+            drawing.line(x1, y1, x2, y2)
+    elif subtype == "Concentricity":
+        drawing.circle(cx, cy, s * 0.4, 0.25)
+        drawing.circle(cx, cy, s * 0.85, 0.25)
+    elif subtype == "Runout":
+        drawing.line(cx - s * 0.7, cy + s * 0.8, cx + s * 0.6, cy - s * 0.7)
+        drawing.arrow(cx + s * 0.7, cy - s * 0.8, 1, -1.15, s * 0.7)
+
+def _frame_size(cells, font, size):
+    _, value, modifier, datums = cells
+    h = size * 1.6
+    value_w = text_extent(value, font, size)[0] + size * (1.7 if modifier else 0.8)
+    return h + value_w + h * len(datums), h
+
+def _draw_frame(drawing, x, y, cells, font, size):
+    subtype, value, modifier, datums = cells
+    w, h = _frame_size(cells, font, size)
+    _, ascent, descent = text_extent(value, font, size)
+    text_y = y + (h - (ascent - descent)) / 2
+    drawing.rect(x, y, w, h, 0.25)
+    _symbol(drawing, subtype, x + h / 2, y + h / 2, h * 0.32)
+    drawing.line(x + h, y, x + h, y + h)
+    box = drawing.text(x + h + size * 0.4, text_y, value, font, size)
+    cursor = box[0] + box[2] + size * 0.2
+    if modifier:
+        mod_w = text_extent(modifier, font, size * 0.7)[0]
+        drawing.circle(cursor + size * 0.5, y + h / 2, size * 0.45, 0.2)
+        drawing.text(cursor + size * 0.5 - mod_w / 2, y + h / 2 - size * 0.35, modifier, font, size * 0.7)
+        cursor += size * 1.1
+    cursor = x + w - h * len(datums)
+    for datum in datums:
+        drawing.line(cursor, y, cursor, y + h)
+        datum_w = text_extent(datum, font, size)[0]
+        drawing.text(cursor + (h - datum_w) / 2, text_y, datum, font, size)
+        cursor += h
+    # Leader to the feature
+    drawing.line(x, y + h / 2, x - size * 1.5, y + h / 2)
+    drawing.line(x - size * 1.5, y + h / 2, x - size * 1.5, y + h * 2)
+    drawing.arrow(x - size * 1.5, y + h * 2.2, 0, 1, size * 0.6)
+    return (x, y, w, h)
+
+def _free(box, occupied):
+    x, y, w, h = box
+    return all(x + w + GAP <= ox or ox + ow + GAP <= x or y + h + GAP <= oy or oy + oh + GAP <= y
+               for ox, oy, ow, oh in occupied)
+
+def _place(rng, w, h, area, occupied, attempts=80):
+    """Top left corner of a free w x h box inside area (x0, y0, x1, y1), None if the sheet is full."""
+    x0, y0, x1, y1 = area
+    if w > x1 - x0 or h > y1 - y0:
+        return None
+    for _ in range(attempts):
+        x, y = rng.uniform(x0, x1 - w), rng.uniform(y0, y1 - h)
+        if _free((x, y, w, h), occupied):
+            return x, y
+    return None
+
+def _box_2d(box, width, height):
+    x, y, w, h = box
+    return [round(y / height * 1000), round(x / width * 1000), round((y + h) / height * 1000), round((x + w) / width * 1000)]
+
+def drawing_params(rng, sheets=None, dpis=None, fmt="pdf"):
+    """Randomly chosen properties of one corpus drawing."""
+    sheet = rng.choice(sheets or list(SHEETS))
+    width, height = SHEETS[sheet]
+    if sheet == "A4" and rng.random() < 0.5:
+        width, height = height, width
+    fits = [dpi for dpi in (dpis or DPIS) if width * height * (dpi / 25.4) ** 2 <= MAX_PIXELS] or [min(dpis or DPIS)]
+    if fmt == "mixed":
+        fmt = rng.choice(["pdf", "png"])
+    scanned = fmt == "pdf" and rng.random() < SCANNED_SHARE
+    return {
+        "sheet": sheet,
+        "size_mm": [width, height],
+        "format": fmt,
+        "scanned": scanned,
+        "dpi": rng.choice(fits) if fmt == "png" or scanned else None, # None: vector PDF
+        "font": rng.choice(list(FONTS)),
+        "text_size": rng.choice(TEXT_SIZES),
+        "density": rng.choice(list(DENSITIES)),
+        "gdt_share": rng.choice(GDT_SHARES),
+        "rotated_share": rng.choice(ROTATED_SHARES),
+        "comma": rng.random() < COMMA_SHARE,
+    }
+
+def build_drawing(seed, index, params):
+    """(Drawing, ground-truth features) of corpus drawing `index`. Deterministic for the same seed, index and params."""
+    rng = random.Random(f"{seed}:{index}:layout")
+    width, height = params["size_mm"]
+    font, size, comma = params["font"], params["text_size"], params["comma"]
+    drawing = Drawing(width, height)
+    drawing.rect(BORDER, BORDER, width - 2 * BORDER, height - 2 * BORDER, 0.7)
+    area = (BORDER + GAP, BORDER + GAP, width - BORDER - GAP, height - BORDER - GAP)
+
+    # Title block, bottom right: text an engine should not report as features
+    block_w, block_h = min(170, (width - 2 * BORDER) * 0.55), 28
+    bx, by = width - BORDER - block_w, height - BORDER - block_h
+    drawing.rect(bx, by, block_w, block_h, 0.5)
+    drawing.line(bx, by + block_h / 2, bx + block_w, by + block_h / 2)
+    title_size = min(3.5, block_w / 40)
+    drawing.text(bx + 2, by + 2, f"SYNTHETIC PART {index}", "Vera-Bold", title_size * 1.2)
+    drawing.text(bx + 2, by + 8, f"DWG NO. SYN-{seed}-{index:05d}", "Vera", title_size)
+    drawing.text(bx + 2, by + block_h / 2 + 2, "GENERAL TOLERANCES ISO 2768-m", "Vera", title_size)
+    drawing.text(bx + 2, by + block_h / 2 + 8, f"SHEET {params['sheet']}   SCALE 1:1", "Vera", title_size)
+    occupied = [(bx, by, block_w, block_h)]
+
+    # Part views: outlines with holes and centre lines
+    for _ in range(rng.randint(1, 3)):
+        w, h = rng.uniform(0.12, 0.3) * width, rng.uniform(0.12, 0.3) * height
+        spot = _place(rng, w, h, area, occupied)
+        if spot is None:
+            continue
+        x, y = spot
+        drawing.rect(x, y, w, h, 0.5)
+        for _ in range(rng.randint(0, 3)):
+            r = rng.uniform(0.05, 0.18) * min(w, h)
+            cx, cy = rng.uniform(x + r * 1.5, x + w - r * 1.5), rng.uniform(y + r * 1.5, y + h - r * 1.5)
+            drawing.circle(cx, cy, r, 0.5)
+            drawing.line(cx - r * 1.3, cy, cx + r * 1.3, cy, 0.18)
+            drawing.line(cx, cy - r * 1.3, cx, cy + r * 1.3, 0.18)
+        occupied.append((x, y, w, h))
+
+    low, high = DENSITIES[params["density"]]
+    scale = (width * height) / (420 * 297)
+    count = max(3, round(rng.randint(low, high) * scale))
+    features = []
+    for _ in range(count):
+        if rng.random() < params["gdt_share"]:
+            feature, cells = _frame_content(rng, comma)
+            w, h = _frame_size(cells, font, size)
+            # Room for the leader on the left and below
+            spot = _place(rng, w + size * 2, h * 2.4, area, occupied)
+            if spot is None:
+                continue
+            box = _draw_frame(drawing, spot[0] + size * 2, spot[1], cells, font, size)
+            occupied.append((spot[0], spot[1], w + size * 2, h * 2.4))
+            tags = ["gdt"]
+        else:
+            feature, label, framed = _dimension(rng, comma)
+            rotated = feature["subtype"] not in ("Chamfer", "Radius") and rng.random() < params["rotated_share"]
+            text_w, ascent, descent = text_extent(label, font, size)
+            text_h = ascent - descent
+            pad = size * 0.3 if framed else 0.0
+            w, h = text_w + 2 * pad, text_h + 2 * pad
+            if rotated:
+                w, h = h, w
+            extension = rng.uniform(size, size * 4)
+            # Text, dimension line and the extension lines it points to
+            foot_w, foot_h = (w + size * 3, h + 2 * extension) if rotated else (w + 2 * extension, h + size * 3)
+            spot = _place(rng, foot_w, foot_h, area, occupied)
+            if spot is None:
+                continue
+            if rotated:
+                x, y = spot[0], spot[1] + extension
+            else:
+                x, y = spot[0] + extension, spot[1]
+            drawing.text(x + pad, y + pad, label, font, size, 90 if rotated else 0)
+            box = (x, y, w, h)
+            if framed:
+                drawing.rect(x, y, w, h, 0.25)
+            if feature["subtype"] in ("Chamfer", "Radius"):
+                # Leader from below the text
+                drawing.line(x, y + h + size * 0.3, x + w, y + h + size * 0.3)
+                drawing.line(x, y + h + size * 0.3, x - size * 0.8, y + h + size * 2.5)
+                drawing.arrow(x - size * 0.9, y + h + size * 2.8, -0.35, 1, size * 0.6)
+            elif rotated:
+                lx = x + w + size * 0.3
+                drawing.line(lx, y - extension, lx, y + h + extension)
+                drawing.arrow(lx, y - extension, 0, -1, size * 0.6)
+                drawing.arrow(lx, y + h + extension, 0, 1, size * 0.6)
+                for ey in (y - extension, y + h + extension):
+                    drawing.line(lx - size * 0.5, ey, lx + size * 2.5, ey, 0.18)
+            else:
+                ly = y + h + size * 0.3
+                drawing.line(x - extension, ly, x + w + extension, ly)
+                drawing.arrow(x - extension, ly, -1, 0, size * 0.6)
+                drawing.arrow(x + w + extension, ly, 1, 0, size * 0.6)
+                for ex in (x - extension, x + w + extension):
+                    drawing.line(ex, ly - size * 0.5, ex, ly + size * 2.5, 0.18)
+            occupied.append((spot[0], spot[1], foot_w, foot_h))
+            feature["original_text"] = label
+            tags = [tag for tag, present in (("rotated", rotated), ("basic", framed),
+                                            ("iso_fit", feature["tolerance"] in ISO_FITS)) if present]
+        if comma and any(char.isdigit() for char in feature["value"]) and "," in feature["original_text"]:
+            tags.append("comma")
+        feature["box_2d"] = _box_2d(box, width, height)
+        feature["tags"] = tags
+        features.append(feature)
+    return drawing, features
+
+def generate_drawing(out_dir, seed, index, fmt="pdf", sheets=None, dpis=None):
+    """Writes drawing_<index>.pdf/.png and its ground truth drawing_<index>.json. Returns the ground truth."""
+    params = drawing_params(random.Random(f"{seed}:{index}:params"), sheets, dpis, fmt)
+    drawing, features = build_drawing(seed, index, params)
+    name = f"drawing_{index:05d}"
+    path = os.path.join(out_dir, f"{name}.{params['format']}")
+    if params["format"] == "png":
+        image = render_raster(drawing, params["dpi"])
+        image.save(path, dpi=(params["dpi"], params["dpi"]))
+    else:
+        render_pdf(drawing, path, params["dpi"] if params["scanned"] else None)
+    truth = {"name": name, "file": os.path.basename(path), "seed": seed, "index": index, **params, "features": features}
+    with open(os.path.join(out_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(truth, f, ensure_ascii=False, indent=1)
+    return truth
+
+def generate_corpus(out_dir, count, seed=1, fmt="pdf", sheets=None, dpis=None, start=1):
+    """Writes `count` drawings with their ground truth into out_dir. Returns the ground-truth paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for index in range(start, start + count):
+        truth = generate_drawing(out_dir, seed, index, fmt, sheets, dpis)
+        paths.append(os.path.join(out_dir, f"{truth['name']}.json"))
+    return paths
+
+def rasterize(truth):
+    """Page raster of a corpus drawing, redrawn from its ground truth (pixel for pixel the PNG of a PNG drawing)."""
+    drawing, _ = build_drawing(truth["seed"], truth["index"], truth)
+    return render_raster(drawing, truth["dpi"] or REFERENCE_DPI)
+
 if __name__ == "__main__":
-    create_test_drawing()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory to write a synthetic corpus to (default: the calibration drawing only)")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start", type=int, default=1, help="Index of the first drawing, to extend a corpus")
+    parser.add_argument("--format", choices=["pdf", "png", "mixed"], default="pdf")
+    parser.add_argument("--sheets", default=",".join(SHEETS), help="Sheet sizes to choose from")
+    parser.add_argument("--dpi", default=",".join(str(dpi) for dpi in DPIS), help="Raster DPIs to choose from (PNGs and scanned PDFs)")
+    args = parser.parse_args()
+
+    if args.corpus:
+        paths = generate_corpus(args.corpus, args.count, args.seed, args.format,
+                                args.sheets.split(","), [int(dpi) for dpi in args.dpi.split(",")], args.start)
+        features = sum(len(json.load(open(path, encoding="utf-8"))["features"]) for path in paths)
+        print(f"Created {len(paths)} drawings with {features} ground-truth features in {args.corpus}")
+    else:
+        create_test_drawing()